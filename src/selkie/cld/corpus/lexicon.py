@@ -711,16 +711,18 @@ class Lexicon (File):
     #   by similarity.
     #   @arg minsim The cutoff for acceptable similarity.
     #   @arg exclude_self True by default.
+    #   @arg k If provided, the maximum number of glosses to return.
+    #   @arg threshold The minimum Dice coefficient.
 
-    def similar_glosses (self, gloss, minsim=3, exclude_self=True):
+    def similar_glosses (self, gloss, minsim=3, exclude_self=True, k=None, threshold=0.0):
         self.require_load()
-        return self._indices.similar_glosses(gloss, minsim, exclude_self)
+        return self._indices.similar_glosses(gloss, minsim, exclude_self, k, threshold)
 
     ##  Returns a list of forms similar to the given one, sorted by similarity.
 
-    def similar_forms (self, form, minsim=3, exclude_self=True):
+    def similar_forms (self, form, minsim=3, exclude_self=True, k=None, threshold=0.0):
         self.require_load()
-        return self._indices.similar_forms(form, minsim, exclude_self)
+        return self._indices.similar_forms(form, minsim, exclude_self, k, threshold)
 
     ##  Returns a list of lexical entries whose form or gloss is similar to
     #   the given form and gloss.
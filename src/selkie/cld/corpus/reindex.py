@@ -0,0 +1,111 @@
+##  @package seal.cld.corpus.reindex
+#   Rebuilding the lexicon's reference lists in parallel.
+#
+#   The reference lists (<tt>_parids</tt> of LexicalEntry) record the
+#   paragraphs in which each lexid occurs, and they are what
+#   concordances are built from.  They are normally maintained
+#   incrementally as texts are edited.  To rebuild them from scratch,
+#   the token files are read and counted in a pool of worker
+#   processes, one text at a time.  Each worker returns a sorted
+#   partial index for its text; the partial indices are combined with
+#   a k-way merge, and the lexicon is updated in a single Writer, so
+#   that the new reference lists are committed all at once or not at
+#   all.
+
+import os, time, heapq
+from itertools import groupby
+from multiprocessing import Pool
+from ..db.disk import writer
+from ...pyx.com import IndexStats
+
+
+#--  Workers  ------------------------------------------------------------------
+
+##  Read a token file directly from disk, without consulting the lexicon.
+#   Iterates over (block_id, form, sense) for each lexical token.  See
+#   TokenFile for the file format.
+
+def read_token_file (filename, encoding='utf8'):
+    blockid = None
+    with open(filename, encoding=encoding) as f:
+        for line in f:
+            fields = line.rstrip('\r\n').split('\t')
+            nf = len(fields)
+            if nf == 1:
+                blockid = int(fields[0])
+            elif nf == 4:
+                if blockid is None:
+                    raise Exception('Missing start of seg (ID) line')
+                yield (blockid, fields[0], int(fields[1]))
+
+##  Index a single text.  The argument is (textid, filename, encoding).
+#   Returns (textid, ntokens, partial), where partial is a sorted list of
+#   distinct (form, sense, textid, block_id) tuples.  Runs in a worker
+#   process.
+
+def index_token_file (args):
+    (textid, filename, encoding) = args
+    ntokens = 0
+    refs = set()
+    for (blockid, form, sense) in read_token_file(filename, encoding):
+        ntokens += 1
+        refs.add((form, sense, textid, blockid))
+    return (textid, ntokens, sorted(refs))
+
+##  Merge sorted partial indices.  Iterates over (lexid, parids) in
+#   lexid order.
+
+def merge_partials (partials):
+    merged = heapq.merge(*partials)
+    for (key, group) in groupby(merged, lambda r: (r[0], r[1])):
+        yield (key, [(r[2], r[3]) for r in group])
+
+
+#--  reindex  ------------------------------------------------------------------
+
+##  The token files of a language: (textid, filename, encoding) for each
+#   text that has a source text on disk.
+
+def token_files (lang):
+    for text in lang.all_texts():
+        src = text.sourcetext()
+        if src is not None and src.exists():
+            yield (src.textid(), src._contents_filename(), src.encoding)
+
+##  Rebuild the reference lists of the language's lexicon from its token
+#   files.  Reads the files from disk, so it should not be called while
+#   texts are being modified.  <i>Processes</i> is the number of worker
+#   processes; None means one per CPU, and 1 means to do everything in
+#   the calling process.  Returns an IndexStats.
+
+def reindex (lang, processes=None):
+    start = time.time()
+    if processes is None:
+        processes = os.cpu_count() or 1
+    files = list(token_files(lang))
+
+    if processes == 1 or len(files) < 2:
+        results = [index_token_file(f) for f in files]
+    else:
+        chunksize = max(1, len(files) // (4 * processes))
+        with Pool(processes) as pool:
+            results = pool.map(index_token_file, files, chunksize)
+
+    ntokens = sum(n for (_, n, _) in results)
+    lex = lang.lexicon
+    nentries = 0
+    with writer(lex):
+        seen = set()
+        for (key, parids) in merge_partials([partial for (_, _, partial) in results]):
+            ent = lex._intern(key)
+            if sorted(ent._parids) != parids:
+                ent._parids = parids
+                lex.modified()
+            seen.add(ent.index())
+            nentries += 1
+        for ent in lex.entries():
+            if ent._parids and ent.index() not in seen:
+                ent._parids = []
+                lex.modified()
+
+    return IndexStats(len(files), ntokens, time.time() - start, processes, nentries)
@@ -1,6 +1,12 @@
 ##  @package seal.cld.corpus.sim
 #   Implements the similarity functions used by the Lexicon.
 
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from heapq import nsmallest
+from itertools import chain
+
 ##  Iterates over the skip 4-grams of the string.  For each position
 #   in the string, four 4-grams are yielded: the next four characters,
 #   the next three plus the fifth, the next two plus the fourth and fifth,
@@ -14,65 +20,159 @@ def tuples (s):
     yield s[-4:]
 
 
-##  An index mapping a skip 4-gram to a list of words containing that
-#   4-gram.
+##  An index mapping a skip 4-gram to the words containing that 4-gram.
+#   Words are interned to integer ids, and the postings for a 4-gram are
+#   a sorted array of ids.  Since ids are assigned in increasing order,
+#   adding a word appends to the postings; deleting one removes its id by
+#   binary search.  A word is indexed at most once.
+#
+#   The id of a deleted word is not reused right away, since a new word
+#   must have the largest id.  Instead, when more than half the ids belong
+#   to deleted words, the ids are renumbered (see compact()).
 
 class Index (object):
 
     ##  Constructor.
 
     def __init__ (self, table=None):
+
+        ##  Maps 4-grams to sorted arrays of ids.
         self._index = {}
+
+        ##  Maps words to ids.
+        self._ids = {}
+
+        ##  Words, by id.  The entry for a deleted word is None.
+        self._words = []
+
+        ##  Number of distinct 4-grams in each word, by id.
+        self._sizes = array('I')
+
+        ##  Number of deleted words whose ids have not been reclaimed.
+        self.ndeleted = 0
+
         if table:
             for key in table:
                 self.add_key(key)
 
     ##  Fetch the words containing the given 4-tuple.
 
-    def __getitem__ (self, key): return self._index.__getitem__(key)
+    def __getitem__ (self, key):
+        words = self._words
+        return [words[i] for i in self._index[key]]
 
     ##  Fetch, but return None on failure.
 
-    def get (self, key): return self._index.get(key)
+    def get (self, key):
+        if key in self._index: return self[key]
+
+    ##  The number of words in the index.
+
+    def __len__ (self):
+        return len(self._ids)
 
-    ##  Index a new word.
+    ##  Whether the word is in the index.
+
+    def __contains__ (self, key):
+        return key in self._ids
+
+    ##  Index a new word.  Words shorter than three characters are not
+    #   indexed.
 
     def add_key (self, key):
+        if len(key) < 3 or key in self._ids: return
         index = self._index
-        if len(key) >= 3:
-            for t in set(tuples(key)):
-                if t in index: index[t].append(key)
-                else: index[t] = [key]
-            
+        i = len(self._words)
+        self._ids[key] = i
+        self._words.append(key)
+        grams = set(tuples(key))
+        self._sizes.append(len(grams))
+        for t in grams:
+            if t in index: index[t].append(i)
+            else: index[t] = array('I', [i])
+
     ##  Delete a word from the index.  Affects the entries for all
     #   4-grams that it contains.
 
     def delete_key (self, key):
+        i = self._ids.pop(key, None)
+        if i is None: return
+        index = self._index
+        self._words[i] = None
+        self._sizes[i] = 0
+        self.ndeleted += 1
+        for t in set(tuples(key)):
+            lst = index.get(t)
+            if lst is None: continue
+            j = bisect_left(lst, i)
+            if j < len(lst) and lst[j] == i:
+                if len(lst) == 1: del index[t]
+                else: del lst[j]
+        if 2 * self.ndeleted > len(self._words):
+            self.compact()
+
+    ##  Renumber the words so that the ids run from 0 to the number of
+    #   words, in the same order, reclaiming the ids of deleted words.
+    #   Since the order is preserved, the postings stay sorted.
+
+    def compact (self):
+        if not self.ndeleted: return
+        remap = array('I', [0]) * len(self._words)
+        words = []
+        sizes = array('I')
+        for (i, word) in enumerate(self._words):
+            if word is not None:
+                remap[i] = len(words)
+                words.append(word)
+                sizes.append(self._sizes[i])
+        for (t, lst) in self._index.items():
+            self._index[t] = array('I', [remap[i] for i in lst])
+        self._words = words
+        self._sizes = sizes
+        self._ids = dict((word, i) for (i, word) in enumerate(words))
+        self.ndeleted = 0
+
+    ##  Returns a Counter mapping ids to the number of 4-grams that the
+    #   word shares with key, and the number of distinct 4-grams in key.
+
+    def _counts (self, key):
         index = self._index
-        if len(key) >= 3:
-            for t in set(tuples(key)):
-                if t in index:
-                    try:
-                        lst = index[t]
-                        i = lst.index(key)
-                        if len(lst) == 1: del index[t]
-                        else: del lst[i]
-                    except:
-                        pass
+        grams = set(tuples(key))
+        postings = [index[t] for t in grams if t in index]
+        return (Counter(chain.from_iterable(postings)), len(grams))
 
     ##  Computes a table containing all words that share any 4-grams
-    #   with the given word.  The keys are ints n, and the values
-    #   are words that share exactly n 4-grams with the given word.
+    #   with the given word.  The keys are words, and the values are the
+    #   number of 4-grams they share with the given word.
 
     def similarity_table (self, key):
-        tab = {}
-        index = self._index
-        for t in set(tuples(key)):
-            if t in index:
-                for form in index[t]:
-                    if form in tab: tab[form] += 1
-                    else: tab[form] = 1
-        return tab
+        words = self._words
+        (counts, n) = self._counts(key)
+        return dict((words[i], c) for (i, c) in counts.items())
+
+    ##  Returns a list of (similarity, word) pairs, sorted with the most
+    #   similar first, and ties broken by word.  The similarity is the
+    #   Dice coefficient of the sets of 4-grams: twice the number shared,
+    #   divided by the total.  Only words sharing at least minsim 4-grams
+    #   with key and with similarity at least threshold are included.  If
+    #   k is given, at most k pairs are returned.  Words in exclude are
+    #   omitted.
+
+    def similar (self, key, k=None, threshold=0.0, minsim=1, exclude=()):
+        words = self._words
+        sizes = self._sizes
+        (counts, n) = self._counts(key)
+        out = []
+        for (i, c) in counts.items():
+            if c < minsim: continue
+            sim = 2 * c / (n + sizes[i])
+            if sim >= threshold and words[i] not in exclude:
+                out.append((-sim, words[i]))
+        if k is not None and k < len(out):
+            out = nsmallest(k, out)
+        else:
+            out.sort()
+        return [(-negsim, word) for (negsim, word) in out]
 
 
 ##  A set of indices for a lexicon.
@@ -143,21 +243,20 @@ class LexicalIndices (object):
     def lexents_by_gloss (self, gloss):
         return self.gloss_lexents.get(gloss)
 
-    ##  Fetch glosses that are similar to the given one.
+    ##  Fetch glosses that are similar to the given one, most similar
+    #   first.  Similarity is as for Index.similar().
 
-    def similar_glosses (self, gloss, minsim=3, exclude_self=True):
+    def similar_glosses (self, gloss, minsim=3, exclude_self=True, k=None, threshold=0.0):
         assert gloss
-        tab = self.gloss_index.similarity_table(gloss)
-        return sorted(g for (g,v) in tab.items()
-                      if v >= minsim and not (exclude_self and g == gloss))
+        exclude = (gloss,) if exclude_self else ()
+        return [g for (sim, g) in self.gloss_index.similar(gloss, k, threshold, minsim, exclude)]
 
-    ##  Fetch forms that are similar to the given one.
+    ##  Fetch forms that are similar to the given one, most similar first.
 
-    def similar_forms (self, form, minsim=3, exclude_self=True):
+    def similar_forms (self, form, minsim=3, exclude_self=True, k=None, threshold=0.0):
         assert form
-        tab = self.form_index.similarity_table(form)
-        return sorted(f for (f,v) in tab.items()
-                      if v >= minsim and not (exclude_self and f == form))
+        exclude = (form,) if exclude_self else ()
+        return [f for (sim, f) in self.form_index.similar(form, k, threshold, minsim, exclude)]
 
     ##  Fetch lexical entries that have either a form or gloss that is
     #   similar to the given form and gloss.
@@ -6,7 +6,7 @@ from ..seal import io
 from ..seal.io import redirect
 
 from ...nlp.fsa import NFsa, SimpleFsa, Fsa as BaseFsa
-from ...nlp.fst import Fst
+from ...nlp.fst import Fst, LazyComposition
 from ...nlp.grammar import Grammar
 from ...nlp.parser import Parser, print_fragments, print_nodes, TooManyParses
 from ...nlp.features import Category, atomset, intern_variable
@@ -126,6 +126,7 @@ class Environment (object):
             'isstring': Function(isstring, 1),
             'L': Function(as_language, 1),
             'lang': Function(list_language, 1, 2, envarg=True),
+            'lazy_compose': Function(lazy_compose, 2, Unlimited),
             'lt': Function(less_than, 2),
             'makecat': Function(makecat, 1, Unlimited),
             'makelexent': Function(makelexent, 2, eval=[False], envarg=True),
@@ -741,19 +742,31 @@ class Fsa (object):
             return self._call1(sent, trace, env)
 
     def _call1 (self, sent, trace, env):
-        if isinstance(self.fsa, Fst):
+        if isinstance(self.fsa, (Fst, LazyComposition)):
             out = []
             T = Set
             if isinstance(sent, (Set, Corpus)):
                 T = sent.__class__
                 for s in sent:
-                    out.extend(self.fsa(s, trace=trace, cutoff=1000))
+                    out.extend(self._transduce(s, trace))
             else:
-                out.extend(self.fsa(sent, trace=trace, cutoff=1000))
+                out.extend(self._transduce(sent, trace))
             return T(String(s) for s in out)
         else:
             return self.fsa.accepts(sent, trace=trace)
 
+    # Tracing requires the depth-first search, which prints the computation.
+    # Otherwise, the lattice-based transduction is used, which does not
+    # re-explore states, so only the number of distinct outputs is limited.
+
+    def _transduce (self, sent, trace, cutoff=1000):
+        if trace:
+            return self.fsa(sent, trace=trace, cutoff=cutoff)
+        out = list(self.fsa.transduce(sent, nbest=cutoff+1))
+        if len(out) > cutoff:
+            raise EvalError('More than %d outputs, possible loop' % cutoff)
+        return out
+
     ##  Returns the computation, as a string.
 
     def computation (self, sent):
@@ -767,12 +780,16 @@ class Fsa (object):
         # self.fsa.dump(output)
         self._show1(output)
 
+    # A LazyComposition is expanded into an Fst for display.
+
     def _show1 (self, output):
-        if isinstance(self.fsa, Fst): s = 'FST:'
+        fsa = self.fsa
+        if isinstance(fsa, LazyComposition): fsa = fsa.expand()
+        if isinstance(fsa, Fst): s = 'FST:'
         else: s = 'FSA:'
         print(s, file=output)
-        start = self.fsa.start
-        for e in self.fsa.edges():
+        start = fsa.start
+        for e in fsa.edges():
 
             # '->' before start state
             if first and e.source == start: s = '->'
@@ -783,7 +800,7 @@ class Fsa (object):
             else: f = ''
 
             # label(s)
-            if isinstance(self.fsa, Fst):
+            if isinstance(fsa, Fst):
                 if e.inlabel is None: ilab = '_e_'
                 else: ilab = e.inlabel
                 if e.outlabel is None: olab = '_e_'
@@ -809,6 +826,8 @@ class Fsa (object):
     ##  String representation.
 
     def __repr__ (self):
+        if isinstance(self.fsa, LazyComposition):
+            return '(A lazy composition of %d FSTs)' % len(self.fsa.fsts)
         if isinstance(self.fsa, Fst): s = 'FST'
         else: s = 'FSA'
         return '(An %s containing %d states)' % (s, len(self.fsa.states))
@@ -1314,6 +1333,14 @@ def compose (*rels, env=None):
             f = seal.nlp.fsa.compose(f, g, trace)
         return Fsa(f)
 
+# [lazy_compose]  ----------------------
+
+##  The implementation of 'lazy_compose'.  Like compose, but the result
+#   wraps a LazyComposition, which expands states only as inputs reach them.
+
+def lazy_compose (*rels):
+    return Fsa(LazyComposition(*[as_fst(rel) for rel in rels]))
+
 # [concat] [OP .] concat  --------------
 
 ##  True if x is a String or Symbol, or has a method 'concat'.
@@ -2,6 +2,7 @@
 import time, math, os, sys, pathlib
 from os import listdir, walk
 from os.path import join, exists, expanduser
+from array import array
 from io import StringIO
 from collections import OrderedDict
 from collections.abc import Sequence
@@ -12,10 +13,12 @@ from ..pyx.seq import LazyList
 from ..pyx.object import ListProxy, MapProxy
 from ..pyx.formats import File, BaseFile, Dicts, PLists, Records, ObjectTables
 #from ..pyx.formats import Nested, NestedDict,
-from ..pyx.com import Main
+from ..pyx.com import Main, IndexStats
 from ..pyx.disk import VDisk
 from ..editor.webserver import Backend
 from .drill import Drill
+from .postings import PostingsFile, write_postings, content_hash, \
+    text_postings, map_texts
 
 # corpus          Corpus
 #   langs         LanguageTable
@@ -432,8 +435,11 @@ class Language (object):
         for loc in locs:
             yield self.deref_loc(loc)
 
-    def clear_index (self):
-        self.index.clear()
+    def clear_index (self, textid=None):
+        if textid is None:
+            self.index.clear()
+        else:
+            self.index.text_modified(textid)
 
     def __str__ (self):
         return str(self._toc)
@@ -528,6 +534,7 @@ class Toc (Item):
         table = self._table()
         del table[textid]
         self.modified()
+        self._lang.clear_index(textid)
         del self.text_table()[textid]
 
     def _toc_entry (self, obj):
@@ -1006,7 +1013,7 @@ class SentenceList (Item, Sequence):
         
     def modified (self):
         Item.modified(self)
-        self.language().clear_index()
+        self.language().clear_index(self._text.textid())
 
 
 class Sentence (ListProxy):
@@ -1435,55 +1442,181 @@ class Lexicon (Item):
 
 class TokenIndex (Item):
 
-    class TokenDicts (Dicts):
-        @classmethod
-        def parse_value (self, value):
-            return set(Loc.from_string(loc) for loc in value.split())
-        @classmethod
-        def unparse_value (self, value):
-            return ' '.join(str(loc) for loc in value)
-
-    format = TokenDicts
+    # The index is kept as per-text postings in a binary file (see
+    # postings.py).  It is brought up to date lazily: on first access,
+    # and after texts have been modified, only texts whose content hash
+    # differs from the stored one are re-tokenized.  As long as nothing
+    # has changed, lookups read directly from the memory-mapped file.
 
     def __init__ (self, corpus, name, lang):
         Item.__init__(self, corpus, name)
         self._lang = lang
+        self._mapped = None
+        self._forms = None
+        self._text_forms = None
+        self._hashes = None
+        self._verified = set()
+        self._dirty = set()
+        self._stale = True
 
     def clear (self):
-        lst = self.contents()
-        if lst:
-            lst.clear()
+        self._close()
+        self._forms = {}
+        self._text_forms = {}
+        self._hashes = {}
+        self._verified.clear()
+        self._dirty.clear()
+        self._stale = True
+
+    def text_modified (self, textid):
+        self._dirty.add(textid)
+        self._stale = True
+
+    def _close (self):
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+
+    def _load (self):
+        self._mapped = PostingsFile.open(self.filename())
+        if self._mapped is None:
+            self._forms = {}
+            self._text_forms = {}
+            self._hashes = {}
+        else:
+            self._hashes = dict(self._mapped.hashes())
+
+    def _materialize (self):
+        if self._forms is None:
+            self._forms = self._mapped.materialize()
+            self._text_forms = {t: set() for t in self._hashes}
+            for (form, entries) in self._forms.items():
+                for t in entries:
+                    self._text_forms[t].add(form)
+            self._close()
+
+    def _refresh (self):
+        if self._hashes is None:
+            self._load()
+        texts = {txt.textid(): txt for txt in self._lang.get_simple_texts()}
+        changed = []
+        for (textid, txt) in texts.items():
+            if textid in self._verified and textid not in self._dirty:
+                continue
+            h = content_hash(txt.sentences().filename())
+            if textid in self._dirty or self._hashes.get(textid) != h:
+                changed.append((textid, txt, h))
+            self._verified.add(textid)
+        removed = [t for t in self._hashes if t not in texts]
+        if changed or removed:
+            self._materialize()
+            for textid in removed:
+                self._drop(textid)
+            for (textid, txt, h) in changed:
+                self._drop(textid)
+                self._add(textid, txt, h)
             self.modified()
-
-    def _rebuild (self):
-        if self.debug: print('[REBUILD-INDEX]')
-        table = {}
-        for txt in self._lang.get_simple_texts():
-            for token in txt.tokens():
-                if token in table:
-                    table[token].add(token.loc())
-                else:
-                    table[token] = set([token.loc()])
-        lst = self.contents()
-        if lst: lst.clear()
-        lst.append(table)
+        self._dirty.clear()
+        self._stale = False
+
+    def _drop (self, textid):
+        for form in self._text_forms.pop(textid, ()):
+            entries = self._forms[form]
+            del entries[textid]
+            if not entries:
+                del self._forms[form]
+        self._hashes.pop(textid, None)
+
+    def _add (self, textid, txt, h):
+        if self.debug: print('[INDEX]', textid)
+        postings = {}
+        for token in txt.tokens():
+            loc = token.loc()
+            key = str(token)
+            positions = postings.get(key)
+            if positions is None:
+                positions = postings[key] = array('I')
+            positions.append(loc.s())
+            positions.append(loc.w())
+        self._install(textid, postings, h)
+
+    def _install (self, textid, postings, h):
+        for (form, positions) in postings.items():
+            if form in self._forms:
+                self._forms[form][textid] = positions
+            else:
+                self._forms[form] = {textid: positions}
+        self._text_forms[textid] = set(postings)
+        self._hashes[textid] = h
+
+    # Re-indexes every simple text from its file on disk, tokenizing
+    # the texts in a pool of worker processes.  Returns an IndexStats.
+
+    def rebuild (self, processes=None):
+        start = time.time()
+        self.clear()
+        texts = [(txt.textid(), txt.sentences().filename())
+                 for txt in self._lang.get_simple_texts()]
+        results = map_texts(text_postings, [fn for (_, fn) in texts], processes)
+        ntokens = 0
+        for ((textid, _), (postings, n, h)) in zip(texts, results):
+            self._install(textid, postings, h)
+            ntokens += n
+        self._verified.update(textid for (textid, _) in texts)
+        self._stale = False
         self.modified()
+        return IndexStats(len(texts), ntokens, time.time() - start, processes)
 
-    def _table (self):
-        lst = self.contents()
-        if not lst: self._rebuild()
-        return lst[0]
+    def _save (self):
+        if self._forms is not None:
+            if self.debug: print('[WRITE]', self._item_name)
+            write_postings(self.filename(), self._hashes, self._forms)
+
+    def postings (self, form):
+        if self._stale: self._refresh()
+        if self._forms is None:
+            return self._mapped.postings(form)
+        else:
+            entries = self._forms.get(form)
+            if entries is None:
+                return []
+            return sorted(entries.items())
+
+    def __contains__ (self, form):
+        if self._stale: self._refresh()
+        if self._forms is None:
+            return form in self._mapped
+        else:
+            return form in self._forms
+
+    def __iter__ (self):
+        if self._stale: self._refresh()
+        if self._forms is None:
+            return iter(self._mapped)
+        else:
+            return iter(self._forms)
+
+    def __len__ (self):
+        if self._stale: self._refresh()
+        if self._forms is None:
+            return len(self._mapped)
+        else:
+            return len(self._forms)
+
+    def count (self, form):
+        return sum(len(positions) // 2 for (_, positions) in self.postings(form))
 
     def __getitem__ (self, form):
-        table = self._table()
-        return table[form]
+        if form not in self:
+            raise KeyError(form)
+        return self.get(form)
 
     def get (self, form):
-        table = self._table()
-        if form in table:
-            return table[form]
-        else:
-            return set()
+        out = set()
+        for (textid, positions) in self.postings(form):
+            for j in range(0, len(positions), 2):
+                out.add(Loc(textid, positions[j], positions[j+1]))
+        return out
 
 # 
 # #--  Concordance  --------------------------------------------------------------
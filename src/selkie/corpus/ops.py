@@ -1,11 +1,27 @@
 
 def concordance (lang, form, recurse=True):
-    form = lang.lexicon[form]
-    for token in form.tokens():
-        sent = token.sentence()
-        i = token.sentence_index()
-        lc = ' '.join(sent[:i])
-        rc = ' '.join(sent[i+1:])
-        rest = token + '  ' + rc
-        print(f'{lc:>35}'[-35:], '', rest[:45])
+    if recurse:
+        forms = lang.lexicon[form].partof(closure=True)
+    else:
+        forms = [form]
 
+    # Locations come straight from the token index, grouped by text, so
+    # that each text's sentences are fetched only once.
+    bytext = {}
+    for f in forms:
+        for (textid, positions) in lang.index.postings(f):
+            locs = bytext.setdefault(textid, [])
+            for j in range(0, len(positions), 2):
+                locs.append((positions[j], positions[j+1]))
+
+    # Texts are visited in the corpus's own (TOC) order.  Text IDs are
+    # strings, so sorting them would put '10' before '2'.
+    for textid in [t for t in lang.txt if t in bytext]:
+        sents = lang.txt[textid].sentences()
+        for (s, w) in sorted(bytext[textid]):
+            sent = sents[s-1]
+            i = w - 1
+            lc = ' '.join(sent[:i])
+            rc = ' '.join(sent[i+1:])
+            rest = sent[i] + '  ' + rc
+            print(f'{lc:>35}'[-35:], '', rest[:45])
@@ -0,0 +1,269 @@
+
+# Binary postings file for the token index.
+#
+# The file consists of a header, a form directory, and the postings
+# themselves:
+#
+#   magic       b'SLKTIX1\n'
+#   ntexts      varint
+#   texts       ntexts x (textid: string, content hash: 16 bytes)
+#   nforms      varint
+#   directory   nforms x (form: string, nbytes: varint)
+#   postings    one block of nbytes bytes for each form, in directory order
+#
+# Integers are unsigned LEB128 varints and strings are a varint byte
+# length followed by UTF-8.  A form's block is a varint count of
+# texts, followed by one entry per text: the text's ordinal in the
+# text table (delta-coded against the previous entry), a varint count
+# of locations, and the locations in order.  A location is a pair
+# (sentence, word), both 1-based; the sentence is coded as a delta
+# against the previous location, and the word is coded as a delta
+# when the sentence is unchanged and as an absolute value otherwise.
+#
+# Positions are held in memory as array('I') with sentence and word
+# numbers interleaved: [s1, w1, s2, w2, ...].
+
+import os, mmap, hashlib
+from io import StringIO
+from array import array
+from multiprocessing import Pool
+from ..pyx.formats import PLists
+
+MAGIC = b'SLKTIX1\n'
+HASH_SIZE = 16
+
+
+def content_hash (filename):
+    h = hashlib.blake2b(digest_size=HASH_SIZE)
+    if os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                h.update(chunk)
+    return h.digest()
+
+
+#--  Indexing  -----------------------------------------------------------------
+
+# Reads a simple text (a SentenceList file) and returns (postings,
+# ntokens, content hash), where postings maps each form to its
+# positions.  The file is read only once, for both the hash and the
+# tokens.  Numbering follows Sentence: sentences and words are 1-based,
+# and words are counted across all 'w' entries of a sentence.
+# Runs in a worker process, hence a module-level function.
+
+def text_postings (filename):
+    data = b''
+    if os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+    h = hashlib.blake2b(data, digest_size=HASH_SIZE).digest()
+    postings = {}
+    ntokens = 0
+    for (sno, plist) in enumerate(PLists.from_lines(StringIO(data.decode('utf8'))), 1):
+        wno = 0
+        for (key, value) in plist:
+            if key == 'w':
+                for form in value.split():
+                    wno += 1
+                    positions = postings.get(form)
+                    if positions is None:
+                        positions = postings[form] = array('I')
+                    positions.append(sno)
+                    positions.append(wno)
+        ntokens += wno
+    return (postings, ntokens, h)
+
+# Applies fn to each of the items in a pool of worker processes,
+# returning the results in order.  With processes=1, or a single item,
+# no pool is created.  processes=None means one per CPU.
+
+def map_texts (fn, items, processes=None):
+    items = list(items)
+    if processes == 1 or len(items) < 2:
+        return [fn(item) for item in items]
+    chunksize = max(1, len(items) // (4 * (processes or os.cpu_count())))
+    with Pool(processes) as pool:
+        return pool.map(fn, items, chunksize)
+
+
+#--  Encoding  -----------------------------------------------------------------
+
+def put_varint (buf, n):
+    while n >= 0x80:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+def get_varint (data, i):
+    n = 0
+    shift = 0
+    while True:
+        b = data[i]
+        i += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return (n, i)
+        shift += 7
+
+def put_string (buf, s):
+    b = s.encode('utf8')
+    put_varint(buf, len(b))
+    buf.extend(b)
+
+def get_string (data, i):
+    (n, i) = get_varint(data, i)
+    return (bytes(data[i:i+n]).decode('utf8'), i+n)
+
+def put_positions (buf, positions):
+    put_varint(buf, len(positions) // 2)
+    ps = pw = 0
+    for j in range(0, len(positions), 2):
+        s = positions[j]
+        w = positions[j+1]
+        put_varint(buf, s - ps)
+        put_varint(buf, w - pw if s == ps else w)
+        ps = s
+        pw = w
+
+def get_positions (data, i):
+    (n, i) = get_varint(data, i)
+    out = array('I')
+    s = w = 0
+    for _ in range(n):
+        (ds, i) = get_varint(data, i)
+        (x, i) = get_varint(data, i)
+        if ds:
+            s += ds
+            w = x
+        else:
+            w += x
+        out.append(s)
+        out.append(w)
+    return (out, i)
+
+
+#--  Writing  ------------------------------------------------------------------
+
+# hashes: textid -> content hash; forms: form -> {textid: positions}
+# The file is written to a temporary and renamed into place, so that a
+# reader never sees a partial index.
+
+def write_postings (filename, hashes, forms):
+    textids = sorted(hashes)
+    ordinal = {t: i for (i, t) in enumerate(textids)}
+
+    head = bytearray(MAGIC)
+    put_varint(head, len(textids))
+    for t in textids:
+        put_string(head, t)
+        head.extend(hashes[t])
+
+    formlist = sorted(forms)
+    put_varint(head, len(formlist))
+    body = bytearray()
+    for form in formlist:
+        start = len(body)
+        entries = forms[form]
+        put_varint(body, len(entries))
+        prev = 0
+        for t in sorted(entries, key=ordinal.__getitem__):
+            k = ordinal[t]
+            put_varint(body, k - prev)
+            prev = k
+            put_positions(body, entries[t])
+        put_string(head, form)
+        put_varint(head, len(body) - start)
+
+    tmpfn = filename + '.tmp'
+    with open(tmpfn, 'wb') as f:
+        f.write(head)
+        f.write(body)
+    os.replace(tmpfn, filename)
+
+
+#--  Reading  ------------------------------------------------------------------
+
+class PostingsFile (object):
+
+    # Returns None if the file does not exist or is not a postings
+    # file (for example, an index written in the old text format).
+
+    @staticmethod
+    def open (filename):
+        if not os.path.exists(filename) or os.path.getsize(filename) < len(MAGIC):
+            return None
+        f = open(filename, 'rb')
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if data[:len(MAGIC)] != MAGIC:
+            data.close()
+            f.close()
+            return None
+        return PostingsFile(f, data)
+
+    def __init__ (self, f, data):
+        self._file = f
+        self._data = data
+        self._textids = []
+        self._hashes = {}
+        self._directory = {}
+
+        i = len(MAGIC)
+        (ntexts, i) = get_varint(data, i)
+        for _ in range(ntexts):
+            (t, i) = get_string(data, i)
+            self._textids.append(t)
+            self._hashes[t] = data[i:i+HASH_SIZE]
+            i += HASH_SIZE
+        (nforms, i) = get_varint(data, i)
+        sizes = []
+        for _ in range(nforms):
+            (form, i) = get_string(data, i)
+            (n, i) = get_varint(data, i)
+            sizes.append((form, n))
+        for (form, n) in sizes:
+            self._directory[form] = i
+            i += n
+
+    def hashes (self):
+        return self._hashes
+
+    def __contains__ (self, form):
+        return form in self._directory
+
+    def __iter__ (self):
+        return iter(self._directory)
+
+    def __len__ (self):
+        return len(self._directory)
+
+    # Returns a list of (textid, positions) pairs, in textid order.
+
+    def postings (self, form):
+        i = self._directory.get(form)
+        if i is None:
+            return []
+        return self._read(i)
+
+    def _read (self, i):
+        data = self._data
+        out = []
+        (n, i) = get_varint(data, i)
+        k = 0
+        for _ in range(n):
+            (dk, i) = get_varint(data, i)
+            k += dk
+            (positions, i) = get_positions(data, i)
+            out.append((self._textids[k], positions))
+        return out
+
+    # Decodes the entire file into form -> {textid: positions}.
+
+    def materialize (self):
+        forms = {}
+        for (form, i) in self._directory.items():
+            forms[form] = dict(self._read(i))
+        return forms
+
+    def close (self):
+        self._data.close()
+        self._file.close()
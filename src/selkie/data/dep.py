@@ -3,7 +3,7 @@
 
 import sys
 from ..cld.seal import io
-from ..cld.seal.config import conll, udt
+from ..cld.seal.config import conll, udt, nowhere
 from ..nlp.dep import conll_sents, umapped_sents, load_umap, apply_umap
 
 
@@ -381,6 +381,12 @@ def ls ():
 
 #--  Catalog  ------------------------------------------------------------------
 
+##  If the data directories are not configured, the catalog is still
+#   loaded, but its filenames lead nowhere.
+
+if conll is None: conll = nowhere
+if udt is None: udt = nowhere
+
 ## orig
 
 register(Dataset(
@@ -0,0 +1,25 @@
+
+% Set sem avs
+
+% Rules
+
+s -> np vp : $2[subj $1]
+np -> name
+np -> det n : $2[spec $1]
+vp -> vi
+vp -> vt np : $1[obj $2]
+vp -> vp adv : $1[mod $2]
+
+% Lexicon
+
+fido name : fido
+rex name : rex
+the det : def
+a det : indef
+dog n : [type dog]
+cat n : [type cat]
+barks vi : [type bark]
+sleeps vi : [type sleep]
+chases vt : [type chase]
+sees vt : [type see]
+loudly adv : loud
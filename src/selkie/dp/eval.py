@@ -1,7 +1,8 @@
 ##  @package seal.nlp.dp.eval
 #   Compute accuracy of the parser.
 
-import unicodedata
+import os, unicodedata, time
+from multiprocessing import Pool
 from ..cld.seal.io import tabular
 
 
@@ -95,22 +96,173 @@ def compare (pred, truth):
 
 ##  Evaluate a parser on a set of sentences.
 #   Calls the parser on each sentence in turn.
-#   Prints a table of statistics.
+#   Prints a table of statistics, including throughput in sentences per
+#   second.  Returns (las, uas, la, n, nsents).
+#
+#   If <i>widths</i> is given, the parser must be a beam parser (it must
+#   have a width attribute), and the evaluation is repeated for each beam
+#   width.  In that case the table has one row per width, giving LAS,
+#   UAS, LA, and sentences per second, and the return value is a list
+#   containing (width, las, uas, la, n, nsents, sents_per_sec) for each
+#   width.  The width of the parser is restored afterwards.
+
+def evaluate (parser, sents, excludepunc=True, output=None, widths=None):
+    if widths:
+        return _evaluate_widths(parser, sents, excludepunc, output, widths)
+    (counts, nsents, secs) = _run(parser, sents, excludepunc)
+    (las, uas, la, n) = counts
+
+    print(tabular([['LAS:', las, n, las/n],
+                              ['UAS:', uas, n, uas/n],
+                              ['LA:', la, n, la/n],
+                              ['NSents:', nsents, '', ''],
+                              ['Sents/sec:', '%.1f' % _rate(nsents, secs), '', '']]),
+          file=output)
+
+    return (las, uas, la, n, nsents)
 
-def evaluate (parser, sents, excludepunc=True, output=None):
+def _run (parser, sents, excludepunc):
     counts = [0, 0, 0, 0]
     nsents = 0
+    secs = 0.0
     for truth in sents:
+        start = time.perf_counter()
         pred = parser(truth)
+        secs += time.perf_counter() - start
         inc = eval_sent(pred, truth, excludepunc)
         nsents += 1
         for i in range(4):
             counts[i] += inc[i]
+    return (counts, nsents, secs)
+
+def _rate (nsents, secs):
+    if secs > 0: return nsents / secs
+    else: return float('inf')
+
+def _evaluate_widths (parser, sents, excludepunc, output, widths):
+    sents = list(sents)
+    saved = parser.width
+    results = []
+    try:
+        for width in widths:
+            parser.width = width
+            ((las, uas, la, n), nsents, secs) = _run(parser, sents, excludepunc)
+            results.append((width, las, uas, la, n, nsents, _rate(nsents, secs)))
+    finally:
+        parser.width = saved
+    _print_widths(results, len(sents), output)
+    return results
+
+def _print_widths (results, nsents, output):
+    rows = [['Width', 'LAS', 'UAS', 'LA', 'Sents/sec']]
+    for (width, las, uas, la, n, _, rate) in results:
+        rows.append([width, '%.4f' % (las/n), '%.4f' % (uas/n), '%.4f' % (la/n),
+                     '%.1f' % rate])
+    print(tabular(rows), file=output)
+    print('NSents:', nsents, file=output)
+
+
+#--  Parallel evaluation  ------------------------------------------------------
+
+##  Evaluate in parallel.  The sentences are divided into shards, one per
+#   worker process, and each worker parses its shard.  <i>Factory</i> is
+#   a function of no arguments that returns a parser; each worker calls
+#   it once, so the model is loaded once per worker, not once per
+#   sentence.  It must be picklable, for example
+#   functools.partial(nivre.Parser, modelfn).  <i>Processes</i> is the
+#   number of workers; None means one per CPU, and 1 means to parse in
+#   the calling process.
+#
+#   The counts from the workers are summed, so the results are exactly
+#   the same as those of evaluate().  Prints the same statistics as
+#   evaluate(), except that sentences per second is overall wall-clock
+#   throughput, including starting the workers and loading the model, and
+#   then a table giving the number of sentences, parsing time, and
+#   throughput of each worker.  Returns (las, uas, la, n, nsents).
+#
+#   If <i>widths</i> is given, the factory must return a beam parser, and
+#   the evaluation is repeated for each width, as in evaluate(), using
+#   the same workers.  The table and the return value are the same as
+#   those of evaluate() with widths, except that sentences per second is
+#   the wall-clock throughput of the workers at that width.
+
+def evaluate_parallel (factory, sents, processes=None, excludepunc=True, output=None,
+                       widths=None):
+    if processes is None:
+        processes = os.cpu_count() or 1
+    sents = list(sents)
+    if widths:
+        return _evaluate_parallel_widths(factory, sents, processes, excludepunc, output,
+                                         widths)
+    nshards = max(1, min(processes, len(sents)))
+    start = time.perf_counter()
+    if processes == 1:
+        parser = factory()
+        results = [(os.getpid(),) + _run(parser, sents, excludepunc)]
+    else:
+        shards = [(sents[i::nshards], excludepunc, None) for i in range(nshards)]
+        with Pool(nshards, initializer=_init_worker, initargs=(factory,)) as pool:
+            results = pool.map(_eval_shard, shards, 1)
+    elapsed = time.perf_counter() - start
+
+    counts = [0, 0, 0, 0]
+    nsents = 0
+    workers = {}
+    for (pid, inc, k, secs) in results:
+        for i in range(4):
+            counts[i] += inc[i]
+        nsents += k
+        if pid in workers:
+            (k0, secs0) = workers[pid]
+            workers[pid] = (k0 + k, secs0 + secs)
+        else:
+            workers[pid] = (k, secs)
     (las, uas, la, n) = counts
 
     print(tabular([['LAS:', las, n, las/n],
-                              ['UAS:', uas, n, uas/n],
-                              ['LA:', la, n, la/n],
-                              ['NSents:', nsents, '', '']]), file=output)
+                   ['UAS:', uas, n, uas/n],
+                   ['LA:', la, n, la/n],
+                   ['NSents:', nsents, '', ''],
+                   ['Sents/sec:', '%.1f' % _rate(nsents, elapsed), '', '']]),
+          file=output)
+    print(file=output)
+    rows = [['Worker', 'NSents', 'Seconds', 'Sents/sec']]
+    for (i, (k, secs)) in enumerate(workers.values(), 1):
+        rows.append([i, k, '%.2f' % secs, '%.1f' % _rate(k, secs)])
+    print(tabular(rows), file=output)
 
     return (las, uas, la, n, nsents)
+
+def _evaluate_parallel_widths (factory, sents, processes, excludepunc, output, widths):
+    if processes == 1:
+        return _evaluate_widths(factory(), sents, excludepunc, output, widths)
+    nshards = max(1, min(processes, len(sents)))
+    results = []
+    with Pool(nshards, initializer=_init_worker, initargs=(factory,)) as pool:
+        for width in widths:
+            shards = [(sents[i::nshards], excludepunc, width) for i in range(nshards)]
+            start = time.perf_counter()
+            counts = [0, 0, 0, 0]
+            nsents = 0
+            for (_, inc, k, _) in pool.map(_eval_shard, shards, 1):
+                for i in range(4):
+                    counts[i] += inc[i]
+                nsents += k
+            rate = _rate(nsents, time.perf_counter() - start)
+            results.append((width,) + tuple(counts) + (nsents, rate))
+    _print_widths(results, len(sents), output)
+    return results
+
+#  The parser of a worker process, created once by _init_worker().
+
+_worker_parser = None
+
+def _init_worker (factory):
+    global _worker_parser
+    _worker_parser = factory()
+
+def _eval_shard (args):
+    (sents, excludepunc, width) = args
+    if width is not None:
+        _worker_parser.width = width
+    return (os.getpid(),) + _run(_worker_parser, sents, excludepunc)
@@ -1,7 +1,9 @@
 ##  @package seal.nlp.dp.features
 #   Features used by the parser.
 
+from zlib import crc32
 from ..cld.seal.io import contents
+from . import parser as _parser
 
 ##  A list of feature functions.
 
@@ -13,15 +15,25 @@ class FunctionList (object):
         for spec in specs:
             assert '=' not in spec
 
-        ##  List of specs.
-        self.specs = [spec.replace(' ', '.') for spec in specs]
+        ##  The words of each spec, as parsed by parse_spec().
+        self.words = [parse_spec(spec) for spec in specs]
+
+        ##  List of specs, in dotted form.
+        self.specs = ['.'.join(words) for words in self.words]
 
         ##  List of functions, one for each spec.
-        self.functions = [_compile1(spec.split()) for spec in specs]
+        self.functions = [_compile1(words) for words in self.words]
 
         ##  Whether to keep null values.
         self.nulls = nulls
-        
+
+        ##  The compiled extractor: a single generated function that
+        #   returns the same list as calling the functions one by one.
+        self.extract = _generate(self.specs, self.words, nulls)
+
+        ##  Batched version of extract.
+        self.extract_batch = _generate(self.specs, self.words, nulls, batch=True)
+
     ##  Call it on a parser configuration.
     #   Each feature function is called to get a value.
     #   If nulls is True, each boolean false value is replaced with 'null';
@@ -29,6 +41,18 @@ class FunctionList (object):
     #   The return is a list of pairs (spec, value).
 
     def __call__ (self, cfg):
+        return self.extract(cfg)
+
+    ##  Call it on a list of configurations.  Returns a list of feature
+    #   lists, one for each configuration.
+
+    def batch (self, cfgs):
+        return self.extract_batch(cfgs)
+
+    ##  The uncompiled version of __call__(): calls the individual feature
+    #   functions.  The result is the same.
+
+    def call_functions (self, cfg):
         values = [f(cfg) for f in self.functions]
         if self.nulls:
             values = [v or 'null' for v in values]
@@ -38,6 +62,75 @@ class FunctionList (object):
                     for pair in zip(self.specs, values)
                     if pair[1]]
 
+    ##  Returns a FeatureEncoder that maps configurations directly to
+    #   sorted lists of integer feature IDs.  <i>Coder</i> supplies the
+    #   IDs of known features; it is a num.Coder or a dict mapping
+    #   (spec, value) pairs to IDs.  If <i>nbits</i> is given, unknown
+    #   features are hashed into 2**nbits IDs above the known ones;
+    #   otherwise they are dropped.
+
+    def encoder (self, coder=None, nbits=None):
+        return FeatureEncoder(self, coder, nbits)
+
+
+##  Maps configurations to integer feature IDs, without constructing
+#   (spec, value) pairs.  Created by FunctionList.encoder().
+
+class FeatureEncoder (object):
+
+    ##  Constructor.
+
+    def __init__ (self, ftrfnc, coder=None, nbits=None):
+        if coder is None:
+            coder = {}
+        elif hasattr(coder, 'features'):
+            coder = coder.features
+        if coder is None:
+            coder = {}
+        tables = [{} for _ in ftrfnc.specs]
+        index = dict((spec, i) for (i, spec) in enumerate(ftrfnc.specs))
+        for ((spec, value), id) in coder.items():
+            if spec in index:
+                tables[index[spec]][value] = id
+
+        ##  The FunctionList.
+        self.ftrfnc = ftrfnc
+
+        ##  Number of bits for hashed features, or None.
+        self.nbits = nbits
+
+        ##  Hashed IDs begin after this value.
+        self.base = max(coder.values(), default=0)
+
+        ##  Number of possible IDs.
+        self.size = self.base + (1 << nbits if nbits else 0)
+
+        ids = (tables, self.base, nbits)
+
+        ##  The compiled encoder.
+        self.extract = _generate(ftrfnc.specs, ftrfnc.words, ftrfnc.nulls, ids=ids)
+
+        ##  Batched version of extract.
+        self.extract_batch = _generate(ftrfnc.specs, ftrfnc.words, ftrfnc.nulls, ids=ids,
+                                       batch=True)
+
+    ##  Call it on a configuration.  Returns a sorted list of feature IDs.
+
+    def __call__ (self, cfg):
+        return self.extract(cfg)
+
+    ##  Call it on a list of configurations.  Returns a list of ID lists.
+
+    def batch (self, cfgs):
+        return self.extract_batch(cfgs)
+
+    ##  The hashed ID of an unknown feature.  This is the computation that
+    #   the compiled encoder inlines.
+
+    def hash (self, spec, value):
+        return self.base + 1 + (crc32(str(value).encode('utf8'), crc32((spec + '=').encode('utf8')))
+                                & ((1 << self.nbits) - 1))
+
 
 ##  Load a file containing specs and call compile() on it.  Returns a FunctionList.
 
@@ -55,6 +148,13 @@ def specs (text):
         if line: specs.append(line)
     return specs
 
+##  Split a single spec into its words.  The words may be separated by
+#   whitespace, as in the text given to compile(), or by dots, as in the
+#   feature names that a FunctionList produces.
+
+def parse_spec (spec):
+    return spec.replace('.', ' ').split()
+
 ##  Compile a list of specs.
 #   The permitted specs are built recursively from the following specs, which
 #   return words:
@@ -121,3 +221,113 @@ def _compile1 (words):
         return lambda cfg: cfg.rs(f(cfg))
     else:
         raise Exception('Unrecognized function:' + repr(op))
+
+
+#--  Code generation  ----------------------------------------------------------
+
+#   The generated code reads the configuration's array directly; see
+#   parser.Configuration for the layout.  Each step reproduces the
+#   corresponding Configuration accessor, including its treatment of
+#   None and of the root (word 0).
+
+_Fields = {'govr': _parser._GOVR,
+           'lc': _parser._LC,
+           'rc': _parser._RC,
+           'ls': _parser._LS,
+           'rs': _parser._RS}
+
+def _emit_spec (words, lines, ind):
+    op = words[0]
+    if op == 'stack':
+        assert len(words) == 2
+        t = int(words[1])
+        if t < 0:
+            lines.append(ind + 'x = None')
+        else:
+            lines.append(ind + 'x = a[d - %d] if %d < d else None' % (t + 1, t))
+    elif op == 'input':
+        assert len(words) == 2
+        t = int(words[1])
+        if t < 0:
+            lines.append(ind + 'x = None')
+        else:
+            lines.append(ind + 'x = p + %d' % t)
+            lines.append(ind + 'if x < 0 or x >= n: x = None')
+    else:
+        _emit_spec(words[1:], lines, ind)
+        if op in _Fields:
+            lines.append(ind + 'if x:')
+            lines.append(ind + '    x = a[%d * n + x]' % _Fields[op])
+            lines.append(ind + '    if x < 0: x = None')
+            lines.append(ind + 'else: x = None')
+        elif op == 'role':
+            lines.append(ind + 'if x:')
+            lines.append(ind + '    x = a[%d * n + x]' % _parser._ROLE)
+            lines.append(ind + '    x = roles[x] if x >= 0 else None')
+            lines.append(ind + 'else: x = None')
+        elif op == 'form':
+            lines.append(ind + 'if x is not None: x = words[x]')
+        elif op in ('lemma', 'morph'):
+            lines.append(ind + 'x = sent.%s(x) if x else None' % op)
+        elif op in ('cpos', 'fpos'):
+            lines.append(ind + 'if x:')
+            lines.append(ind + '    x = sent.cat(x)')
+            lines.append(ind + '    if isinstance(x, tuple): x = x[%d]' % (0 if op == 'cpos' else 1))
+            lines.append(ind + 'else: x = None')
+        else:
+            raise Exception('Unrecognized function:' + repr(op))
+
+#   Generates the function.  If ids is None, it returns (spec, value)
+#   pairs; otherwise ids is (tables, base, nbits) and it returns a
+#   sorted list of feature IDs.  If batch is True, the function takes a
+#   list of configurations and returns a list of results.
+
+def _generate (specs, wordlists, nulls, ids=None, batch=False):
+    env = {'roles': _parser._role_table.roles,
+           'crc32': crc32}
+    if batch:
+        lines = ['def extract (cfgs):',
+                 '    result = []',
+                 '    for cfg in cfgs:']
+        ind = '        '
+    else:
+        lines = ['def extract (cfg):']
+        ind = '    '
+    lines.append(ind + 'a = cfg._a; n = cfg._n; d = cfg.depth; p = cfg.pointer')
+    lines.append(ind + 'words = cfg.words; sent = cfg.sent')
+    lines.append(ind + 'out = []')
+    for (i, (spec, words)) in enumerate(zip(specs, wordlists)):
+        lines.append(ind + '# ' + ' '.join(words))
+        _emit_spec(words, lines, ind)
+        if nulls:
+            lines.append(ind + "if not x: x = 'null'")
+            vind = ind
+        else:
+            lines.append(ind + 'if x:')
+            vind = ind + '    '
+        if ids is None:
+            env['K%d' % i] = spec
+            lines.append(vind + 'out.append((K%d, x))' % i)
+        else:
+            (tables, base, nbits) = ids
+            env['T%d' % i] = tables[i].get
+            lines.append(vind + 'j = T%d(x)' % i)
+            if nbits:
+                env['H%d' % i] = crc32((spec + '=').encode('utf8'))
+                lines.append(vind + 'if j is None: j = %d + (crc32(str(x).encode(\'utf8\'), H%d) & %d)'
+                             % (base + 1, i, (1 << nbits) - 1))
+                lines.append(vind + 'out.append(j)')
+            else:
+                lines.append(vind + 'if j is not None: out.append(j)')
+    if ids is not None:
+        lines.append(ind + 'out.sort()')
+    if batch:
+        lines.append(ind + 'result.append(out)')
+        lines.append('    return result')
+    else:
+        lines.append(ind + 'return out')
+    code = '\n'.join(lines) + '\n'
+    exec(code, env)
+    fnc = env['extract']
+    fnc.source = code
+    return fnc
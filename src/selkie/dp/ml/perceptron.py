@@ -0,0 +1,423 @@
+##  @package seal.ml.perceptron
+#   Multi-class averaged perceptron.
+#
+#   A native alternative to selkie.dp.ml.libsvm, with the same module
+#   interface: train(), load_model(), and accuracy().  It can therefore
+#   be used either directly or as the sublearner of selkie.dp.ml.split.
+#
+#   Features are hashed into 2**nbits IDs, using the same hash as
+#   selkie.dp.features.FeatureEncoder, so no coder is needed and the
+#   parser can compute IDs directly from configurations.  The weights are
+#   stored as a sparse matrix, with one row per feature ID, in a binary
+#   file that is memory-mapped when the model is loaded.
+
+import os, mmap
+from array import array
+from zlib import crc32
+from ...cld.seal import io
+from ...cld.seal.misc import repeatable
+
+
+#--  Features  -----------------------------------------------------------------
+
+##  The ID of a feature.  The feature is an (att, value) pair, or an att
+#   standing alone, which is treated as (att, True).  IDs run from 1 to
+#   2**nbits.
+
+def feature_id (ftr, nbits):
+    if isinstance(ftr, tuple) or isinstance(ftr, list):
+        (att, value) = ftr
+    else:
+        (att, value) = (ftr, True)
+    h = crc32(str(value).encode('utf8'), crc32((att + '=').encode('utf8')))
+    return 1 + (h & ((1 << nbits) - 1))
+
+##  Sorted list of feature IDs for a list of features.
+
+def feature_ids (ftrs, nbits):
+    return sorted(feature_id(ftr, nbits) for ftr in ftrs)
+
+
+#--  Trainer  ------------------------------------------------------------------
+
+##  Trainer.  Each epoch is one pass through the training instances, so
+#   the training instances may be a stream that is regenerated on each
+#   iteration (see selkie.dp.parser.InstanceStream); they are never
+#   written to disk.  A one-shot iterator is read into a list if more
+#   than one epoch is requested.
+
+class Trainer (object):
+
+    ##  Constructor.
+
+    def __init__ (self, nbits=18, epochs=5):
+
+        ##  Number of bits in a feature ID.
+        self.nbits = nbits
+
+        ##  Number of passes through the training data.
+        self.epochs = epochs
+
+        ##  The learning problem.
+        self.problem = None
+
+        ##  List of labels.
+        self.labels = None
+
+        ##  Maps labels to their indices.
+        self.label_index = None
+
+        ##  The current weights: feature ID -> {label index: weight}.
+        self.weights = None
+
+        ##  Accumulated updates, weighted by time, for averaging.
+        self.totals = None
+
+        ##  Number of instances seen, across epochs.
+        self.count = 0
+
+        ##  Number of errors in each epoch.
+        self.errors = None
+
+    ##  Get the index of a label, adding it if necessary.
+
+    def intern_label (self, label):
+        i = self.label_index.get(label)
+        if i is None:
+            i = self.label_index[label] = len(self.labels)
+            self.labels.append(label)
+        return i
+
+    ##  Score the labels.  Returns a list containing one score for each
+    #   label.
+
+    def scores (self, ids):
+        scores = [0.0] * len(self.labels)
+        weights = self.weights
+        for f in ids:
+            row = weights.get(f)
+            if row:
+                for (y, w) in row.items():
+                    scores[y] += w
+        return scores
+
+    ##  Predict a label index.  Ties are broken in favor of the label seen
+    #   first.
+
+    def predict (self, ids):
+        scores = self.scores(ids)
+        return scores.index(max(scores))
+
+    ##  Add delta to the weight of (f, y).
+
+    def _update (self, f, y, delta):
+        row = self.weights.get(f)
+        if row is None:
+            row = self.weights[f] = {}
+            trow = self.totals[f] = {}
+        else:
+            trow = self.totals[f]
+        row[y] = row.get(y, 0.0) + delta
+        trow[y] = trow.get(y, 0.0) + self.count * delta
+
+    ##  Train on one instance.  Returns True if the prediction was correct.
+
+    def learn (self, ids, y):
+        self.count += 1
+        p = self.predict(ids)
+        if p == y:
+            return True
+        for f in ids:
+            self._update(f, y, 1.0)
+            self._update(f, p, -1.0)
+        return False
+
+    ##  The averaged weights, as a dict of dicts.
+
+    def averaged_weights (self):
+        c = self.count
+        out = {}
+        for (f, row) in self.weights.items():
+            trow = self.totals[f]
+            avg = {}
+            for (y, w) in row.items():
+                a = w - trow[y] / c
+                if a:
+                    avg[y] = a
+            if avg:
+                out[f] = avg
+        return out
+
+    ##  Main call.  Trains, saves the model, and if there are test
+    #   instances, saves the accuracy on them in <i>workfn</i>.acc.
+
+    def __call__ (self, prob, output=None):
+        self.problem = prob
+        opts = prob.options or {}
+        if 'nbits' in opts: self.nbits = int(opts['nbits'])
+        if 'epochs' in opts: self.epochs = int(opts['epochs'])
+        self.labels = []
+        self.label_index = {}
+        self.weights = {}
+        self.totals = {}
+        self.count = 0
+        self.errors = []
+
+        train = repeatable(prob.train)
+        if self.epochs > 1 and hasattr(train, '__next__'):
+            train = list(train)
+        for epoch in range(self.epochs):
+            n = errors = 0
+            for inst in train:
+                n += 1
+                y = self.intern_label(inst.label)
+                if not self.learn(feature_ids(inst.ftrs, self.nbits), y):
+                    errors += 1
+            self.errors.append(errors)
+            if output is not None:
+                print('Epoch', epoch + 1, 'errors=', errors, 'ninst=', n, file=output)
+
+        model = self.model()
+        model.save(prob.modelfn)
+        if prob.test:
+            (_, correct, total) = model.test(prob.test)
+            io.save_string('%d\t%d\n' % (correct, total), '%s.acc' % prob.workfn)
+        return model
+
+    ##  Returns a Model containing the averaged weights.
+
+    def model (self):
+        (offsets, values, indices) = _sparse_matrix(self.averaged_weights(), self.nbits)
+        return Model(labels=list(self.labels), nbits=self.nbits,
+                     offsets=offsets, values=values, indices=indices)
+
+
+##  Convert a dict of dicts to compressed sparse rows.  Row f occupies
+#   positions offsets[f] to offsets[f+1] of values and indices.
+
+def _sparse_matrix (weights, nbits):
+    nrows = (1 << nbits) + 1
+    offsets = array('q', [0]) * (nrows + 1)
+    values = array('d')
+    indices = array('i')
+    for f in range(nrows):
+        offsets[f] = len(values)
+        row = weights.get(f)
+        if row:
+            for y in sorted(row):
+                indices.append(y)
+                values.append(row[y])
+    offsets[nrows] = len(values)
+    return (offsets, values, indices)
+
+##  Create and call a Trainer.
+
+def train (problem, output=None):
+    Trainer()(problem, output=output)
+
+
+#--  Model  --------------------------------------------------------------------
+
+##  The model.  The parameters are in two files: <i>prefix</i>.ptron is a
+#   text file containing the number of bits and the labels, and
+#   <i>prefix</i>.weights contains the offsets (int64), values (float64)
+#   and label indices (int32) of the sparse weight matrix, in that order.
+
+class Model (object):
+
+    ##  Constructor.  Either give a filename prefix, or the parameters.
+
+    def __init__ (self, prefix=None, labels=None, nbits=None,
+                  offsets=None, values=None, indices=None):
+
+        ##  Filename prefix.
+        self.prefix = prefix
+
+        ##  List of labels.
+        self.labels = labels
+
+        ##  Number of bits in a feature ID.
+        self.nbits = nbits
+
+        ##  Row offsets.
+        self.offsets = offsets
+
+        ##  Weights.
+        self.values = values
+
+        ##  Label indices of the weights.
+        self.indices = indices
+
+        self._file = None
+        self._map = None
+
+        if prefix is not None:
+            assert labels is None
+            self.load(prefix)
+
+    ##  Load from files, memory-mapping the weights.
+
+    def load (self, prefix):
+        self.prefix = prefix
+        self.labels = []
+        with open('%s.ptron' % prefix) as f:
+            (key, nbits) = next(f).rstrip('\r\n').split('\t')
+            assert key == 'nbits'
+            self.nbits = int(nbits)
+            (key, nweights) = next(f).rstrip('\r\n').split('\t')
+            assert key == 'nweights'
+            nweights = int(nweights)
+            assert next(f) == 'labels\n'
+            for line in f:
+                self.labels.append(line.rstrip('\r\n'))
+        nrows = (1 << self.nbits) + 1
+        self._file = open('%s.weights' % prefix, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        mv = memoryview(self._map)
+        i = 8 * (nrows + 1)
+        j = i + 8 * nweights
+        self.offsets = mv[:i].cast('q')
+        self.values = mv[i:j].cast('d')
+        self.indices = mv[j:j + 4 * nweights].cast('i')
+
+    ##  Save to files.
+
+    def save (self, prefix):
+        with open('%s.ptron' % prefix, 'w') as f:
+            f.write('nbits\t%d\n' % self.nbits)
+            f.write('nweights\t%d\n' % len(self.values))
+            f.write('labels\n')
+            for label in self.labels:
+                if not isinstance(label, str):
+                    raise Exception('Label is not a string: %s' % repr(label))
+                f.write(label)
+                f.write('\n')
+        with open('%s.weights' % prefix, 'wb') as f:
+            f.write(bytes(self.offsets))
+            f.write(bytes(self.values))
+            f.write(bytes(self.indices))
+
+    ##  Release the memory map.
+
+    def close (self):
+        if self._map is not None:
+            self.offsets = self.values = self.indices = None
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+
+    ##  Returns a FeatureEncoder that computes this model's feature IDs
+    #   directly from parser configurations.
+
+    def encoder (self, ftrfnc):
+        return ftrfnc.encoder(nbits=self.nbits)
+
+    ##  Score the labels, given a list of feature IDs.  Returns a list
+    #   containing one score for each label.  This is a sparse dot product:
+    #   only the nonzero weights in the features' rows are visited.
+
+    def scores_ids (self, ids):
+        scores = [0.0] * len(self.labels)
+        offsets = self.offsets
+        values = self.values
+        indices = self.indices
+        for f in ids:
+            for k in range(offsets[f], offsets[f+1]):
+                scores[indices[k]] += values[k]
+        return scores
+
+    ##  Score the labels for each of a list of ID lists.  The lists in a
+    #   batch typically share many features (for example, the
+    #   configurations in a beam all look at the same sentence), so the
+    #   rows of the features common to all of them are visited only once,
+    #   and each list adds only its own remaining rows to a copy of the
+    #   shared scores.
+
+    def scores_ids_batch (self, idlists):
+        if len(idlists) < 2:
+            return [self.scores_ids(ids) for ids in idlists]
+        common = set(idlists[0]).intersection(*idlists[1:])
+        shared = self.scores_ids(sorted(common))
+        offsets = self.offsets
+        values = self.values
+        indices = self.indices
+        out = []
+        for ids in idlists:
+            scores = list(shared)
+            for f in ids:
+                if f not in common:
+                    for k in range(offsets[f], offsets[f+1]):
+                        scores[indices[k]] += values[k]
+            out.append(scores)
+        return out
+
+    ##  Predict a label, given a list of feature IDs.
+
+    def predict_ids (self, ids):
+        scores = self.scores_ids(ids)
+        return self.labels[scores.index(max(scores))]
+
+    ##  Score the labels, given a list of features.
+
+    def scores (self, ftrs):
+        return self.scores_ids(feature_ids(ftrs, self.nbits))
+
+    ##  Call it on a list of features.  Returns the predicted label.
+
+    def __call__ (self, ftrs):
+        return self.predict_ids(feature_ids(ftrs, self.nbits))
+
+    ##  Predict labels for a list of feature lists.
+
+    def predict_batch (self, ftrlists):
+        nbits = self.nbits
+        return [self.predict_ids(feature_ids(ftrs, nbits)) for ftrs in ftrlists]
+
+    ##  Predict labels for a list of ID lists.
+
+    def predict_ids_batch (self, idlists):
+        return [self.predict_ids(ids) for ids in idlists]
+
+    ##  Test on instances.  Returns (accuracy, correct, total).
+
+    def test (self, insts):
+        correct = total = 0
+        for inst in insts:
+            total += 1
+            if self(inst.ftrs) == inst.label:
+                correct += 1
+        if total:
+            return (correct/total, correct, total)
+        else:
+            return (None, 0, 0)
+
+
+##  Whether or not the model files exist.
+
+def model_exists (model_prefix):
+    return (os.path.exists('%s.ptron' % model_prefix) and
+            os.path.exists('%s.weights' % model_prefix))
+
+##  Load a model.
+
+def load_model (prefix):
+    return Model(prefix)
+
+
+#--  accuracy  -----------------------------------------------------------------
+
+##  Compute accuracy on the test instances.  The counts are computed at
+#   training time.  Returns (accuracy, correct, total).
+
+#   If output is given, the result is also printed.
+
+def accuracy (workfn, modelfn=None, output=None):
+    fn = '%s.acc' % workfn
+    (acc, correct, total) = (None, 0, 0)
+    if os.path.exists(fn):
+        (correct, total) = [int(x) for x in io.contents(fn).split()]
+        if total:
+            acc = correct/total
+    if output is not None and output is not io.null:
+        print('acc:', acc, 'correct=', correct, 'ntest=', total, file=output)
+    return (acc, correct, total)
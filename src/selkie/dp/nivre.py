@@ -2,13 +2,15 @@
 #   The Nivre parser.
 
 import os
+from functools import partial
 from ..cld.seal import io, sh
 from ..cld.seal.misc import Timer, as_boolean
-from .parser import iterinstances, instances, ClassifierOracle, Parser as DepParser
+from .parser import InstanceStream, instances, ClassifierOracle, ScoringOracle, BeamParser, \
+    Parser as DepParser
 from .features import load as load_features
-from .ml import sym, split, libsvm, experiment, Problem
+from .ml import sym, split, libsvm, perceptron, experiment, Problem
 from ..data import dep
-from .eval import evaluate as dp_evaluate
+from .eval import evaluate as dp_evaluate, evaluate_parallel as dp_evaluate_parallel
 
 ##  Save a feature function.
 
@@ -26,13 +28,52 @@ def load_ftrfnc (modelfn):
     ftrfnc = load_features('%s/Features' % modelfn, nulls)
     return ftrfnc
 
+##  The available learners, by name.
+
+Learners = {'libsvm': libsvm,
+            'perceptron': perceptron}
+
+##  Save the learner specification: the name of the learner, given by
+#   the 'learner' spec (default libsvm).
+
+def save_learner (e, modelfn):
+    name = e.get('learner', 'libsvm')
+    if name not in Learners:
+        raise Exception('Unknown learner: %s' % name)
+    sh.need_dir(modelfn)
+    io.save_string(name, '%s/Learner' % modelfn)
+
+##  Returns the learner, given the experiment specs.  If there is a
+#   'split' spec, the learner is wrapped in a split.Learner.
+
+def get_learner (specs):
+    sub = Learners[specs.get('learner', 'libsvm')]
+    if 'split' in specs:
+        return split.Learner(sub)
+    else:
+        return sub
+
+##  Load the learner for an existing model.  Models created before the
+#   learner was recorded are libsvm models.
+
+def load_learner (modelfn):
+    fn = '%s/Learner' % modelfn
+    name = 'libsvm'
+    if os.path.exists(fn):
+        name = io.contents(fn).strip()
+    sub = Learners[name]
+    if os.path.exists('%s/Params' % modelfn):
+        return split.Learner(sub)
+    else:
+        return sub
+
 ##  Create an experiment.
 
 def create (e):
     if isinstance(e, str):
         fn = '%s.exp' % e
         e = experiment.load_experiment(fn)
-    for key in ['experiment', 'features', 'nulls', 'dataset', 'split']:
+    for key in ['experiment', 'features', 'nulls', 'dataset']:
         if key not in e:
             raise Exception('Missing spec: %s' % key)
     dir = e['experiment']['dir']
@@ -41,6 +82,7 @@ def create (e):
     workfn = e['experiment']['work']
     ftrfn = '%s/%s.ftrs' % (dir, e['features'])
     save_ftrfnc(ftrfn, e['nulls'], modelfn)
+    save_learner(e, modelfn)
     sh.need_dir(workfn)
     io.save_nested_dict(e, '%s/Experiment' % workfn)
     return Trainer(name, workfn)
@@ -70,7 +112,7 @@ class Trainer (object):
         self.dataset = dep.dataset(self.specs['dataset'])
 
         ##  The learner.
-        self.learner = split.Learner(libsvm)
+        self.learner = get_learner(self.specs)
 
         self._model = None
         self._parser = None
@@ -90,13 +132,19 @@ class Trainer (object):
         return self._parser
 
     ##  Creates a Problem, constructs feature vectors, runs the learner's train() method.
+    #   The instances are streams, generated from the dataset each time the
+    #   learner iterates over them.  Options come from the 'split' specs if
+    #   splitting, and otherwise from the specs named after the learner.
 
     def train (self, output=None):
         timer = Timer()
         p = Problem(modelfn=self.modelfn, workfn=self.workfn)
-        p.options = self.specs['split']
-        p.train = iterinstances(self.dataset.sents('train'), self.ftrfnc)
-        p.test = iterinstances(self.dataset.sents('test'), self.ftrfnc)
+        if 'split' in self.specs:
+            p.options = self.specs['split']
+        else:
+            p.options = self.specs.get(self.specs.get('learner', 'libsvm'))
+        p.train = InstanceStream(partial(self.dataset.sents, 'train'), self.ftrfnc)
+        p.test = InstanceStream(partial(self.dataset.sents, 'test'), self.ftrfnc)
         self.learner.train(p, output=output)
         print('Elapsed time', timer, file=output)
 
@@ -110,10 +158,44 @@ class Trainer (object):
     def sents (self, which):
         return self.dataset.sents(which)
 
-    ##  Calls dp_evaluate().
+    ##  The beam widths to evaluate, from the 'beam.widths' spec (a
+    #   comma-separated list), or None.
+
+    def beam_widths (self):
+        beam = self.specs.get('beam')
+        if beam and 'widths' in beam:
+            return [int(w) for w in beam['widths'].split(',')]
 
-    def evaluate (self, which='test', excludepunc=True, output=None):
+    ##  The number of evaluation processes, from the 'eval.processes'
+    #   spec, or None.
+
+    def eval_processes (self):
+        spec = self.specs.get('eval')
+        if spec and 'processes' in spec:
+            return int(spec['processes'])
+
+    ##  Calls dp_evaluate().  If there is a 'beam.widths' spec, evaluates
+    #   a beam parser at each of the widths.  If the number of processes is
+    #   greater than 1, either given explicitly or by the 'eval.processes'
+    #   spec, calls dp_evaluate_parallel() instead.  Either way, the return
+    #   value is (las, uas, la, n, nsents), or with beam widths, a list of
+    #   (width, las, uas, la, n, nsents, sents_per_sec).
+
+    def evaluate (self, which='test', excludepunc=True, output=None, processes=None):
         sents = self.sents(which)
+        widths = self.beam_widths()
+        if processes is None:
+            processes = self.eval_processes()
+        if processes and processes > 1:
+            if not widths:
+                return dp_evaluate_parallel(partial(Parser, self.modelfn), sents, processes,
+                                            excludepunc=excludepunc, output=output)
+            return dp_evaluate_parallel(partial(beam_parser, self.modelfn, widths[0]),
+                                        sents, processes, excludepunc=excludepunc,
+                                        output=output, widths=widths)
+        if widths:
+            p = beam_parser(self.modelfn, widths[0], self.ftrfnc, self.model())
+            return dp_evaluate(p, sents, excludepunc=excludepunc, output=output, widths=widths)
         p = self.parser()
         return dp_evaluate(p, sents, excludepunc=excludepunc, output=output)
 
@@ -147,12 +229,24 @@ class Parser (DepParser):
         self.model = model
 
         if not ftrfnc: self.ftrfnc = load_ftrfnc(modelfn)
-        learner = split.Learner(libsvm)
-        if not model: self.model = learner.load_model(modelfn)
-        oracle = ClassifierOracle(self.model, self.ftrfnc)
+        if not model: self.model = load_learner(modelfn).load_model(modelfn)
+        if isinstance(self.model, perceptron.Model):
+            oracle = ClassifierOracle(self.model.predict_ids, self.model.encoder(self.ftrfnc))
+        else:
+            oracle = ClassifierOracle(self.model, self.ftrfnc)
         DepParser.__init__(self, oracle)
 
 
+##  Create a beam parser.  The model must be a perceptron model, trained
+#   without splitting, since beam search needs scores for all actions.
+
+def beam_parser (modelfn, width=8, ftrfnc=None, model=None):
+    if not ftrfnc: ftrfnc = load_ftrfnc(modelfn)
+    if not model: model = load_learner(modelfn).load_model(modelfn)
+    if not isinstance(model, perceptron.Model):
+        raise Exception('Beam search requires an unsplit perceptron model')
+    return BeamParser(ScoringOracle(model, ftrfnc), width)
+
 ##  Compute the accuracy, given an experiment pathname prefix.
 
 def accuracy (prefix, output=None):
@@ -160,8 +254,8 @@ def accuracy (prefix, output=None):
 
 ##  Evaluate the results, given an experiment pathname prefix.
 
-def evaluate (prefix, which='test', excludepunc=True, output=None):
-    return Trainer(prefix).evaluate(which, excludepunc, output=output)
+def evaluate (prefix, which='test', excludepunc=True, output=None, processes=None):
+    return Trainer(prefix).evaluate(which, excludepunc, output=output, processes=processes)
 
 ##  Train a model.
 
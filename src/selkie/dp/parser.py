@@ -1,6 +1,8 @@
 ##  @package seal.nlp.dp.parser
 #   Generic classifier-based dependency parser.
 
+import math, heapq
+from array import array
 from ..cld.seal.io import tabular
 from ..cld.seal.misc import trim
 from ..nlp.dep import Sentence, Word
@@ -16,63 +18,68 @@ def _str (s):
     else: return str(s)
 
 
-##  A parse node.
+##  Roles are stored in configurations as integers.  This table maps
+#   role strings to integers and back; it is shared by all configurations.
 
-class Node (object):
+class RoleTable (object):
 
     ##  Constructor.
 
-    def __init__ (self, index=None, source=None):
-        if source is None:
-            assert index is not None
+    def __init__ (self):
 
-            ##  The current input index.
-            self.index = index
+        ##  Maps role to integer.
+        self.ids = {}
 
-            ##  The governor.
-            self.govr = None
+        ##  Maps integer to role.
+        self.roles = []
 
-            ##  The role.
-            self.role = None
+    ##  The integer for a role, assigning a new one if necessary.
 
-            ##  The leftmost child.
-            self.lc = None
+    def intern (self, role):
+        i = self.ids.get(role)
+        if i is None:
+            i = self.ids[role] = len(self.roles)
+            self.roles.append(role)
+        return i
 
-            ##  The rightmost child.
-            self.rc = None
+_role_table = RoleTable()
 
-            ##  The left sibling.
-            self.ls = None
 
-            ##  The right sibling
-            self.rs = None
+# Offsets of the fields in Configuration._a, in units of the sentence length.
 
-        else:
-            assert index is None
-            self.index = source.index
-            self.govr = source.govr
-            self.role = source.role
-            self.lc = source.lc
-            self.rc = source.rc
-            self.ls = source.ls
-            self.rs = source.rs
+_STACK = 0
+_GOVR = 1
+_ROLE = 2
+_LC = 3
+_RC = 4
+_LS = 5
+_RS = 6
+_NFIELDS = 7
 
 
 ##  A parse configuration.
+#   The parse state is kept in a single integer array that is allocated
+#   once, when the configuration is created from a sentence.  For a
+#   sentence of n words (including the root), it consists of seven
+#   blocks of length n: the stack, and for each word its governor, role,
+#   leftmost and rightmost child, and left and right sibling.  An absent
+#   value is represented as -1.
+#
+#   The action methods (attach_left(), attach_right(), shift(), reduce(),
+#   and __call__()) leave the configuration unchanged and return a new
+#   one.  The method apply() performs the action in place instead, which
+#   avoids any allocation during decoding.
 
 class Configuration (object):
 
-    ##  Constructor.
+    ##  Constructor.  With <i>source</i>, creates a copy of the source.
 
     def __init__ (self, words=None, source=None):
         if source:
             assert words is None
 
-            ##  Of this configuration.
-            self.index = source.index + 1
-
-            ##  The source for the input.
-            self.source = source
+            ##  Of this configuration: the number of actions taken.
+            self.index = source.index
 
             ##  Input sentence.
             self.sent = source.sent
@@ -83,11 +90,13 @@ class Configuration (object):
             ##  Input pointer (into self.words).
             self.pointer = source.pointer
 
-            self._stack = source._stack
-            self._nodes = source._nodes
+            ##  Number of elements on the stack.
+            self.depth = source.depth
+
+            self._n = source._n
+            self._a = source._a[:]
 
         elif words:
-            self.source = None
             self.index = 0
             if isinstance(words, Sentence):
                 self.sent = words
@@ -96,12 +105,18 @@ class Configuration (object):
                 self.sent = None
                 self.words = ['*root*'] + words
             self.pointer = 1
-            self._stack = [0]
-            self._nodes = [Node(i) for i in range(len(self.words))]
+            self.depth = 1
+            self._n = n = len(self.words)
+            self._a = array('i', [0]) * n + array('i', [-1]) * ((_NFIELDS - 1) * n)
 
         else:
             raise Exception('Must provide words or source')
 
+    ##  A copy of this configuration.
+
+    def copy (self):
+        return Configuration(source=self)
+
     ##  The sentence provenance, if there is one.
 
     def provenance (self):
@@ -115,14 +130,19 @@ class Configuration (object):
     def input (self, t):
         if t < 0: return None
         i = self.pointer + t
-        if i < 0 or i >= len(self.words): return None
+        if i < 0 or i >= self._n: return None
         else: return i
 
     ##  The t-th word on the stack.
 
     def stack (self, t):
-        if t < 0 or t >= len(self._stack): return None
-        else: return self._stack[-(t+1)]
+        if t < 0 or t >= self.depth: return None
+        else: return self._a[self.depth - t - 1]
+
+    ##  The contents of the stack, as a list, bottom first.
+
+    def stack_list (self):
+        return list(self._a[:self.depth])
 
     #--  Word properties  ------------------
 
@@ -179,147 +199,136 @@ class Configuration (object):
     ##  Governor of word w.
 
     def govr (self, w):
-        if w: return self._nodes[w].govr
+        if w:
+            x = self._a[_GOVR * self._n + w]
+            if x >= 0: return x
 
     ##  Role of word w.
 
     def role (self, w):
-        if w: return self._nodes[w].role
+        if w:
+            r = self._a[_ROLE * self._n + w]
+            if r >= 0: return _role_table.roles[r]
 
     ##  Leftmost child of word w.
 
     def lc (self, w):
-        if w: return self._nodes[w].lc
+        if w:
+            x = self._a[_LC * self._n + w]
+            if x >= 0: return x
 
     ##  Rightmost child of word w.
 
     def rc (self, w):
-        if w: return self._nodes[w].rc
+        if w:
+            x = self._a[_RC * self._n + w]
+            if x >= 0: return x
 
     ##  Left sibling of word w.
 
     def ls (self, w):
-        if w: return self._nodes[w].ls
+        if w:
+            x = self._a[_LS * self._n + w]
+            if x >= 0: return x
 
     ##  Right sibling of word w.
 
     def rs (self, w):
-        if w: return self._nodes[w].rs
+        if w:
+            x = self._a[_RS * self._n + w]
+            if x >= 0: return x
 
     ##  Whether word w has its governor and all its dependents.
 
     def is_complete (self, w):
         if self.govr(w) is None: return False
-        for i in range(self.pointer, len(self.words)):
+        for i in range(self.pointer, self._n):
             if self.true_govr(i) == w and self.govr(i) is None:
                 return False
         return True
 
     #--  Actions  --------------------------
 
-    def _node (self, w):
-        node = self._nodes[w]
-        if self.source:
-            if self._nodes is self.source._nodes:
-                self._nodes = self._nodes[:]
-            if node is self.source._nodes[w]:
-                node = Node(source=node)
-                self._nodes[w] = node
-        return node
-
-    def _push (self, w):
-        self._stack = self._stack + [w]
-
-    def _pop (self):
-        assert len(self._stack) > 1
-        self._stack = self._stack[:-1]
-
-    # g d
-    # d.govr = g
-    # set d.role
-    # d.ls = g.rc
-    # g.rc.rs = d
-    # g.rc = d
-
     ##  Attach input[0] to stack[0].  Move input[0] onto the stack.
 
     def attach_left (self, role):
-        out = Configuration(source=self)
-        g = out.stack(0)
-        d = out.input(0)
-        gn = out._node(g)
-        dn = out._node(d)
-        assert dn.govr is None
-        dn.govr = g
-        dn.role = role
-        dn.ls = gn.rc
-        if gn.rc:
-            lsn = out._node(gn.rc)
-            lsn.rs = d
-        gn.rc = d
-        out._push(d)
-        out.pointer += 1
-        return out
+        return self.copy().apply('al', role)
 
     ##  Attach stack[0] to input[0].  Pop the stack.
 
     def attach_right (self, role):
-        out = Configuration(source=self)
-        d = out.stack(0)
-        g = out.input(0)
-        dn = out._node(d)
-        gn = out._node(g)
-        assert dn.govr is None
-        dn.govr = g
-        dn.role = role
-        dn.rs = gn.lc
-        if gn.lc:
-            rsn = out._node(gn.lc)
-            rsn.ls = d
-        gn.lc = d
-        out._pop()
-        return out
+        return self.copy().apply('ar', role)
 
     ##  Move input[0] onto the stack.
 
     def shift (self):
-        out = Configuration(source=self)
-        w = out.input(0)
-        assert w
-        out._push(w)
-        out.pointer += 1
-        return out
+        return self.copy().apply('sh')
 
     ##  Pop the stack.
 
     def reduce (self):
-        out = Configuration(source=self)
-        out._pop()
-        return out
+        return self.copy().apply('re')
 
     #--  Call  -----------------------------
     
     ##  Call an action: 'al' for attach_left(), 'ar' for attach_right(), 're' for 
-    #   reduce(), 'sh' for shift().
+    #   reduce(), 'sh' for shift().  Returns a new configuration.
 
     def __call__ (self, action, role=None):
+        return self.copy().apply(action, role)
+
+    ##  Perform an action in place.  Returns self.
+
+    def apply (self, action, role=None):
+        a = self._a
+        n = self._n
         if action == 'al':
-            return self.attach_left(role)
+            g = a[self.depth - 1]
+            d = self.pointer
+            assert a[_GOVR * n + d] < 0
+            a[_GOVR * n + d] = g
+            a[_ROLE * n + d] = _role_table.intern(role)
+            rc = a[_RC * n + g]
+            a[_LS * n + d] = rc
+            if rc >= 0:
+                a[_RS * n + rc] = d
+            a[_RC * n + g] = d
+            a[self.depth] = d
+            self.depth += 1
+            self.pointer += 1
         elif action == 'ar':
-            return self.attach_right(role)
+            d = a[self.depth - 1]
+            g = self.pointer
+            assert a[_GOVR * n + d] < 0
+            a[_GOVR * n + d] = g
+            a[_ROLE * n + d] = _role_table.intern(role)
+            lc = a[_LC * n + g]
+            a[_RS * n + d] = lc
+            if lc >= 0:
+                a[_LS * n + lc] = d
+            a[_LC * n + g] = d
+            assert self.depth > 1
+            self.depth -= 1
         elif action == 're':
             assert role is None
-            return self.reduce()
+            assert self.depth > 1
+            self.depth -= 1
         elif action == 'sh':
             assert role is None
-            return self.shift()
+            w = self.input(0)
+            assert w
+            a[self.depth] = w
+            self.depth += 1
+            self.pointer += 1
         else:
             raise Exception('Unrecognized action: ' + repr(action))
+        self.index += 1
+        return self
 
     ##  Whether the named action is permissible.
 
     def is_permissible (self, action):
-        if self.pointer >= len(self.words):
+        if self.pointer >= self._n:
             return False
         if action == 'ar':
             d = self.stack(0)
@@ -338,7 +347,7 @@ class Configuration (object):
     ##  Whether there is any remaining input.
 
     def can_continue (self):
-        return self.pointer < len(self.words)
+        return self.pointer < self._n
 
     #--  Sentence  -------------------------
 
@@ -362,29 +371,26 @@ class Configuration (object):
 
     def buffer_string (self):
         buf = []
-        for i in range(len(self._stack)):
-            w = self._stack[i]
+        for i in range(self.depth):
+            w = self._a[i]
             buf.append(trim(2, self.words[w]))
         buf.append('|')
-        for w in range(self.pointer, len(self.words)):
+        for w in range(self.pointer, self._n):
             buf.append(trim(2, self.words[w]))
         return ' '.join(buf)
 
     ##  Detailed string representation.
 
     def __str__ (self):
-        r = list(range(len(self.words)))
+        r = list(range(self._n))
         rows = []
         if self.sent:
             true_govrs = [_str(self.true_govr(i)) for i in r]
             true_roles = [_str(self.true_role(i)) for i in r]
             rows.append(['    tgovr:'] + true_govrs)
             rows.append(['    trole:'] + [trim(2,role) for role in true_roles])
-        govrs = []
-        roles = []
-        for node in self._nodes:
-            roles.append(_str(node.role))
-            govrs.append(_str(node.govr))
+        govrs = [_str(self.govr(i)) for i in r]
+        roles = [_str(self.role(i)) for i in r]
         rows.append(['    govr:'] + govrs)
         rows.append(['    role:'] + [trim(2,role) for role in roles])
         if self.sent:
@@ -395,7 +401,7 @@ class Configuration (object):
         deco = ['']
         for w in r:
             if w == self.pointer: deco.append('|-')
-            elif w in self._stack: deco.append('*')
+            elif w in self._a[:self.depth]: deco.append('*')
             else: deco.append('')
         rows.append(deco)
         out = tabular(rows)
@@ -412,9 +418,13 @@ class Configuration (object):
 def computation (sent, orc, strict=False, trace=False):
     return list(itercomputation(sent, orc, strict=strict, trace=trace))
 
-##  Iterate over computations.
+##  Iterate over computations.  Yields triples (cfg, act, role).
+#   By default, each cfg is a distinct configuration, so that the
+#   computation can be kept as a history.  If <i>inplace</i> is true, a
+#   single configuration is updated in place and yielded at every step;
+#   the caller must be done with it before asking for the next triple.
 
-def itercomputation (sent, orc, strict=False, trace=False):
+def itercomputation (sent, orc, strict=False, trace=False, inplace=False):
     c = Configuration(sent)
     if trace: print(c)
     while c.can_continue():
@@ -429,7 +439,10 @@ def itercomputation (sent, orc, strict=False, trace=False):
             act = 'sh'
             role = None
         yield (c, act, role)
-        c = c(act, role)
+        if inplace:
+            c.apply(act, role)
+        else:
+            c = c(act, role)
         if trace:
             print()
             print(c)
@@ -531,6 +544,34 @@ def iterinstances (sents, ftrfnc, strict=True):
 def instances (sents, ftrfnc):
     return list(iterinstances(sents, ftrfnc))
 
+##  A stream of instances that can be iterated over repeatedly, without
+#   the instances being kept in memory.  Each iteration calls
+#   iterinstances() anew.  <i>Sents</i> is either a list of sentences
+#   or a function of no arguments that returns an iterable over sentences,
+#   such as functools.partial(dataset.sents, 'train').
+
+class InstanceStream (object):
+
+    ##  Constructor.
+
+    def __init__ (self, sents, ftrfnc, strict=True):
+
+        ##  The sentences, or a function that returns them.
+        self.sents = sents
+
+        ##  The feature function.
+        self.ftrfnc = ftrfnc
+
+        ##  Passed to computation().
+        self.strict = strict
+
+    ##  Iterate over the instances.
+
+    def __iter__ (self):
+        sents = self.sents
+        if callable(sents): sents = sents()
+        return iterinstances(sents, self.ftrfnc, self.strict)
+
 ##  Simple features.
 
 def simple_features (c):
@@ -564,6 +605,46 @@ class ClassifierOracle (object):
         return decode_label(label)
 
 
+##  Scoring oracle.  Wraps a model that scores every label, rather than
+#   just predicting one, such as selkie.dp.ml.perceptron.Model.  The
+#   model must provide labels, encoder(), and scores_ids_batch().
+#   Used by BeamParser, but it can also be used as a greedy oracle.
+
+class ScoringOracle (object):
+
+    ##  Constructor.
+
+    def __init__ (self, model, ftrfnc):
+
+        ##  The model.
+        self.model = model
+
+        ##  Maps configurations to the model's feature IDs.
+        self.encoder = model.encoder(ftrfnc)
+
+        ##  The (act, role) pair for each of the model's labels.
+        self.actions = [decode_label(label) for label in model.labels]
+
+    ##  Score a list of configurations in a single call to the model.
+    #   Returns a list of score lists, one score for each action.
+
+    def scores (self, cfgs):
+        return self.model.scores_ids_batch(self.encoder.batch(cfgs))
+
+    ##  Call the oracle on a configuration.  Returns the best-scoring
+    #   permissible (act, role).
+
+    def __call__ (self, config):
+        scores = self.scores([config])[0]
+        best = None
+        for (i, (act, role)) in enumerate(self.actions):
+            if (best is None or scores[i] > scores[best]) and config.is_permissible(act):
+                best = i
+        if best is None:
+            return ('sh', None)
+        return self.actions[best]
+
+
 #--  Parse  --------------------------------------------------------------------
 
 ##  Parser.
@@ -577,10 +658,137 @@ class Parser (object):
         ##  An oracle.
         self.oracle = oracle
 
-    ##  Apply it to a sentence.  Just a wrapper around computation().
+    ##  Apply it to a sentence.  Just a wrapper around itercomputation().
+    #   The configuration is updated in place, since no history is needed.
     #   Uses Configuration.sentence() to unwind the results.
 
     def __call__ (self, sent, trace=False):
-        comp = computation(sent, self.oracle, trace=trace)
-        cfg = comp[-1][0]
+        for (cfg, act, role) in itercomputation(sent, self.oracle, trace=trace, inplace=True):
+            pass
         return cfg.sentence()
+
+
+#--  Beam search  --------------------------------------------------------------
+
+##  Beam-search parser.  Keeps the <i>width</i> best configurations,
+#   by cumulative score, instead of committing to a single action at each
+#   step.  The oracle must be a ScoringOracle.
+#
+#   At each step, all unfinished configurations in the beam are scored in
+#   a single batched call, every permissible action of every configuration
+#   is a candidate, and the best <i>width</i> candidates form the next
+#   beam.  Finished configurations (those with no remaining input) stay in
+#   the beam and compete with the others, except that a finished
+#   configuration that has left words unattached ranks below every other
+#   candidate.  (Scores are log probabilities, so a derivation that gives
+#   up early would otherwise win simply by being short.)  Configurations
+#   are copied on write: a configuration's last surviving successor is
+#   produced by updating it in place, and only the others are copies, so
+#   the beam never holds more than width configurations.
+#
+#   If <i>normalize</i> is true (the default), each step's scores are
+#   converted to log probabilities (softmax) before being added; otherwise
+#   the raw scores are added.
+
+class BeamParser (object):
+
+    ##  Constructor.
+
+    def __init__ (self, oracle, width=8, normalize=True, complete=True):
+
+        ##  A ScoringOracle.
+        self.oracle = oracle
+
+        ##  The beam width.
+        self.width = width
+
+        ##  Whether to normalize scores.
+        self.normalize = normalize
+
+        ##  Whether to rank a configuration that leaves words unattached
+        #   below all others.
+        self.complete = complete
+
+    ##  Apply it to a sentence.  Returns the parse of the best configuration.
+
+    def __call__ (self, sent, trace=False):
+        return self.search(sent, trace)[0][2].sentence()
+
+    ##  Do the search.  Returns the final beam, as a list of triples
+    #   (rank, score, configuration), best first.  Rank is 0 for a
+    #   configuration that has left words unattached, and 1 otherwise.
+    #   If complete is false, the rank is always 1.
+
+    def search (self, sent, trace=False):
+        width = self.width
+        actions = self.oracle.actions
+        beam = [(1, 0.0, Configuration(sent))]
+        while True:
+            live = [i for (i, (_, _, c)) in enumerate(beam) if c.can_continue()]
+            if not live:
+                break
+            allscores = self.oracle.scores([beam[i][2] for i in live])
+            cands = [(rank, score, i, None)
+                     for (i, (rank, score, c)) in enumerate(beam)
+                     if not c.can_continue()]
+            for (i, scores) in zip(live, allscores):
+                c = beam[i][2]
+                score = beam[i][1]
+                if self.normalize:
+                    scores = _log_softmax(scores)
+                last = self.complete and (c.pointer == c._n - 1)
+                ok = {}
+                for (k, (act, role)) in enumerate(actions):
+                    if act not in ok:
+                        ok[act] = c.is_permissible(act)
+                    if ok[act]:
+                        rank = 1
+                        if last and not _completes(c, act):
+                            rank = 0
+                        cands.append((rank, score + scores[k], i, k))
+            best = heapq.nlargest(width, cands, key=_rank_score)
+
+            uses = [0] * len(beam)
+            for (_, _, i, k) in best:
+                uses[i] += 1
+            newbeam = []
+            for (rank, score, i, k) in best:
+                c = beam[i][2]
+                if k is not None:
+                    uses[i] -= 1
+                    if uses[i]:
+                        c = c.copy()
+                    (act, role) = actions[k]
+                    c.apply(act, role)
+                newbeam.append((rank, score, c))
+            beam = newbeam
+            if trace:
+                print()
+                for (rank, score, c) in beam:
+                    print('%d %10.4f' % (rank, score), c.buffer_string())
+        return beam
+
+
+#   Whether applying act to c, when only one input word remains, leaves
+#   every word attached.  Shift leaves the last word unattached; the
+#   others attach it ('al') or consume nothing ('ar', 're').  'ar' and 're'
+#   do not finish the configuration.
+
+def _completes (c, act):
+    if act != 'al':
+        return act != 'sh'
+    a = c._a
+    base = _GOVR * c._n
+    for i in range(c.depth):
+        w = a[i]
+        if w and a[base + w] < 0:
+            return False
+    return True
+
+def _rank_score (x):
+    return (x[0], x[1])
+
+def _log_softmax (scores):
+    m = max(scores)
+    z = m + math.log(sum(math.exp(x - m) for x in scores))
+    return [x - z for x in scores]
@@ -111,6 +111,8 @@ class Avs (list):
     def __init__ (self):
         list.__init__(self)
         self.__import_table = {}
+        self.__trail = None
+        self.__parents = None
 
         ##  Unique ID.
         self.id = Avs.count
@@ -123,7 +125,54 @@ class Avs (list):
 
     ##  Freeze it: make it immutable.
 
-    def freeze (self): self.__import_table = None
+    def freeze (self):
+        self.__import_table = None
+        self.__trail = None
+
+
+    #--  Trail  ----------------------------
+
+    ##  Start recording changes, if not already recording, and return
+    #   the current position in the trail.  Every later change to a slot,
+    #   appended variable, or import-table entry is recorded, so that
+    #   undo() can restore the AVS to its state at the mark.
+
+    def mark (self):
+        if not self.is_mutable():
+            raise Exception('Attempt to modify a frozen AVS')
+        if self.__trail is None:
+            self.__trail = []
+        return len(self.__trail)
+
+    ##  Roll back all changes made since the given mark.
+
+    def undo (self, mark=0):
+        trail = self.__trail
+        while len(trail) > mark:
+            (kind, key, old) = trail.pop()
+            if kind == 'set': self[key] = old
+            elif kind == 'append': self.pop()
+            else: del self.__import_table[key]
+
+    ##  Stop recording changes.  The changes become permanent.
+
+    def commit (self):
+        self.__trail = None
+
+    def __set (self, v, value):
+        if self.__trail is not None:
+            self.__trail.append(('set', v, self[v]))
+        self[v] = value
+
+    def __append (self, value):
+        if self.__trail is not None:
+            self.__trail.append(('append', None, None))
+        self.append(value)
+
+    def __add_import (self, key, v):
+        if self.__trail is not None:
+            self.__trail.append(('import', key, None))
+        self.__import_table[key] = v
 
 
     #--  Hashing  --------------------------
@@ -253,10 +302,17 @@ class Avs (list):
     def __repr__ (self):
         return self.__pprint(flat=True)
 
-    def __pprint (self, flat=False):
+    ##  Flat string representation of the structure rooted at variable v.
+    #   Two structures have the same variable string just in case they are
+    #   identical up to renaming of variables.
+
+    def variable_string (self, v):
+        return self.__pprint(flat=True, root=v)
+
+    def __pprint (self, flat=False, root=0):
         pathto = {}
         out = []
-        self.__pprint_variable(0, 1, [], pathto, flat, out)
+        self.__pprint_variable(root, 1, [], pathto, flat, out)
         return ''.join(out)
 
     def __pprint_variable (self, v, indent, path, pathto, flat, out, forceprint=False):
@@ -352,21 +408,26 @@ class Avs (list):
             assert not import_value
             return u
 
-        key = (id(avs), u)
+        # A variable whose value is an AV list is identified by the list,
+        # since the same list may also be held by variables of other AVSs
+        # that share structure with avs.
+        if isinstance(value, AvList): key = id(value)
+        else: key = (id(avs), u)
         if key in self.__import_table:
             v = self.__import_table[key]
             if import_value:
-                if isinstance(value, AvList) and value.avs is not self:
-                    self[v] = -1
-                    self[v] = self.import_avlist(value)
+                local = self[v]
+                if isinstance(local, AvList) and local.avs is not self:
+                    self.__set(v, -1)
+                    self.__set(v, self.import_avlist(value))
         else:
             v = len(self)
-            self.__import_table[key] = v
-            self.append(Top)
+            self.__add_import(key, v)
+            self.__append(Top)
 
             if import_value:
                 value = self.import_avlist(value)
-            self[v] = value
+            self.__set(v, value)
 
             if TraceOn:
                 print('%d.%d' % (avs.id, u), '->', v)
@@ -390,14 +451,27 @@ class Avs (list):
             out.append(AvPair(pair.att, value))
         return out
 
-    ##  Parents.
+    ##  Parents.  A frozen AVS cannot change, so its parent table is
+    #   computed once and kept.
 
     def parents (self, v):
-        out = []
-        for u, value in enumerate(self):
-            if isinstance(value, AvList) and value.contains(v):
-                out.append(u)
-        return out
+        if self.is_mutable():
+            out = []
+            for u, value in enumerate(self):
+                if isinstance(value, AvList) and value.contains(v):
+                    out.append(u)
+            return out
+        if self.__parents is None:
+            table = {}
+            for u, value in enumerate(self):
+                if isinstance(value, AvList):
+                    for pair in value:
+                        if isinstance(pair.value, int):
+                            ps = table.setdefault(pair.value, [])
+                            if not (ps and ps[-1] == u):
+                                ps.append(u)
+            self.__parents = table
+        return self.__parents.get(v, [])
 
 
     #--  Deref  ----------------------------
@@ -424,13 +498,29 @@ class Avs (list):
     ##  Called for side effect.  x and y are imported into self.
 
     def unify (self, x, y):
-        assert self.is_mutable()
-        atom1 = self.import_atom(x)
-        atom2 = self.import_atom(y)
-        self.unify_atoms(atom1, atom2)
+        if not self.try_unify(x, y):
+            raise Failure
         self.pack()
         self.freeze()
 
+    ##  Unify x and y in place, binding variables of self directly.
+    #   Changes are recorded on the trail; if unification fails, they are
+    #   undone and the return value is False.  Nothing is packed or frozen,
+    #   so the caller may take a snapshot() and then undo() back to an
+    #   earlier mark.
+
+    def try_unify (self, x, y):
+        mark = self.mark()
+        try:
+            atom1 = self.import_atom(x)
+            atom2 = self.import_atom(y)
+            self.unify_atoms(atom1, atom2)
+            return True
+        except Failure:
+            if TraceOn: print('undo to', mark)
+            self.undo(mark)
+            return False
+
     ##  Atom may be constant, local variable, or Top.
 
     def unify_atoms (self, atom1, atom2):
@@ -441,26 +531,26 @@ class Avs (list):
 
         if TraceOn: print('unify atoms', orig1, '->', atom1, ';', orig2, '->', atom2)
 
-        if atom1 is atom2:
+        if atom1 == atom2:
             return atom1
         elif value1 is Top:
-            self[atom1] = atom2
+            self.__set(atom1, atom2)
             if TraceOn: print('%d -> %s' % (atom1, atom2))
             return atom2
         elif value2 is Top:
-            self[atom2] = atom1
+            self.__set(atom2, atom1)
             if TraceOn: print('%d -> %s' % (atom2, atom1))
             return atom1
         elif isinstance(atom1, str) or isinstance(atom2, str):
             raise Failure
         else:
-            self[atom2] = atom1
-            self[atom1] = -1
+            self.__set(atom2, atom1)
+            self.__set(atom1, -1)
             if TraceOn:
                 print('%d -> %s' % (atom2, atom1))
                 print('%d -> -1' % atom1)
             value = self.unify_lists(value1, value2)
-            self[atom1] = value
+            self.__set(atom1, value)
             if TraceOn: print('%d -> %s' % (atom1, value))
             return atom1
 
@@ -531,22 +621,39 @@ class Avs (list):
             print(self.raw())
         nnew, newvars = self.__newvars()
         if nnew < len(self):
-            for o in range(len(self)):
-                n = newvars[o]
-                if n != -1 and isinstance(n, int):
-                    value = self[o]
-                    if isinstance(value, int):
-                        value = newvars[value]
-                    elif isinstance(value, AvList) and value.avs is self:
-                        value = self.__renumber_vars(value, newvars)
-                    self[n] = value
-            del self[nnew:]
+            self[:] = self.__packed_values(nnew, newvars, self)
         if TraceOn:
             print('After packing:')
             print(self.raw())
 
-    def __renumber_vars (self, avlist, newvars):
-        output = AvList(self)
+    ##  Return a packed, frozen copy of the structure reachable from
+    #   variable 0.  AV lists that belong to other AVSs are shared, not
+    #   copied.  Self is left unchanged.
+
+    def snapshot (self):
+        nnew, newvars = self.__newvars()
+        out = Avs()
+        out.extend(self.__packed_values(nnew, newvars, out))
+        out.freeze()
+        return out
+
+    # The new values are collected in a separate list: a variable's new
+    # number may be larger than its old one, so renumbering in place
+    # would overwrite values not yet moved.
+
+    def __packed_values (self, nnew, newvars, owner):
+        values = [Top] * nnew
+        for o, value in enumerate(self):
+            n = newvars[o]
+            if n != -1 and isinstance(n, int) and not isinstance(value, int):
+                if isinstance(value, AvList) and value.avs is self:
+                    value = self.__renumber_vars(value, newvars, owner)
+                values[n] = value
+        return values
+
+    def __renumber_vars (self, avlist, newvars, owner=None):
+        if owner is None: owner = self
+        output = AvList(owner)
         for i in range(len(avlist)):
             pair = avlist[i]
             if isinstance(pair.value, int):
@@ -573,8 +680,9 @@ class Avs (list):
             if isinstance(value, str):
                 out.append(tuple(path + [value]))
             elif isinstance(value, AvList):
+                # the list may belong to an AVS that this one shares structure with
                 for pair in value:
-                    self.__collect_constant_equations(pair.value, path + [pair.att], out)
+                    value.avs.__collect_constant_equations(pair.value, path + [pair.att], out)
 
 
 #--  Unify  --------------------------------------------------------------------
@@ -587,7 +695,7 @@ def unify (x, y, trace=False):
     if TraceOn:
         print('----------------------------------------')
     try:
-        if x is Top: out = y
+        if x is Top or x is y: out = y
         elif y is Top: out = x
         else:
             out = Avs()
@@ -622,6 +730,26 @@ class AvState (object):
         self.i = i
         assert not self.targets[0]
 
+        ##  Working AVS into which self.avs has been imported as variable 0.
+        #   Created on first use and reused by match() and extend().
+        self.work = None
+
+    ##  Unify x and y in the working AVS.  On success, a snapshot of the
+    #   result is returned; in either case, the working AVS is restored.
+
+    def __unify (self, x, y):
+        if self.work is None:
+            self.work = Avs()
+            v = self.work.import_atom(self.avs)
+            assert v == 0
+        work = self.work
+        mark = work.mark()
+        if not work.try_unify(x, y):
+            return None
+        out = work.snapshot()
+        work.undo(mark)
+        return out
+
     ##  Avs representing type of i-th child.
 
     def __getitem__ (self, i):
@@ -633,10 +761,10 @@ class AvState (object):
         else:
             return self.avs.follow_path(self.targets[i])
 
-    ##  Match.  Returns an AvState.
+    ##  Match.  Returns an AvState, or None if unification fails.
 
     def match (self, parentsem):
-        if parentsem is Top:
+        if parentsem is Top or parentsem is self.avs:
             return self
         elif self.avs is Top:
             return AvState(parentsem, self.targets, self.i)
@@ -644,13 +772,11 @@ class AvState (object):
             if self.avs == parentsem: return self
             else: return Bottom
         else:
-            avs = Avs()
-            v = avs.import_atom(self.avs)
-            assert v == 0
-            avs.unify(0, parentsem)
+            avs = self.__unify(0, parentsem)
+            if avs is None: return None
             return AvState(avs, self.targets, self.i)
 
-    ##  Extend.  Returns an AvState.
+    ##  Extend.  Returns an AvState, or None if unification fails.
 
     def extend (self, other):
         path = self.targets[self.i]
@@ -658,12 +784,12 @@ class AvState (object):
             avs = self.avs
         elif other is None:
             return None
+        elif other is Top:
+            avs = self.avs
         else:
-            avs = Avs()
-            v = avs.import_atom(self.avs)
-            assert v == 0
             atom1 = self.avs.follow_path(path)
-            avs.unify(atom1, other)
+            avs = self.__unify(atom1, other)
+            if avs is None: return None
         return AvState(avs, self.targets, self.i+1)
 
     ##  Execute it on a list of child semantic representations.
@@ -741,6 +867,12 @@ class Copier (object):
             last = sem
         return last
 
+    ##  Execute it on a list of child semantic representations: the value
+    #   is the semantics of the last child.
+
+    def __call__ (self, childsems):
+        return self.reduce(childsems)
+
     ##  Match.
 
     def match (self, parentsem):
@@ -844,6 +976,7 @@ class Scanner (object):
             if isinstance(pair.value, str):
                 return pair.value
             else:
+                self.avs.freeze()
                 return self.avs
         finally:
             self.input.pop_syntax()
@@ -102,6 +102,68 @@ def restart_variables ():
     variable_count = 0
 
 
+#--  Hash consing  -------------------------------------------------------------
+
+##  A table of unique expressions.  Interning an expression returns the
+#   table's copy of it.  Equal expressions interned in the same table are
+#   the same object, so identity can stand in for equality, for example as
+#   a key in a memo table.  The table holds on to its expressions, so their
+#   ids remain valid for the life of the table.
+
+class ExprTable (object):
+
+    ##  Constructor.
+
+    def __init__ (self):
+
+        ##  Maps a key to the unique expression with that key.  The key is
+        #   the tuple of children, with complex children replaced by their ids.
+        self.table = {}
+
+        ##  The ids of the expressions in the table.
+        self.ids = set()
+
+        ##  Number of times intern() found an existing expression.
+        self.hits = 0
+
+        ##  Number of expressions added to the table.
+        self.misses = 0
+
+    ##  Returns the unique expression equal to x.  Atoms are returned as is.
+
+    def intern (self, x):
+        if not isinstance(x, Expr) or id(x) in self.ids:
+            return x
+        children = [self.intern(c) for c in x]
+        if all(c is d for (c, d) in zip(children, x)):
+            return self.make(children, x)
+        else:
+            return self.make(children)
+
+    ##  Returns the unique expression with the given children, which must
+    #   already be interned.  If the expression is new, expr is used for it
+    #   if provided; otherwise a new Expr is created.
+
+    def make (self, children, expr=None):
+        key = tuple([id(c) if c.__class__ is Expr else (c.__class__, c)
+                     for c in children])
+        x = self.table.get(key)
+        if x is not None:
+            self.hits += 1
+            return x
+        self.misses += 1
+        if expr is None:
+            expr = Expr(children)
+        self.table[key] = expr
+        self.ids.add(id(expr))
+        return expr
+
+    ##  The number of expressions in the table.
+
+    def __len__ (self):
+        return len(self.table)
+
+
 #--  Parse expr  ---------------------------------------------------------------
 
 ##  Whether this looks like a variable.  Returns True if the string consists
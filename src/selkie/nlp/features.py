@@ -1,6 +1,8 @@
 ##  \package seal.nlp.features
 #   Features for a feature grammar.
 
+from time import time
+from collections import OrderedDict
 from .io import Syntax, outfile
 
 
@@ -238,6 +240,355 @@ def subsumes (v1, v2):
     return meet(v1,v2) == v2
 
 
+#--  Compiled categories  ------------------------------------------------------
+
+##  Encodes feature values as bitmasks.  Each atom is assigned a bit; an
+#   atom set is the union of the bits of its members; None (bottom) is 0;
+#   and '*' (top) is -1, which has all bits set, so that it behaves
+#   correctly even for atoms that are interned after it is encoded.
+#   Meet is then bitwise and, join is bitwise or, and v1 subsumes v2 just
+#   in case v1 & v2 == v2.
+#
+#   A variable-free category is encoded as a tuple whose first element is
+#   the type (a string) and whose remaining elements are masks.  A category
+#   that may contain variables is compiled into a BitPattern.  Bindings are
+#   lists of masks.  Encodings are cached, and categories are hash-consed:
+#   intern() and decode() return a single shared object for equal categories.
+#
+#   The codec also memoizes bit_unify() in an LRU cache holding at most
+#   cache_size entries, keyed on the identities of the pattern and the
+#   encoded category and on the bindings.
+
+class CategoryCodec (object):
+
+    ##  Constructor.
+
+    def __init__ (self, cache_size=100000):
+
+        ##  Maps an atom to its bit.
+        self.bits = {}
+
+        ##  List of atoms, in order of bit.
+        self.atoms = []
+
+        ##  The feature table whose atoms have been declared, if any.
+        self.features = None
+
+        ##  Cache mapping masks to values.
+        self.values = {}
+
+        ##  Cache mapping variable-free categories to tuples of masks.
+        self.encoded = {}
+
+        ##  Cache mapping tuples of masks to categories.
+        self.decoded = {}
+
+        ##  Cache mapping categories (possibly with variables) to patterns.
+        self.patterns = {}
+
+        ##  Intern table: maps a category to the shared instance.
+        self.interned = {}
+
+        ##  The maximum number of entries in the unification cache.
+        self.cache_size = cache_size
+
+        ##  The unification cache.
+        self.cache = OrderedDict()
+
+        ##  Number of unifications served from the cache.
+        self.hits = 0
+
+        ##  Number of unifications computed.
+        self.misses = 0
+
+    ##  Intern the atoms of a feature table, so that the atoms of each feature
+    #   type receive adjacent bits.
+
+    def declare (self, features):
+        self.features = features
+        for ftr in sorted(features.values()):
+            self.encode_value(ftr.value)
+
+    ##  The bit for an atom.  Assigns a new bit if necessary.
+
+    def atom_bit (self, atom):
+        bit = self.bits.get(atom)
+        if bit is None:
+            bit = 1 << len(self.atoms)
+            self.bits[atom] = bit
+            self.atoms.append(atom)
+        return bit
+
+    ##  Encode a value: None, '*', an atom, or an AtomSet.
+
+    def encode_value (self, value):
+        if value is None: return 0
+        elif value == '*': return -1
+        elif isinstance(value, AtomSet):
+            mask = 0
+            for atom in value:
+                mask |= self.atom_bit(atom)
+            return mask
+        elif isinstance(value, str):
+            return self.atom_bit(value)
+        else:
+            raise Exception('Not a feature value: %s' % repr(value))
+
+    ##  Decode a mask.
+
+    def decode_value (self, mask):
+        if mask in self.values:
+            return self.values[mask]
+        if mask == 0: value = None
+        elif mask < 0: value = '*'
+        else:
+            atoms = []
+            i = 0
+            m = mask
+            while m:
+                if m & 1: atoms.append(self.atoms[i])
+                m >>= 1
+                i += 1
+            value = atomset(atoms)
+        self.values[mask] = value
+        return value
+
+    ##  Encode a variable-free category as a tuple of masks.
+
+    def encode (self, cat):
+        bits = self.encoded.get(cat)
+        if bits is None:
+            vals = [cat[0]]
+            for v in cat[1:]:
+                if isinstance(v, int):
+                    raise Exception('Category contains variables: %s' % repr(cat))
+                vals.append(self.encode_value(v))
+            bits = tuple(vals)
+            self.encoded[cat] = bits
+            if bits not in self.decoded:
+                self.decoded[bits] = self.intern(cat)
+        return bits
+
+    ##  Decode a tuple of masks.  Equal tuples always yield the same
+    #   Category object.
+
+    def decode (self, bits):
+        cat = self.decoded.get(bits)
+        if cat is None:
+            vals = [bits[0]]
+            for m in bits[1:]:
+                vals.append(self.decode_value(m))
+            cat = self.intern(Category(vals))
+            self.decoded[bits] = cat
+            if cat not in self.encoded:
+                self.encoded[cat] = bits
+        return cat
+
+    ##  Returns the shared instance of the given category.  The first
+    #   category interned becomes the shared instance for all equal ones.
+
+    def intern (self, cat):
+        shared = self.interned.get(cat)
+        if shared is None:
+            self.interned[cat] = shared = cat
+        return shared
+
+    ##  Memoized bit_unify().  The pattern and category should be shared
+    #   instances, as returned by pattern() and encode(); others work, but
+    #   will rarely hit.  Entries keep their pattern and category alive, so
+    #   an id is never reused while its entry is in the cache.
+
+    def unify (self, pattern, cat, bindings):
+        key = (id(pattern), id(cat), tuple(bindings))
+        cache = self.cache
+        entry = cache.get(key)
+        if entry is not None and entry[0] is pattern and entry[1] is cat:
+            self.hits += 1
+            cache.move_to_end(key)
+            return entry[2]
+        self.misses += 1
+        result = bit_unify(pattern, cat, bindings)
+        cache[key] = (pattern, cat, result)
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return result
+
+    ##  Clear the unification cache and reset the counters.
+
+    def clear_cache (self):
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    ##  The unification cache counters: (hits, misses).
+
+    def cache_stats (self):
+        return (self.hits, self.misses)
+
+    ##  Compile a category that may contain variables.
+
+    def pattern (self, cat):
+        pat = self.patterns.get(cat)
+        if pat is None:
+            pat = BitPattern(self, cat)
+            self.patterns[cat] = pat
+        return pat
+
+    ##  Encode a list of binding values.
+
+    def encode_bindings (self, bindings):
+        return [self.encode_value(v) for v in bindings]
+
+    ##  Decode a list of masks.
+
+    def decode_bindings (self, bindings):
+        return [self.decode_value(m) for m in bindings]
+
+    ##  Compile a grammar rule.
+
+    def compile_rule (self, rule):
+        return CompiledRule(self, rule)
+
+
+##  A compiled category that may contain variables.
+
+class BitPattern (object):
+
+    ##  Constructor.
+
+    def __init__ (self, codec, cat):
+
+        ##  The category type.
+        self.name = cat[0]
+
+        ##  The length of the category, including the type.
+        self.size = len(cat)
+
+        ##  List of (position, mask) for positions with constant values.
+        #   Positions whose value is '*' are omitted, since they always match.
+        self.consts = []
+
+        ##  List of (position, variable) for positions with variables.
+        self.vars = []
+
+        ##  For each position after the first: a variable number, or None.
+        self.slots = []
+
+        ##  For each position after the first: a mask, or None for a variable.
+        self.masks = []
+
+        for i in range(1, len(cat)):
+            v = cat[i]
+            if isinstance(v, int):
+                self.vars.append((i, v))
+                self.slots.append(v)
+                self.masks.append(None)
+            else:
+                m = codec.encode_value(v)
+                if m != -1: self.consts.append((i, m))
+                self.slots.append(None)
+                self.masks.append(m)
+
+    ##  String representation.
+
+    def __repr__ (self):
+        return '<BitPattern %s %s %s>' % (self.name, self.consts, self.vars)
+
+
+##  A grammar rule with compiled categories and bindings.
+
+class CompiledRule (object):
+
+    ##  Constructor.
+
+    def __init__ (self, codec, rule):
+
+        ##  The codec.
+        self.codec = codec
+
+        ##  The compiled lhs.
+        self.lhs = codec.pattern(rule.lhs)
+
+        ##  The compiled rhs categories.
+        self.rhs = [codec.pattern(cat) for cat in rule.rhs]
+
+        ##  The initial bindings, as masks.
+        self.bindings = codec.encode_bindings(rule.bindings)
+
+
+##  Unify a pattern with an encoded variable-free category.  Returns the
+#   new bindings, or None on failure.  The bindings are copied only if a
+#   value actually changes; otherwise the input list is returned.  The
+#   caller must not modify it.
+
+def bit_unify (pattern, cat, bindings):
+    if pattern.name != cat[0]: return None
+    if pattern.size != len(cat):
+        raise Exception('Categories not conformal: %s %s' % (pattern, cat))
+    for (i, m) in pattern.consts:
+        if not (m & cat[i]): return None
+    out = bindings
+    for (i, v) in pattern.vars:
+        old = out[v]
+        value = old & cat[i]
+        if not value: return None
+        if value != old:
+            if out is bindings: out = list(bindings)
+            out[v] = value
+    return out
+
+##  Substitute bindings (masks) into a pattern.  Returns an encoded
+#   category.
+
+def bit_subst (bindings, pattern):
+    out = [pattern.name]
+    for (v, m) in zip(pattern.slots, pattern.masks):
+        if v is None: out.append(m)
+        else: out.append(bindings[v])
+    return tuple(out)
+
+##  Whether encoded category x subsumes encoded category y.
+
+def bit_subsumes (x, y):
+    if x[0] != y[0] or len(x) != len(y): return False
+    for i in range(1, len(x)):
+        if x[i] & y[i] != y[i]: return False
+    return True
+
+##  Compares the cost of unify() and bit_unify() on a grammar.  The test
+#   pairs are each rhs category of each rule together with each lexical
+#   category of the same type.  Prints and returns the time per call, in
+#   microseconds, for each.
+
+def benchmark_unify (grammar, nreps=100, file=None):
+    codec = grammar.codec
+    pairs = []
+    for rule in grammar.rules:
+        for (k, X) in enumerate(rule.rhs):
+            for entry in grammar.lexicon:
+                Y = entry.pos
+                if Y[0] == X[0] and len(Y) == len(X) and \
+                        not any(isinstance(v, int) for v in Y[1:]):
+                    pairs.append((X, Y, rule.bindings,
+                                  rule.compiled.rhs[k], codec.encode(Y), rule.compiled.bindings))
+    if not pairs:
+        raise Exception('No test pairs')
+    t0 = time()
+    for i in range(nreps):
+        for (X, Y, b, _, _, _) in pairs:
+            unify(X, Y, b)
+    t1 = time()
+    for i in range(nreps):
+        for (_, _, _, P, Z, c) in pairs:
+            bit_unify(P, Z, c)
+    t2 = time()
+    n = nreps * len(pairs)
+    results = [('unify', (t1 - t0) * 1e6 / n), ('bit_unify', (t2 - t1) * 1e6 / n)]
+    for (name, t) in results:
+        print('%-10s %8.3f us/call' % (name, t), file=file)
+    return results
+
+
 #--  Feature Table  ------------------------------------------------------------
 
 ##  A feature definition, which is an entry in a feature table.
@@ -1,7 +1,11 @@
 ##  \package seal.nlp.fsa
 #   Finite-state automata.
 
+import random, tracemalloc
+from array import array
+from time import time
 from .io import iter_records, ispathlike
+from .string import timestr
 
 
 ##  Input is a linked list in reverse
@@ -45,8 +49,7 @@ class Fsa (object):
             ##  Its edges, a list.
             self.edges = []
 
-            ##  Whether it is a final state.
-            self.is_final = False
+            self._is_final = False
 
             ##  Its index.
             self.index = None
@@ -54,6 +57,19 @@ class Fsa (object):
             ##  The fsa that it belongs to.
             self.fsa = None
 
+        ##  Whether it is a final state.  Setting it counts as a modification
+        #   of the fsa.
+
+        @property
+        def is_final (self):
+            return self._is_final
+
+        @is_final.setter
+        def is_final (self, value):
+            self._is_final = value
+            if self.fsa is not None:
+                self.fsa.modified()
+
         ##  Comparison is by string representation.
 
         def __lt__ (self, other):
@@ -80,7 +96,9 @@ class Fsa (object):
             if e is None:
                 e = Fsa.Edge(self, dest, label)
                 self.edges.append(e)
-                if self.fsa and e.is_epsilon(): self.fsa.epsilon_free = False
+                if self.fsa:
+                    if e.is_epsilon(): self.fsa.epsilon_free = False
+                    self.fsa.modified()
             return e
     
         def _find_edge (self, dest, label):
@@ -195,6 +213,8 @@ class Fsa (object):
         ##  The start state.
         self.start = None
 
+        self._compiled = None
+
         ##  Whether the fsa is epsilon-free.
         self.epsilon_free = True
 
@@ -204,6 +224,25 @@ class Fsa (object):
             else:
                 self.initialize_from(initzr)
 
+    ##  The start state.  Setting it counts as a modification.
+
+    @property
+    def start (self):
+        return self._start
+
+    @start.setter
+    def start (self, q):
+        self._start = q
+        self.modified()
+
+    ##  Called whenever a state or edge is added, or the start state or a
+    #   final state changes.  Discards the cached compiled form used by
+    #   accepts_many() (a CompiledDFsa or NFsaEngine).  Code that modifies
+    #   the edge lists directly must call it.
+
+    def modified (self):
+        self._compiled = None
+
     ##  Not implemented.
 
     def initialize_from (self, fsa):
@@ -257,6 +296,18 @@ class Fsa (object):
             else:
                 file.error('Expected one, two, or three fields')
 
+    ##  Write to a file in binary format.  See selkie.nlp.fsabin.
+
+    def save_binary (self, fn):
+        from .fsabin import save_binary
+        save_binary(self, fn)
+
+    ##  Load from a file in binary format.  See selkie.nlp.fsabin.
+
+    def load_binary (self, fn):
+        from .fsabin import load_binary
+        load_binary(fn, self)
+
     ##  The number of states.
 
     def __len__ (self):
@@ -279,6 +330,7 @@ class Fsa (object):
             q.index = len(self.states)
             self.state_dict[name] = q
             self.states.append(q)
+            self.modified()
             if not self.start: self.start = q
             return q
 
@@ -412,6 +464,133 @@ class NFsa (Fsa):
             if q.is_final: return True
         return False
 
+    ##  Returns a list of booleans, one for each input sequence.
+    #   Uses an NFsaEngine, which is created on first use and kept until the
+    #   automaton is modified, so that its transition cache carries over
+    #   from one call to the next.
+
+    def accepts_many (self, inputs):
+        if self._compiled is None:
+            self._compiled = self.engine()
+        return self._compiled.accepts_many(inputs)
+
+    ##  Returns a new NFsaEngine.  Like compile() for a DFsa, the engine is
+    #   a snapshot.
+
+    def engine (self, max_cache=None):
+        return NFsaEngine(self, max_cache)
+
+
+##  Iterates over the positions of the one-bits in an integer.
+
+def _bits (mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+##  Simulates a non-deterministic fsa.  Sets of states are represented as
+#   integer bitmasks, in which bit i stands for the state with index i.
+#   Epsilon closures are computed once per state, and the transition from
+#   a state set on a given label is computed on first use and cached, so
+#   that the engine behaves like a DFsa that is determinized on the fly.
+
+class NFsaEngine (object):
+
+    ##  Constructor.  If max_cache is provided, the transition cache is
+    #   cleared whenever it grows to contain more than max_cache state sets.
+
+    def __init__ (self, fsa, max_cache=None):
+        n = len(fsa.states)
+
+        ##  The maximum number of cached state sets.
+        self.max_cache = max_cache
+
+        ##  Epsilon closure of each state, as a bitmask.
+        self.closure = [0] * n
+
+        ##  A bitmask of the final states.
+        self.final = 0
+
+        ##  For each state, a dict mapping a label to the (closed) bitmask
+        #   of destination states.
+        self.delta = [None] * n
+
+        ##  Maps a state-set bitmask to a dict from labels to bitmasks.
+        self.cache = {}
+
+        ##  Number of transitions served from the cache.
+        self.hits = 0
+
+        ##  Number of transitions computed.
+        self.misses = 0
+
+        for q in fsa.states:
+            mask = 0
+            for r in q.eclosure():
+                mask |= 1 << r.index
+            self.closure[q.index] = mask
+            if q.is_final:
+                self.final |= 1 << q.index
+
+        closure = self.closure
+        for q in fsa.states:
+            table = {}
+            for e in q.edges:
+                if not e.is_epsilon():
+                    label = e.single_label()
+                    table[label] = table.get(label, 0) | closure[e.dest.index]
+            self.delta[q.index] = table
+
+        ##  The start state set, a bitmask.
+        self.start = closure[fsa.start.index] if fsa.start else 0
+
+    ##  The state set reached from the given state set on the given label.
+
+    def step (self, mask, label):
+        row = self.cache.get(mask)
+        if row is None:
+            if self.max_cache is not None and len(self.cache) >= self.max_cache:
+                self.cache.clear()
+            row = self.cache[mask] = {}
+        elif label in row:
+            self.hits += 1
+            return row[label]
+        self.misses += 1
+        delta = self.delta
+        out = 0
+        for i in _bits(mask):
+            out |= delta[i].get(label, 0)
+        row[label] = out
+        return out
+
+    ##  Whether the given state set contains a final state.
+
+    def is_final (self, mask):
+        return bool(mask & self.final)
+
+    ##  Whether it accepts the given symbol list.
+
+    def accepts (self, input):
+        mask = self.start
+        step = self.step
+        for sym in input:
+            if not mask: return False
+            mask = step(mask, sym)
+        return bool(mask & self.final)
+
+    ##  Returns a list of booleans, one for each input sequence.
+
+    def accepts_many (self, inputs):
+        accepts = self.accepts
+        return [accepts(input) for input in inputs]
+
+    ##  Converts a bitmask to a list of state indices.
+
+    def indices (self, mask):
+        return list(_bits(mask))
+
 
 ##  An NFsa in which state names equal their indices.
 
@@ -436,6 +615,7 @@ class SimpleFsa (NFsa):
         q.fsa = self
         q.index = i
         self.states.append(q)
+        self.modified()
         if not self.start: self.start = q
         return q
 
@@ -472,6 +652,7 @@ class DFsa (Fsa):
                     return e
             e = Fsa.Edge(self, dest, label)
             self.edges.append(e)
+            if self.fsa: self.fsa.modified()
             return e
     
 
@@ -489,6 +670,126 @@ class DFsa (Fsa):
             if q == None: return False
         return q.is_final
 
+    ##  Returns a list of booleans, one for each input sequence.
+    #   The automaton is compiled on first use, and the CompiledDFsa is kept
+    #   until the automaton is modified.
+
+    def accepts_many (self, inputs):
+        if self._compiled is None:
+            self._compiled = self.compile()
+        return self._compiled.accepts_many(inputs)
+
+    ##  Returns a new CompiledDFsa.  The compiled automaton is a snapshot;
+    #   it does not reflect subsequent changes to this one.
+
+    def compile (self, dense=None):
+        return CompiledDFsa(self, dense)
+
+
+##  A read-only, array-backed version of a DFsa.  Labels are interned
+#   to integers, and states are represented by their indices.
+#   If the transition table is dense enough, it is stored as a flat
+#   array of size nstates * nlabels, with -1 for missing transitions.
+#   Otherwise, it is a dict keyed on state * nlabels + label.
+
+class CompiledDFsa (object):
+
+    ##  The proportion of filled cells required for a dense table, when
+    #   the dense argument to the constructor is None.
+    min_density = 0.2
+
+    ##  Constructor.  The dfsa is a DFsa.  If dense is None, the representation
+    #   is chosen by density of the transition table.
+
+    def __init__ (self, dfsa, dense=None):
+        labels = sorted(dfsa.labels(), key=str)
+
+        ##  Maps a label to its integer code.
+        self.label_codes = dict((lab, i) for (i, lab) in enumerate(labels))
+
+        ##  The labels, indexed by code.
+        self.labels = labels
+
+        ##  The number of states.
+        self.nstates = len(dfsa.states)
+
+        ##  The start state (an index).
+        self.start = dfsa.start.index if dfsa.start else -1
+
+        ##  A bytearray of final-state flags, indexed by state.
+        self.final = bytearray(1 if q.is_final else 0 for q in dfsa.states)
+
+        nlabels = len(labels)
+        nedges = sum(len(q.edges) for q in dfsa.states)
+        ncells = self.nstates * nlabels
+        if dense is None:
+            dense = (ncells == 0 or nedges >= self.min_density * ncells)
+
+        ##  Whether the transition table is a dense array.
+        self.dense = dense
+
+        ##  The transition table: an array if dense, otherwise a dict.
+        self.delta = None
+
+        if dense:
+            delta = array('i', [-1]) * ncells
+        else:
+            delta = {}
+        for q in dfsa.states:
+            base = q.index * nlabels
+            for e in q.edges:
+                delta[base + self.label_codes[e.label]] = e.dest.index
+        self.delta = delta
+
+    ##  The number of states.
+
+    def __len__ (self):
+        return self.nstates
+
+    ##  Translate a symbol sequence to a list of label codes.  Unknown
+    #   symbols map to None.
+
+    def encode (self, input):
+        codes = self.label_codes
+        return [codes.get(sym) for sym in input]
+
+    ##  Next state.  Takes and returns state indices; returns -1 if there
+    #   is no transition.
+
+    def next (self, q, code):
+        if self.dense:
+            return self.delta[q * len(self.labels) + code]
+        else:
+            return self.delta.get(q * len(self.labels) + code, -1)
+
+    ##  Whether it accepts the given symbol list.
+
+    def accepts (self, input):
+        q = self.start
+        if q < 0: return False
+        codes = self.label_codes
+        delta = self.delta
+        n = len(self.labels)
+        if self.dense:
+            for sym in input:
+                c = codes.get(sym)
+                if c is None: return False
+                q = delta[q * n + c]
+                if q < 0: return False
+        else:
+            for sym in input:
+                c = codes.get(sym)
+                if c is None: return False
+                q = delta.get(q * n + c, -1)
+                if q < 0: return False
+        return bool(self.final[q])
+
+    ##  Returns a list of booleans, one for each input sequence.
+
+    def accepts_many (self, inputs):
+        accepts = self.accepts
+        return [accepts(input) for input in inputs]
+
 
 ##  Determinize an fsa.  Non-destructive.  Returns a DFsa.
 
@@ -639,16 +940,157 @@ def pair (i, j):
     elif i < j: return (j, i)
     else: raise Exception("Cannot pair a state with itself")
 
-##  Minimize an automaton.  Instantiates and calls a Minimizer.
+##  Minimize an automaton.  Instantiates and calls a HopcroftMinimizer,
+#   or, if method is 'pairwise', a Minimizer.
 #   Non-destructive.
 
-def minimize (fsa):
+def minimize (fsa, method='hopcroft'):
     if not isinstance(fsa, DFsa):
         raise Exception("Must determinize first")
-    m = Minimizer(fsa)
+    if method == 'hopcroft':
+        m = HopcroftMinimizer(fsa)
+    elif method == 'pairwise':
+        m = Minimizer(fsa)
+    else:
+        raise Exception('Unknown minimization method: %s' % method)
     return m()
 
 
+##  A minimizer that uses Hopcroft's partition-refinement algorithm.
+#   Time is O(k n log n) and space is O(k n), for n states and k labels,
+#   in contrast to the O(n^2) pair table of Minimizer.
+#
+#   As with Minimizer, a sink state (index n) is added, to which all missing
+#   transitions go.  Blocks that are unreachable, or equivalent to the sink,
+#   are dropped from the output, and the output states are numbered in
+#   breadth-first order from the start state.
+
+class HopcroftMinimizer (object):
+
+    ##  Constructor.
+
+    def __init__ (self, fsa):
+
+        ##  The fsa.
+        self.fsa = fsa
+
+        ##  The labels, sorted.
+        self.labels = sorted(fsa.labels(), key=str)
+
+        ##  Number of states, including the sink.
+        self.nstates = len(fsa) + 1
+
+        ##  Reverse edges: for each label index, a dict mapping a state index
+        #   to a list of source state indices.
+        self.inverse = [{} for _ in self.labels]
+
+        ##  The blocks of the partition, a list of sets of state indices.
+        self.blocks = []
+
+        ##  Maps a state index to the index of its block.
+        self.block_of = [None] * self.nstates
+
+        sink = self.nstates - 1
+        codes = dict((lab, i) for (i, lab) in enumerate(self.labels))
+        for q in fsa.states:
+            seen = set()
+            for e in q.edges:
+                c = codes[e.label]
+                seen.add(c)
+                self.inverse[c].setdefault(e.dest.index, []).append(q.index)
+            for c in range(len(self.labels)):
+                if c not in seen:
+                    self.inverse[c].setdefault(sink, []).append(q.index)
+        for c in range(len(self.labels)):
+            self.inverse[c].setdefault(sink, []).append(sink)
+
+    ##  Partition refinement.
+
+    def refine (self):
+        final = set(q.index for q in self.fsa.states if q.is_final)
+        nonfinal = set(range(self.nstates)) - final
+        blocks = self.blocks
+        block_of = self.block_of
+        for b in (nonfinal, final):
+            if b:
+                for i in b:
+                    block_of[i] = len(blocks)
+                blocks.append(b)
+        if len(blocks) < 2: return
+
+        nlabels = len(self.labels)
+        smaller = 0 if len(blocks[0]) <= len(blocks[1]) else 1
+        todo = [(smaller, c) for c in range(nlabels)]
+
+        while todo:
+            (b, c) = todo.pop()
+            inv = self.inverse[c]
+            touched = {}
+            for s in blocks[b]:
+                for r in inv.get(s, ()):
+                    y = block_of[r]
+                    if y in touched: touched[y].add(r)
+                    else: touched[y] = set([r])
+            for (y, sub) in touched.items():
+                old = blocks[y]
+                if len(sub) == len(old): continue
+                rest = old - sub
+                if len(sub) <= len(rest):
+                    (new, blocks[y]) = (sub, rest)
+                else:
+                    (new, blocks[y]) = (rest, sub)
+                z = len(blocks)
+                blocks.append(new)
+                for r in new:
+                    block_of[r] = z
+                # Block y keeps the larger half, so any splitter (y,c) still
+                # on todo now denotes that half.  Adding the smaller half z
+                # suffices in either case.
+                for c1 in range(nlabels):
+                    todo.append((z, c1))
+
+    ##  Create the new automaton.
+
+    def create_newfsa (self):
+        oldfsa = self.fsa
+        newfsa = DFsa()
+        if oldfsa.start is None:
+            return newfsa
+        block_of = self.block_of
+        sink_block = block_of[self.nstates - 1]
+        reps = {}
+        for q in oldfsa.states:
+            b = block_of[q.index]
+            if b not in reps: reps[b] = q
+
+        start_block = block_of[oldfsa.start.index]
+        names = {start_block: '0'}
+        newfsa.state('0')
+        todo = [start_block]
+        i = 0
+        while i < len(todo):
+            b = todo[i]
+            i += 1
+            q = reps.get(b)
+            if q is None: continue
+            q1 = newfsa.state(names[b])
+            if q.is_final: q1.is_final = True
+            for e in sorted(q.edges, key=lambda e: str(e.label)):
+                d = block_of[e.dest.index]
+                if d == sink_block: continue
+                if d not in names:
+                    names[d] = str(len(names))
+                    todo.append(d)
+                q1.edge(newfsa.state(names[d]), e.label)
+        return newfsa
+
+    ##  Call it.  Does refine() and create_newfsa().
+
+    def __call__ (self):
+        self.refine()
+        return self.create_newfsa()
+
+
 ##  A minimizer.
 
 class Minimizer:
@@ -811,3 +1253,86 @@ class History (object):
         if self.inlabel: input.append(self.inlabel)
         if self.outlabel: output.append(self.outlabel)
 
+
+
+#--  Benchmarks  ---------------------------------------------------------------
+
+def _elapsed (f, *args, nreps=1):
+    t0 = time()
+    for _ in range(nreps):
+        value = f(*args)
+    return (time() - t0, value)
+
+##  Compares DFsa.accepts, using per-state edge lists, to CompiledDFsa.accepts
+#   on the given inputs.  Prints a line for each, and returns the list of
+#   (name, seconds) pairs.  The compilation time is reported separately.
+
+def benchmark_accepts (dfsa, inputs, nreps=1, file=None):
+    inputs = list(inputs)
+    (t_compile, cfsa) = _elapsed(dfsa.compile)
+    (t_edges, v1) = _elapsed(lambda: [dfsa.accepts(x) for x in inputs], nreps=nreps)
+    (t_compiled, v2) = _elapsed(cfsa.accepts_many, inputs, nreps=nreps)
+    if v1 != v2:
+        raise Exception('Compiled automaton disagrees with original')
+    results = [('edge lists', t_edges),
+               ('compile', t_compile),
+               ('compiled', t_compiled)]
+    for (name, t) in results:
+        print('%-12s %s' % (name, timestr(t)), file=file)
+    return results
+
+##  Compares NFsa.accepts to an NFsaEngine, and to determinization followed
+#   by CompiledDFsa.accepts.  The engine and determinization times include
+#   construction.
+
+def benchmark_nfsa (nfsa, inputs, nreps=1, file=None):
+    inputs = list(inputs)
+    (t_nfsa, v1) = _elapsed(lambda: [nfsa.accepts(x) for x in inputs], nreps=nreps)
+    (t_engine, v2) = _elapsed(lambda: nfsa.engine().accepts_many(inputs), nreps=nreps)
+    (t_dfsa, v3) = _elapsed(lambda: determinize(nfsa).compile().accepts_many(inputs), nreps=nreps)
+    if not (v1 == v2 == v3):
+        raise Exception('Engine disagrees with NFsa.accepts')
+    results = [('nfsa', t_nfsa),
+               ('engine', t_engine),
+               ('determinize', t_dfsa)]
+    for (name, t) in results:
+        print('%-12s %s' % (name, timestr(t)), file=file)
+    return results
+
+##  Generates a random DFsa with n states, for benchmarking.  Each state has
+#   an edge on each label with probability density, and is final with
+#   probability pfinal.
+
+def random_dfsa (n, labels='abcd', density=0.8, pfinal=0.2, seed=None):
+    rand = random.Random(seed)
+    fsa = DFsa()
+    for i in range(n):
+        fsa.state(str(i))
+    for i in range(n):
+        for lab in labels:
+            if rand.random() < density:
+                fsa.edge(str(i), str(rand.randrange(n)), lab)
+        if rand.random() < pfinal:
+            fsa.final_state(str(i))
+    return fsa
+
+##  Compares time and peak memory of Hopcroft and pairwise minimization on
+#   random automata of the given sizes.  Pairwise minimization is skipped
+#   for automata larger than pairwise_limit.  Returns a list of rows
+#   (n, method, seconds, peak bytes, output size).
+
+def benchmark_minimize (sizes=(100, 1000, 10000), pairwise_limit=1000, seed=0, file=None):
+    rows = []
+    for n in sizes:
+        fsa = random_dfsa(n, seed=seed)
+        for method in ('hopcroft', 'pairwise'):
+            if method == 'pairwise' and n > pairwise_limit: continue
+            tracemalloc.start()
+            try:
+                (t, out) = _elapsed(minimize, fsa, method)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            rows.append((n, method, t, peak, len(out)))
+            print('%8d %-9s %14s %12d %8d' % (n, method, timestr(t), peak, len(out)), file=file)
+    return rows
@@ -0,0 +1,405 @@
+##  \package seal.nlp.fsabin
+#   Binary format for automata.
+#
+#   The file consists of a header followed by a symbol table, a table of
+#   state names, final-state flags, and the transitions in CSR form: a row
+#   array with one entry per state, plus one, giving the position of each
+#   state's first edge in the edge arrays.  The edge arrays are the
+#   destination, input label, and (for transducers) output label of each
+#   edge.  Within a row, edges are sorted by input label, so that lookup can
+#   use binary search.  Labels are symbol codes, with -1 for epsilon and -2
+#   for the wildcard (True).  All integers are 32-bit, in native byte order,
+#   and every section begins on a 4-byte boundary, so that the arrays can
+#   be used in place when the file is memory-mapped.
+
+import mmap, os, sys
+from array import array
+from bisect import bisect_left
+from struct import Struct
+from tempfile import mkdtemp
+from time import time
+from .fsa import Fsa, NFsa, History
+from .fst import Fst, Lattice
+from .string import timestr
+
+
+_MAGIC = b'SLKA'
+_VERSION = 1
+_ORDER = {'little': 0, 'big': 1}[sys.byteorder]
+
+# magic, version, byte order, is_transducer, nstates, nedges, nsymbols,
+# start, nsigma, symbol bytes, name bytes
+_header = Struct('=4sBBBxiiiiiii')
+
+_EPSILON = -1
+_WILDCARD = -2
+
+
+def _pad (n):
+    return (4 - n % 4) % 4
+
+def _label_code (label, codes, symbols):
+    if label is True:
+        return _WILDCARD
+    elif not label:
+        return _EPSILON
+    elif not isinstance(label, str):
+        raise Exception('Binary format requires string labels: %s' % repr(label))
+    c = codes.get(label)
+    if c is None:
+        c = codes[label] = len(symbols)
+        symbols.append(label)
+    return c
+
+def _string_table (strings):
+    offsets = array('i', [0])
+    blob = bytearray()
+    for s in strings:
+        blob.extend(s.encode('utf8'))
+        offsets.append(len(blob))
+    blob.extend(b'\0' * _pad(len(blob)))
+    return (offsets, bytes(blob))
+
+
+##  Write an Fsa or Fst to a file in binary format.
+
+def save_binary (fsa, fn):
+    is_fst = isinstance(fsa, Fst)
+    codes = {}
+    symbols = []
+    rows = array('i', [0])
+    dests = array('i')
+    inlabels = array('i')
+    outlabels = array('i')
+    for q in fsa.states:
+        edges = []
+        for e in q.edges:
+            (inlab, outlab) = (e.inlabel, e.outlabel) if is_fst else (e.label, e.label)
+            edges.append((_label_code(inlab, codes, symbols),
+                          _label_code(outlab, codes, symbols),
+                          e.dest.index))
+        edges.sort()
+        for (i, o, d) in edges:
+            inlabels.append(i)
+            outlabels.append(o)
+            dests.append(d)
+        rows.append(len(dests))
+
+    sigma = getattr(fsa, 'sigma', None)
+    if sigma is None:
+        sigma_codes = array('i')
+        nsigma = -1
+    else:
+        sigma_codes = array('i', sorted(_label_code(s, codes, symbols) for s in sigma))
+        nsigma = len(sigma_codes)
+
+    (symoffsets, symblob) = _string_table(symbols)
+    (nameoffsets, nameblob) = _string_table(str(q) for q in fsa.states)
+    final = bytes(1 if q.is_final else 0 for q in fsa.states)
+    final += b'\0' * _pad(len(final))
+    start = fsa.start.index if fsa.start else -1
+
+    with open(fn, 'wb') as f:
+        f.write(_header.pack(_MAGIC, _VERSION, _ORDER, 1 if is_fst else 0,
+                             len(fsa.states), len(dests), len(symbols),
+                             start, nsigma, len(symblob), len(nameblob)))
+        for a in (symoffsets, nameoffsets):
+            a.tofile(f)
+        f.write(symblob)
+        f.write(nameblob)
+        f.write(final)
+        for a in (rows, dests, inlabels):
+            a.tofile(f)
+        if is_fst:
+            outlabels.tofile(f)
+        sigma_codes.tofile(f)
+
+
+##  A read-only automaton backed by a binary file.  If mapped is true, the
+#   file is memory-mapped, so that processes that load the same file share
+#   its pages; otherwise it is read into memory.  The arrays are used in
+#   place.  Provides the same lookup interface as FrozenFst: arcs(),
+#   epsilons(), is_final(), __call__(), accepts(), lattice(), transduce().
+#   For an Fsa, each edge's label serves as both input and output label.
+
+class BinaryAutomaton (object):
+
+    ##  Constructor.
+
+    def __init__ (self, fn, mapped=True):
+
+        ##  The filename.
+        self.filename = fn
+
+        self._mmap = None
+        with open(fn, 'rb') as f:
+            if mapped:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                buf = memoryview(self._mmap)
+            else:
+                buf = memoryview(f.read())
+
+        # Views into the buffer, which must be released before the
+        # memory map can be closed.
+        self._views = [buf]
+
+        (magic, version, order, is_fst, nstates, nedges, nsymbols, start,
+         nsigma, symbytes, namebytes) = _header.unpack_from(buf, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise Exception('Not a binary automaton file: %s' % fn)
+        if order != _ORDER:
+            raise Exception('Binary automaton has wrong byte order: %s' % fn)
+
+        pos = _header.size
+        def ints (n):
+            nonlocal pos
+            a = buf[pos:pos + 4*n].cast('i')
+            pos += 4*n
+            self._views.append(a)
+            return a
+
+        def raw (n):
+            nonlocal pos
+            b = buf[pos:pos + n]
+            pos += n + _pad(n)
+            self._views.append(b)
+            return b
+
+        ##  Whether it is a transducer.
+        self.is_transducer = bool(is_fst)
+
+        ##  The number of states.
+        self.nstates = nstates
+
+        ##  The start state, an index.
+        self.start = start if start >= 0 else None
+
+        symoffsets = ints(nsymbols + 1)
+        nameoffsets = ints(nstates + 1)
+        symblob = raw(symbytes)
+        self._names = (nameoffsets, raw(namebytes))
+
+        ##  The symbols, indexed by code.
+        self.symbols = [str(symblob[symoffsets[i]:symoffsets[i+1]], 'utf8')
+                        for i in range(nsymbols)]
+
+        ##  Maps a symbol to its code.
+        self.symbol_codes = dict((s, i) for (i, s) in enumerate(self.symbols))
+
+        ##  Final-state flags.
+        self.final = raw(nstates)
+
+        ##  Row offsets into the edge arrays, one per state, plus one.
+        self.rows = ints(nstates + 1)
+
+        ##  Edge destinations.
+        self.dests = ints(nedges)
+
+        ##  Edge input labels, as codes.
+        self.inlabels = ints(nedges)
+
+        ##  Edge output labels, as codes.
+        self.outlabels = ints(nedges) if is_fst else self.inlabels
+
+        ##  The input vocabulary, if any.
+        self.sigma = None
+        if nsigma >= 0:
+            self.sigma = set(self.symbols[c] for c in ints(nsigma))
+
+    ##  Release the memory map.
+
+    def close (self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, t, v, tb):
+        self.close()
+
+    ##  The number of states.
+
+    def __len__ (self):
+        return self.nstates
+
+    ##  The name of a state.
+
+    def name (self, q):
+        (offsets, blob) = self._names
+        return str(blob[offsets[q]:offsets[q+1]], 'utf8')
+
+    ##  Whether the given state is final.
+
+    def is_final (self, q):
+        return bool(self.final[q])
+
+    def _symbol (self, c):
+        if c >= 0: return self.symbols[c]
+        elif c == _WILDCARD: return True
+        else: return None
+
+    ##  Iterates over (inlabel, outlabel, dest) triples for the edges out
+    #   of state q.
+
+    def edges (self, q):
+        sym = self._symbol
+        for k in range(self.rows[q], self.rows[q+1]):
+            yield (sym(self.inlabels[k]), sym(self.outlabels[k]), self.dests[k])
+
+    def _arcs_for (self, lo, hi, c):
+        k = bisect_left(self.inlabels, c, lo, hi)
+        out = []
+        while k < hi and self.inlabels[k] == c:
+            out.append((self._symbol(self.outlabels[k]), self.dests[k]))
+            k += 1
+        return out
+
+    ##  The (outlabel, dest) pairs for edges out of q with no input label.
+
+    def epsilons (self, q):
+        return self._arcs_for(self.rows[q], self.rows[q+1], _EPSILON)
+
+    ##  The (outlabel, dest) pairs for edges out of state q that consume
+    #   the given input label, or no input, if inlabel is None.  Agrees with
+    #   FrozenFst.arcs().
+
+    def arcs (self, q, inlabel):
+        (lo, hi) = (self.rows[q], self.rows[q+1])
+        if not inlabel:
+            return self._arcs_for(lo, hi, _EPSILON)
+        c = self.symbol_codes.get(inlabel)
+        arcs = [] if c is None else self._arcs_for(lo, hi, c)
+        if lo < hi and self.inlabels[lo] == _WILDCARD:
+            if self.sigma: known = inlabel in self.sigma
+            else: known = bool(arcs)
+            if not known:
+                for (out, dest) in self._arcs_for(lo, hi, _WILDCARD):
+                    arcs.append((inlabel if out is True else out, dest))
+        return arcs
+
+    ##  Call it on an input.  Same as Fst.__call__().
+
+    def __call__ (self, input, cutoff=None):
+        todo = [History(0, self.start)]
+        out = []
+        n = 0
+        while todo:
+            if cutoff and n >= cutoff:
+                raise Exception('Exceeded cutoff, possible loop')
+            n += 1
+            h = todo.pop()
+            if h.i == len(input):
+                if self.final[h.state]:
+                    out.append(h.output())
+            else:
+                for (outlabel, dest) in self.arcs(h.state, input[h.i]):
+                    todo.append(History(h.i + 1, dest, outlabel, h))
+            for (outlabel, dest) in self.epsilons(h.state):
+                todo.append(History(h.i, dest, outlabel, h))
+        return out
+
+    ##  Returns a Lattice representing all computations on the input.
+
+    def lattice (self, input):
+        return Lattice(input, self.start, self.arcs, self.is_final)
+
+    ##  Whether it accepts a given input.
+
+    def accepts (self, input):
+        if self.start is None: return False
+        return bool(self.lattice(input).finals)
+
+    ##  Iterates over the distinct outputs, as for Fst.transduce().
+
+    def transduce (self, input, nbest=None):
+        return self.lattice(input).outputs(nbest)
+
+
+##  Memory-map a binary automaton file.  Returns a BinaryAutomaton.
+
+def map_binary (fn):
+    return BinaryAutomaton(fn, mapped=True)
+
+
+##  Load a binary automaton file into a (mutable) automaton.  If fsa is
+#   None, a new one is created, of class Fst or NFsa according to the file.
+
+def load_binary (fn, fsa=None):
+    with BinaryAutomaton(fn, mapped=False) as b:
+        if fsa is None:
+            if b.is_transducer:
+                fsa = Fst()
+            else:
+                fsa = NFsa()
+        elif b.is_transducer and not isinstance(fsa, Fst):
+            raise Exception('File contains a transducer: %s' % fn)
+        is_fst = isinstance(fsa, Fst)
+        states = [fsa.state(b.name(q)) for q in range(len(b))]
+        # The file was written from an automaton, so edges are known to be
+        # distinct, and need not be checked by State.edge().
+        for q in range(len(b)):
+            src = states[q]
+            for (inlab, outlab, dest) in b.edges(q):
+                if is_fst:
+                    e = Fst.Edge(src, states[dest], inlab, outlab)
+                else:
+                    e = Fsa.Edge(src, states[dest], inlab)
+                src.edges.append(e)
+                if e.is_epsilon():
+                    fsa.epsilon_free = False
+            if b.is_final(q):
+                src.is_final = True
+        if b.start is not None:
+            fsa.start = states[b.start]
+        if is_fst:
+            fsa.sigma = b.sigma
+        fsa.modified()
+    return fsa
+
+
+#--  Benchmark  ----------------------------------------------------------------
+
+def _write_text (fsa, fn):
+    with open(fn, 'w') as f:
+        first = True
+        for q in [fsa.start] + [q for q in fsa.states if q is not fsa.start]:
+            if first and not q.edges:
+                print(q, file=f)
+            first = False
+            for e in q.edges:
+                e.write(f)
+            if q.is_final:
+                print(q, file=f)
+
+##  Compares startup time for the text format, load_binary(), and
+#   map_binary().  Writes the automaton in both formats to a temporary
+#   directory (or to dir, if given).  Each mapped automaton is closed
+#   after it is timed.  Returns a list of (name, seconds) pairs.
+
+def benchmark_load (fsa, dir=None, nreps=1, file=None):
+    if dir is None: dir = mkdtemp()
+    txt = os.path.join(dir, 'automaton.txt')
+    bin = os.path.join(dir, 'automaton.bin')
+    _write_text(fsa, txt)
+    save_binary(fsa, bin)
+    cls = fsa.__class__
+    results = []
+    for (name, load) in (('text', lambda: cls(txt)),
+                         ('binary', lambda: load_binary(bin, cls())),
+                         ('mmap', lambda: map_binary(bin))):
+        t = 0.0
+        for _ in range(nreps):
+            t0 = time()
+            x = load()
+            t += time() - t0
+            if isinstance(x, BinaryAutomaton):
+                x.close()
+        results.append((name, t / nreps))
+    for (name, t) in results:
+        print('%-8s %s' % (name, timestr(t)), file=file)
+    return results
@@ -1,4 +1,5 @@
 
+from collections import OrderedDict, deque
 from .fsa import (Fsa, History)
 from .io import iter_records
 
@@ -112,6 +113,25 @@ class Fst (Fsa):
     def accepts (self, input):
         return bool(self.__call__(input))
 
+    ##  Returns a Lattice representing all computations on the input.
+
+    def lattice (self, input):
+        return Lattice(input, self.start, _fst_arcs, _fst_is_final)
+
+    ##  Returns a FrozenFst.  The frozen transducer is a snapshot; it does
+    #   not reflect subsequent changes to this one.
+
+    def freeze (self):
+        return FrozenFst(self)
+
+    ##  Iterates over the outputs for the given input, without duplicates.
+    #   Unlike __call__(), this does not re-explore a state that is reached
+    #   at the same input position by different paths.  If nbest is
+    #   provided, at most nbest outputs are generated.
+
+    def transduce (self, input, nbest=None):
+        return self.lattice(input).outputs(nbest)
+
     ##  Its vocabulary.  One can specify either the 'left' (input) vocabulary,
     #   the 'right' (output) vocabulary, or 'both'.  The default is 'both'.
 
@@ -211,8 +231,10 @@ class Fst (Fsa):
             if e is None:
                 e = Fst.Edge(self, dest, inlabel, outlabel)
                 self.edges.append(e)
-                if self.fsa and (not inlabel) and (not outlabel):
-                    self.fsa.epsilon_free = False
+                if self.fsa:
+                    if (not inlabel) and (not outlabel):
+                        self.fsa.epsilon_free = False
+                    self.fsa.modified()
             return e
     
         def _find_edge (self, dest, inlabel, outlabel):
@@ -337,6 +359,264 @@ class Fst (Fsa):
             out.write(s + "\n")
 
 
+#--  FrozenFst  ----------------------------------------------------------------
+
+##  An immutable, compact version of an Fst.  States are represented by their
+#   indices, and input labels are interned to integers.  Each state has a dict
+#   mapping input label codes to edges, a separate list of edges that consume
+#   no input, and a list of wildcard edges, which are used for an input label
+#   that the state does not mention (or, if sigma is set, that is not in
+#   sigma).  An edge is an (outlabel, dest) pair; a wildcard edge whose
+#   outlabel is True copies the input label.  Hence, there is no need to
+#   globalize wildcards.
+
+class FrozenFst (object):
+
+    ##  Constructor.
+
+    def __init__ (self, fst):
+        n = len(fst.states)
+
+        ##  Maps an input label to its code.
+        self.label_codes = {}
+
+        ##  The input labels, indexed by code.
+        self.labels = []
+
+        ##  For each state, a dict from label code to a tuple of edges.
+        self.delta = [None] * n
+
+        ##  For each state, a tuple of the edges with no input label.
+        self.epsilons = [None] * n
+
+        ##  For each state, a tuple of wildcard edges.
+        self.wildcards = [None] * n
+
+        ##  Final-state flags, indexed by state.
+        self.final = bytearray(n)
+
+        ##  The input vocabulary, copied from the Fst.
+        self.sigma = fst.sigma
+
+        ##  The start state, an index.
+        self.start = fst.start.index if fst.start else None
+
+        codes = self.label_codes
+        for q in fst.states:
+            table = {}
+            eps = []
+            wild = []
+            for e in q.edges:
+                arc = (e.outlabel, e.dest.index)
+                if e.inlabel is True:
+                    wild.append(arc)
+                elif not e.inlabel:
+                    eps.append(arc)
+                else:
+                    c = codes.get(e.inlabel)
+                    if c is None:
+                        c = codes[e.inlabel] = len(self.labels)
+                        self.labels.append(e.inlabel)
+                    table.setdefault(c, []).append(arc)
+            self.delta[q.index] = dict((c, tuple(arcs)) for (c, arcs) in table.items())
+            self.epsilons[q.index] = tuple(eps)
+            self.wildcards[q.index] = tuple(wild)
+            if q.is_final:
+                self.final[q.index] = 1
+
+    ##  The number of states.
+
+    def __len__ (self):
+        return len(self.delta)
+
+    ##  Whether the given state is final.
+
+    def is_final (self, q):
+        return bool(self.final[q])
+
+    ##  Returns the (outlabel, dest) pairs for edges out of state q that
+    #   consume the given input label, or that consume no input, if inlabel
+    #   is None.  Agrees with Fst.State.__getitem__().
+
+    def arcs (self, q, inlabel):
+        if not inlabel:
+            return self.epsilons[q]
+        c = self.label_codes.get(inlabel)
+        arcs = () if c is None else self.delta[q].get(c, ())
+        wild = self.wildcards[q]
+        if wild:
+            if self.sigma: known = inlabel in self.sigma
+            else: known = bool(arcs)
+            if not known:
+                arcs = arcs + tuple((inlabel if out is True else out, dest)
+                                    for (out, dest) in wild)
+        return arcs
+
+    ##  Call it on an input.  Same as Fst.__call__().
+
+    def __call__ (self, input, cutoff=None):
+        todo = [History(0, self.start)]
+        out = []
+        n = 0
+        while todo:
+            if cutoff and n >= cutoff:
+                raise Exception('Exceeded cutoff, possible loop')
+            n += 1
+            h = todo.pop()
+            if h.i == len(input):
+                if self.final[h.state]:
+                    out.append(h.output())
+            else:
+                for (outlabel, dest) in self.arcs(h.state, input[h.i]):
+                    todo.append(History(h.i + 1, dest, outlabel, h))
+            for (outlabel, dest) in self.epsilons[h.state]:
+                todo.append(History(h.i, dest, outlabel, h))
+        return out
+
+    ##  Whether it accepts a given input.
+
+    def accepts (self, input):
+        return bool(self.lattice(input).finals)
+
+    ##  Returns a Lattice representing all computations on the input.
+
+    def lattice (self, input):
+        return Lattice(input, self.start, self.arcs, self.is_final)
+
+    ##  Iterates over the distinct outputs, as for Fst.transduce().
+
+    def transduce (self, input, nbest=None):
+        return self.lattice(input).outputs(nbest)
+
+
+def _fst_arcs (q, inlabel):
+    return [(e.outlabel, e.dest) for e in q[inlabel]]
+
+def _fst_is_final (q):
+    return q.is_final
+
+
+#--  Lattice  ------------------------------------------------------------------
+
+##  A node in a Lattice: a state reached at a given input position.
+
+class LatticeNode (object):
+
+    ##  Constructor.
+
+    def __init__ (self, i, state):
+
+        ##  Input position.
+        self.i = i
+
+        ##  The state.
+        self.state = state
+
+        ##  Back pointers: a list of (node, outlabel) pairs.
+        self.back = []
+
+    ##  Add a back pointer, unless it is already present.
+
+    def add (self, prev, outlabel):
+        for (p, lab) in self.back:
+            if p is prev and lab == outlabel:
+                return
+        self.back.append((prev, outlabel))
+
+    ##  String representation.
+
+    def __repr__ (self):
+        return '<LatticeNode %s %s>' % (self.i, self.state)
+
+
+##  The computations of a transducer on an input, with a node for each
+#   (position, state) pair that is reached.  Computations that reach the
+#   same pair share the node, so the lattice is built in time proportional
+#   to the input length times the number of edges, however ambiguous
+#   the transducer.
+#
+#   The transducer is given by its start state and two functions:
+#   arcs(state, inlabel) returns a list of (outlabel, dest) pairs, where
+#   inlabel None selects the edges that consume no input, and
+#   is_final(state) says whether a state is final.
+
+class Lattice (object):
+
+    ##  Constructor.  Builds the lattice, position by position.
+
+    def __init__ (self, input, start, arcs, is_final):
+
+        ##  The input.
+        self.input = input
+
+        ##  The columns: for each position, a dict from state to node.
+        self.columns = []
+
+        ##  The nodes at the last position whose state is final.
+        self.finals = []
+
+        column = {}
+        self.start = column[start] = LatticeNode(0, start)
+        for i in range(len(input) + 1):
+            todo = list(column.values())
+            while todo:
+                node = todo.pop()
+                for (outlabel, dest) in arcs(node.state, None):
+                    if dest in column:
+                        column[dest].add(node, outlabel)
+                    else:
+                        column[dest] = new = LatticeNode(i, dest)
+                        new.add(node, outlabel)
+                        todo.append(new)
+            self.columns.append(column)
+            if i == len(input): break
+            next = {}
+            for node in column.values():
+                for (outlabel, dest) in arcs(node.state, input[i]):
+                    if dest in next:
+                        next[dest].add(node, outlabel)
+                    else:
+                        next[dest] = new = LatticeNode(i+1, dest)
+                        new.add(node, outlabel)
+            column = next
+            if not column:
+                for j in range(i+1, len(input) + 1):
+                    self.columns.append({})
+                break
+
+        self.finals = [node for node in self.columns[-1].values()
+                       if is_final(node.state)]
+
+    ##  The number of nodes.
+
+    def __len__ (self):
+        return sum(len(col) for col in self.columns)
+
+    ##  Iterates over the distinct outputs, fewest edges first.  If nbest is
+    #   provided, stops after that many.  The iteration is lazy, so it may be
+    #   used even if there are infinitely many outputs (because of a cycle of
+    #   edges that consume no input but produce output).
+
+    def outputs (self, nbest=None):
+        if nbest is not None and nbest <= 0: return
+        todo = deque((node, ()) for node in self.finals)
+        seen = set((id(node), ()) for node in self.finals)
+        produced = set()
+        while todo:
+            (node, suffix) = todo.popleft()
+            if node is self.start and suffix not in produced:
+                produced.add(suffix)
+                yield list(suffix)
+                if nbest is not None and len(produced) >= nbest: return
+            for (prev, outlabel) in node.back:
+                if outlabel: s1 = (outlabel,) + suffix
+                else: s1 = suffix
+                key = (id(prev), s1)
+                if key not in seen:
+                    seen.add(key)
+                    todo.append((prev, s1))
+
+
 ##  Composes two transducers.
 
 class Composer (object):
@@ -384,6 +664,7 @@ class Composer (object):
             fst1.dump()
             print('fst2:')
             fst2.dump()
+        frozen2 = fst2.freeze()
         out = self.out = Fst()
         out.sigma = sigma
         self.todo = []
@@ -406,17 +687,16 @@ class Composer (object):
                     q.edge(r, e.inlabel, None)
                 # x:y
                 else:
-                    for e2 in q2[e.outlabel]:
-                        r = self.state(e.dest, e2.dest)
-                        if trace: print('    Edge', q, '%s:%s' % (e.inlabel, e2.outlabel), r)
-                        q.edge(r, e.inlabel, e2.outlabel)
+                    for (outlabel, d2) in frozen2.arcs(q2.index, e.outlabel):
+                        r = self.state(e.dest, fst2.states[d2])
+                        if trace: print('    Edge', q, '%s:%s' % (e.inlabel, outlabel), r)
+                        q.edge(r, e.inlabel, outlabel)
 
             # Edges of T2 with epsilon input - advance T2, not T1
-            for e2 in q2.edges:
-                if not e2.inlabel:
-                    r = self.state(q1, e2.dest)
-                    if trace: print('    Edge', q, 'None:%s' % e2.outlabel, r)
-                    q.edge(r, None, e2.outlabel)
+            for (outlabel, d2) in frozen2.epsilons[q2.index]:
+                r = self.state(q1, fst2.states[d2])
+                if trace: print('    Edge', q, 'None:%s' % outlabel, r)
+                q.edge(r, None, outlabel)
 
         out = out.eliminate_epsilons()
         if trace:
@@ -431,6 +711,167 @@ class Composer (object):
 compose = Composer()
 
 
+#--  LazyComposition  ----------------------------------------------------------
+
+##  The composition of a chain of transducers, computed on demand.
+#   Unlike Composer, no composed machine is built.  A state of the composition
+#   is a tuple of state indices, one per transducer, and its outgoing edges are
+#   computed only when an input reaches it.  Expanded edges are cached, keyed
+#   on (state, inlabel), in an LRU cache that holds at most cache_size entries.
+#
+#   The components are frozen (see FrozenFst), so wildcards need not be
+#   globalized.
+
+class LazyComposition (object):
+
+    ##  Constructor.  Takes one or more Fsts, in order of application.
+
+    def __init__ (self, *fsts, cache_size=10000):
+        if not fsts:
+            raise Exception('No transducers given')
+
+        ##  The component transducers, frozen.
+        self.fsts = [fst if isinstance(fst, FrozenFst) else fst.freeze()
+                     for fst in fsts]
+
+        ##  The maximum number of cache entries.
+        self.cache_size = cache_size
+
+        ##  Maps (state, inlabel) to a tuple of (outlabel, dest) pairs.
+        self.cache = OrderedDict()
+
+        ##  Number of expansions served from the cache.
+        self.hits = 0
+
+        ##  Number of expansions computed.
+        self.misses = 0
+
+        ##  The start state, a tuple of state indices.
+        self.start = tuple(fst.start for fst in self.fsts)
+
+    ##  Whether the given composite state is final.
+
+    def is_final (self, state):
+        for (fst, i) in zip(self.fsts, state):
+            if not fst.final[i]:
+                return False
+        return True
+
+    ##  Returns a tuple of (outlabel, dest) pairs for edges out of the given
+    #   composite state that consume the given input label.  If inlabel is
+    #   None, returns the edges that consume no input.
+
+    def arcs (self, state, inlabel):
+        key = (state, inlabel)
+        cache = self.cache
+        if key in cache:
+            self.hits += 1
+            cache.move_to_end(key)
+            return cache[key]
+        self.misses += 1
+        arcs = tuple(self._arcs(len(self.fsts), state, inlabel))
+        cache[key] = arcs
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return arcs
+
+    # Composes the first k transducers.  The outputs of the composition of
+    # the first k-1 are fed to the k-th; its epsilon-input edges are
+    # available only when no input is consumed.
+
+    def _arcs (self, k, state, inlabel):
+        fst = self.fsts[k-1]
+        q = state[k-1]
+        if k == 1:
+            for (outlabel, dest) in fst.arcs(q, inlabel):
+                yield (outlabel, (dest,))
+        else:
+            prefix = state[:k-1]
+            for (mid, dest) in self._arcs(k-1, prefix, inlabel):
+                if mid is None:
+                    yield (None, dest + (q,))
+                else:
+                    for (outlabel, r) in fst.arcs(q, mid):
+                        yield (outlabel, dest + (r,))
+            if inlabel is None:
+                for (outlabel, r) in fst.epsilons[q]:
+                    yield (outlabel, prefix + (r,))
+
+    ##  Call it on an input.  The return value is a list of outputs,
+    #   as for Fst.__call__().
+
+    def __call__ (self, input, trace=False, cutoff=None):
+        if trace: print('input=', input)
+        todo = [History(0, self.start)]
+        out = []
+        n = 0
+        while todo:
+            if cutoff and n >= cutoff:
+                raise Exception('Exceeded cutoff, possible loop')
+            n += 1
+            h = todo.pop()
+            if trace: print('[%s]' % h.i, 'state', h.state)
+            if h.i == len(input):
+                if self.is_final(h.state):
+                    if trace: print('    accept')
+                    out.append(h.output())
+            else:
+                for (outlabel, dest) in self.arcs(h.state, input[h.i]):
+                    if trace: print('    edge', h.state, '%s:%s' % (input[h.i], outlabel), dest)
+                    todo.append(History(h.i + 1, dest, outlabel, h))
+            for (outlabel, dest) in self.arcs(h.state, None):
+                if trace: print('    edge', h.state, 'None:%s' % outlabel, dest)
+                todo.append(History(h.i, dest, outlabel, h))
+        return out
+
+    ##  Whether it accepts a given input.
+
+    def accepts (self, input):
+        return bool(self.__call__(input))
+
+    ##  Returns a Lattice representing all computations on the input.
+
+    def lattice (self, input):
+        return Lattice(input, self.start, self.arcs, self.is_final)
+
+    ##  Iterates over the distinct outputs for the given input, as for
+    #   Fst.transduce().
+
+    def transduce (self, input, nbest=None):
+        return self.lattice(input).outputs(nbest)
+
+    ##  Builds the part of the composition that is reachable from the start
+    #   state, as an Fst whose state names are the composite states.  The
+    #   input labels tried are those of the first transducer's sigma, if it
+    #   is set, and otherwise those on its edges; a wildcard edge in the
+    #   first transducer is expanded only for those labels.
+
+    def expand (self):
+        first = self.fsts[0]
+        inlabels = sorted(first.sigma if first.sigma else first.labels, key=str)
+        out = Fst()
+        out.state(self.start)
+        todo = [self.start]
+        seen = set(todo)
+        while todo:
+            q = todo.pop()
+            src = out.state(q)
+            if self.is_final(q):
+                src.is_final = True
+            for inlabel in [None] + inlabels:
+                for (outlabel, dest) in self.arcs(q, inlabel):
+                    src.edge(out.state(dest), inlabel, outlabel)
+                    if dest not in seen:
+                        seen.add(dest)
+                        todo.append(dest)
+        return out
+
+    ##  Iterates over the edges of the expanded composition.
+
+    def edges (self):
+        return self.expand().edges()
+
+
 #--  From List  ----------------------------------------------------------------
 
 def _advance_intern (fst, q, i):
@@ -6,6 +6,7 @@ from ..data import path
 from .io import Fn
 from .grammar import Grammar
 from .parser import Parser, Chart
+from .gen import Generator
 
 
 #--  Parse  --------------------------------------------------------------------
@@ -125,6 +126,9 @@ class Dev (object):
         ##  The parser.
         self.parser = None
 
+        ##  The generator, used for round-trip testing.
+        self.generator = None
+
         ##  Whether to trace parsing.
         self.trace_parse = False
 
@@ -197,6 +201,7 @@ class Dev (object):
         fn = self.prefix.g
         self.grammar = Grammar(fn)
         self.parser = Parser(self.grammar)
+        self.generator = Generator(self.grammar)
 
     ##  Parse all sentences.
 
@@ -279,6 +284,31 @@ class Dev (object):
         sent.parse()
         return sent
 
+    ##  Round-trip test.  Each sentence not labeled ungrammatical is parsed,
+    #   and strings are generated from the semantics of each parse.  The
+    #   sentence passes if it is among the first limit strings generated.
+    #   Prints a summary line for each failure, and returns the number of
+    #   failures.
+
+    def roundtrip (self, limit=100):
+        nfail = 0
+        for sent in self.sents:
+            if sent.label == '*': continue
+            target = ' '.join(sent.words)
+            ok = False
+            for tree in self.parser(sent.words) or []:
+                if tree.sem is None: continue
+                for s in self.generator.strings(tree.sem, limit):
+                    if s == target:
+                        ok = True
+                        break
+                if ok: break
+            if not ok:
+                nfail += 1
+                print('[%d] not regenerated: %s' % (sent.i, target))
+        print('Round trip: %d sentences, %d failed' % (len(self.sents), nfail))
+        return nfail
+
     ##  Save translations.
 
     def save_translations (self):
@@ -331,6 +361,7 @@ class Dev (object):
         print('m           Print the model')
         print('s           Print the sentences')
         print('t           Save the translations to %s-trans.txt' % self.prefix)
+        print('rt          Round trip: check that each sentence is regenerated')
         print('h           Print this message')
         print('^D          Quit')
 
@@ -360,6 +391,8 @@ class Dev (object):
         elif com == 't':
             self.save_translations()
             print('Wrote translations to %s-trans.txt' % self.prefix)
+        elif com == 'rt':
+            self.roundtrip()
         elif com == 'm':
             self.print_model()
         elif com == 'trace':
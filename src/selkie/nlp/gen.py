@@ -1,8 +1,9 @@
 ##  \package seal.nlp.gen
 #   Generates random sentences from a grammar.
 
-from .features import unify as unify_cats, subst
-from .avs import unify
+from collections import deque
+from .features import bit_subst
+from .avs import unify, Avs, Variable, Top, Bottom
 from .grammar import Rule, ReverseLexicon
 from .tree import Tree
 
@@ -11,6 +12,127 @@ from .tree import Tree
 TraceOn = False
 
 
+#--  Semantic index  -----------------------------------------------------------
+
+##  The constant equations of a semantic value, as a dict mapping paths to
+#   constants.  A string value is a constant at the empty path.
+
+def sem_constants (sem):
+    if isinstance(sem, str):
+        return {(): sem}
+    elif isinstance(sem, (Avs, Variable)):
+        return dict((eqn[:-1], eqn[-1]) for eqn in sem.constant_equations())
+    else:
+        return {}
+
+##  Whether the constant table c1 subsumes c2: every constant that c1
+#   assigns to a path, c2 assigns to the same path.
+
+def subsumes (c1, c2):
+    for (path, value) in c1.items():
+        if c2.get(path) != value:
+            return False
+    return True
+
+##  The functor of a semantic value: the set of top-level attributes that
+#   have constants beneath them, or the value itself if it is a string.
+
+def sem_functor (constants):
+    return frozenset(path[0] if path else value for (path, value) in constants.items())
+
+##  The functor of a rule's semantics: the top-level attributes that the
+#   rule assigns children to, or fixes constants beneath.
+
+def rule_functor (sem, constants):
+    out = set(sem_functor(constants))
+    for path in getattr(sem, 'targets', None) or ():
+        if path: out.add(path[0])
+    return frozenset(out)
+
+##  A hashable key for a semantic value.  Structures that are identical up to
+#   renaming of variables have the same key.
+
+def sem_key (sem):
+    if isinstance(sem, Avs):
+        return sem.variable_string(0)
+    elif isinstance(sem, Variable):
+        return sem.avs.variable_string(sem.v)
+    else:
+        return sem
+
+
+##  An index of the rules and lexical entries that can realize a semantic
+#   value.  It is computed once per grammar.
+#
+#   A generated tree must realize all of the semantics it was generated
+#   for, and nothing more.  Hence a rule or entry is tried only if its
+#   semantics subsumes the semantics being generated: every attribute
+#   that it introduces, and every constant that it fixes, must be present
+#   in the target.  Rules are keyed on their lhs type and one attribute of
+#   their functor, so that only the rules whose functor can be present are
+#   examined.
+
+class GenIndex (object):
+
+    ##  Constructor.
+
+    def __init__ (self, grammar):
+
+        ##  The grammar.
+        self.grammar = grammar
+
+        ##  Reverse lexicon: maps (part of speech, constant equation) to entries.
+        self.lexicon = ReverseLexicon(grammar.lexicon)
+
+        ##  Maps (lhs type, attribute) to a list of (rule, functor,
+        #   constants) triples.  A rule with an empty functor is filed under
+        #   attribute None.
+        self.rules = {}
+
+        ##  Maps id(entry) to the constants of the entry's semantics.
+        self.entry_constants = {}
+
+        for rule in grammar:
+            sem = rule.sem
+            if sem is None or sem.avs is Top:
+                constants = {}
+            else:
+                constants = sem_constants(sem.avs)
+            functor = rule_functor(sem, constants)
+            key = (rule.lhs[0], min(functor, key=str) if functor else None)
+            self.rules.setdefault(key, []).append((rule, functor, constants))
+        for entry in grammar.lexicon:
+            self.entry_constants[id(entry)] = sem_constants(entry.sem)
+
+    ##  Iterates over the rules with the given lhs type whose semantics
+    #   subsumes the given constants.
+
+    def expansions (self, lhstype, constants):
+        functor = sem_functor(constants)
+        for att in [None] + sorted(functor, key=str):
+            for (rule, required, fixed) in self.rules.get((lhstype, att), ()):
+                if required <= functor and subsumes(fixed, constants):
+                    yield rule
+
+    ##  Returns the distinct lexical entries with the given part of speech
+    #   whose semantics subsumes sem.
+
+    def entries (self, pos, sem, constants):
+        out = []
+        seen = set()
+        for entry in self.lexicon[pos, sem]:
+            if id(entry) in seen: continue
+            seen.add(id(entry))
+            if not subsumes(self.entry_constants[id(entry)], constants): continue
+            if isinstance(entry.sem, Avs) and not isinstance(sem, str):
+                if unify(entry.sem, sem) is Bottom: continue
+            out.append(entry)
+        return out
+
+
+#--  Generator  ----------------------------------------------------------------
+
+
 ##  A node in a generated tree.
 
 class Node (object):
@@ -28,12 +150,19 @@ class Node (object):
         ##  Semantics.
         self.sem = sem
 
+        ##  The constants of the semantics.
+        self.constants = sem_constants(sem)
+
         ##  Callers.
         self.callers = []
 
         ##  Trees.
         self.trees = []
-        
+
+        ##  Set when all trees have been generated.  A complete node is
+        #   kept across calls to the generator.
+        self.complete = False
+
     ##  String representation.
 
     def __repr__ (self):
@@ -43,30 +172,37 @@ class Node (object):
 
     def expand (self):
         g = self.gen.grammar
-        for rule in g.expansions(self.cat[0]):
-            bindings = unify_cats(rule.lhs, self.cat, rule.bindings)
+        index = self.gen.index
+        bits = g.codec.encode(self.cat)
+        constants = self.constants
+        for rule in index.expansions(self.cat[0], constants):
+            bindings = g.codec.unify(rule.compiled.lhs, bits, rule.compiled.bindings)
             if bindings is None: continue
             sem = rule.sem.match(self.sem)
-            if sem is None: continue
+            if sem is None or sem is Bottom: continue
             state = State(self, rule, bindings, sem)
             self.gen.add_state(state)
-        lex = self.gen.lexicon
-        for entry in lex[self.cat[0], self.sem]:
-            if unify_cats(entry.pos, self.cat, []) is None: continue
+        for entry in index.entries(self.cat[0], self.sem, constants):
+            if g.codec.unify(g.codec.pattern(entry.pos), bits, []) is None: continue
             self.add_tree(Tree(entry.pos, word=entry.word, sem=entry.sem))
 
     ##  Add a caller.
 
     def add_caller (self, caller):
         if TraceOn: print('Add caller', repr(caller), 'to', repr(self))
-        self.callers.append(caller)
+        if not self.complete:
+            self.callers.append(caller)
         n = len(self.trees)
         for i in range(n):
             caller.extend(self.trees[i])
 
-    ##  Add a tree.
+    ##  Add a tree.  A tree whose semantics fixes a constant that the
+    #   node's semantics lacks is discarded: no ancestor can remove it.
 
     def add_tree (self, tree):
+        if not subsumes(sem_constants(tree.sem), self.constants):
+            if TraceOn: print('Discard tree', repr(tree), 'at', repr(self))
+            return
         if TraceOn: print('Add tree', repr(tree), 'to', repr(self))
         self.trees.append(tree)
         n = len(self.callers)
@@ -88,7 +224,7 @@ class State (object):
         ##  The rule used.
         self.rule = rule
 
-        ##  Bindings.
+        ##  Bindings, encoded as bitmasks.
         self.bindings = bindings
 
         ##  Semantics.
@@ -110,21 +246,26 @@ class State (object):
     def advance (self):
         i = len(self.children)
         n = len(self.rule.rhs)
+        codec = self.rule.compiled.codec
         if i < n:
-            cat = subst(self.bindings, self.rule.rhs[i])
+            cat = codec.decode(bit_subst(self.bindings, self.rule.compiled.rhs[i]))
             sem = self.sem[1+i]
             node = self.node.gen.intern(cat, sem)
             node.add_caller(self)
         else:
-            cat = subst(self.bindings, self.rule.lhs)
-            sem = self.sem.avs
+            cat = codec.decode(bit_subst(self.bindings, self.rule.compiled.lhs))
+            sem = self.rule.sem
+            if sem is not None and hasattr(sem, '__call__'):
+                sem = sem([child.sem for child in self.children])
+                if sem is None: return
             self.node.add_tree(Tree(cat, self.children, sem=sem))
 
     ##  Called each time the node gets a new tree.
 
     def extend (self, tree):
         i = len(self.children)
-        bindings = unify_cats(self.rule.rhs[i], tree.cat, self.bindings)
+        c = self.rule.compiled
+        bindings = c.codec.unify(c.rhs[i], c.codec.encode(tree.cat), self.bindings)
         if bindings is None: return
         sem = self.sem.extend(tree.sem)
         if sem is None: return
@@ -144,8 +285,17 @@ class Generator (object):
         ##  The grammar.
         self.grammar = grammar
 
+        ##  Index of rules and lexical entries.
+        self.index = GenIndex(grammar)
+
         ##  The lexicon.
-        self.lexicon = ReverseLexicon(grammar.lexicon)
+        self.lexicon = self.index.lexicon
+
+        ##  Key of the semantics being generated.
+        self.target = None
+
+        ##  Completed nodes, kept across calls.
+        self.table = {}
 
         ##  Trees.
         self.trees = None
@@ -153,13 +303,19 @@ class Generator (object):
         ##  Nodes.
         self.nodes = None
 
-        ##  To be processed.
+        ##  To be processed.  It is a queue, so that states are processed
+        #   fairly even when a recursive rule yields unboundedly many trees.
         self.todo = None
 
 
-    ##  Called when a complete tree is created.
+    ##  Called when a complete tree is created.  The tree is kept only if
+    #   its semantics is the one being generated, up to renaming of
+    #   variables.
 
     def extend (self, tree):
+        if sem_key(tree.sem) != self.target:
+            if TraceOn: print('Discard root', repr(tree))
+            return
         if TraceOn: print('Add root', repr(tree))
         self.trees.append(tree)
 
@@ -172,18 +328,22 @@ class Generator (object):
     ##  Returns self, which behaves as an iteration.
 
     def __call__ (self, sem):
+        self.target = sem_key(sem)
         self.trees = []
         self.nodes = {}
-        self.todo = []
+        self.todo = deque()
         node = self.intern(self.grammar.start, sem)
         node.add_caller(self)
         return self
 
-    ##  Intern a cat and semantics.
+    ##  Intern a cat and semantics.  Nodes that were completed in an earlier
+    #   call are reused, with their trees.
 
     def intern (self, cat, sem):
-        key = (cat, sem)
-        if key in self.nodes:
+        key = (cat, sem_key(sem))
+        if key in self.table:
+            return self.table[key]
+        elif key in self.nodes:
             return self.nodes[key]
         else:
             node = Node(self, cat, sem)
@@ -197,14 +357,43 @@ class Generator (object):
     def __next__ (self):
         while not self.trees:
             if self.todo:
-                q = self.todo.pop()
+                q = self.todo.popleft()
                 if TraceOn: print('Process state', q)
                 q.advance()
             else:
+                self.__finish()
                 raise StopIteration
         return self.trees.pop()
 
+    ##  Called when todo is exhausted: every node now has all its trees.
+
+    def __finish (self):
+        for (key, node) in self.nodes.items():
+            node.complete = True
+            node.callers = []
+            self.table[key] = node
+        self.nodes = {}
+
     ##  Returns self.
 
     def __iter__ (self):
         return self
+
+    ##  Iterates over the distinct surface strings for the given semantics.
+    #   Strings are generated lazily; if limit is given, at most that many
+    #   are produced.
+
+    def strings (self, sem, limit=None):
+        seen = set()
+        if limit is not None and limit <= 0: return
+        for tree in self(sem):
+            s = ' '.join(tree.words())
+            if s in seen: continue
+            seen.add(s)
+            yield s
+            if limit is not None and len(seen) >= limit: return
+
+    ##  Discard the table of completed nodes.
+
+    def clear (self):
+        self.table = {}
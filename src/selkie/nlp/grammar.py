@@ -5,8 +5,8 @@ import os
 from .map import Index
 from .io import lines_to_tokens, Fn, Syntax, StringIO
 from .features import Category, join, subsumes, scan_category, Declarations, \
-                          Parameter, basecat, arity
-from .avs import scan_avs, scan_avstate, Copier
+                          Parameter, basecat, arity, CategoryCodec
+from .avs import scan_avs, scan_avstate, Copier, Avs
 from .expr import scan_expr
 
 
@@ -144,10 +144,18 @@ class Rule (object):
     ##  Constructor.
 
     def __init__ (self, lhs=None, rhs=None, sem=None,
-                  index=None, symtab=None, decls=None, source=None, bindings=None):
+                  index=None, symtab=None, decls=None, source=None, bindings=None,
+                  weight=None):
 
         ##  The rule number.
         self.index = index
+
+        ##  The rule weight, if any.  Used by the k-best parse enumerator.
+        self.weight = weight
+
+        ##  The compiled form of the rule (a CompiledRule), set by the grammar.
+        self.compiled = None
+
         if source:
 
             ##  The left-hand side category.
@@ -164,6 +172,8 @@ class Rule (object):
 
             ##  Variables.
             self.variables = source.variables
+
+            if weight is None: self.weight = source.weight
         else:
             self.lhs = None
             self.rhs = None
@@ -307,15 +317,22 @@ class Grammar (object):
 
         ##  The semantic scanner.
         self.semantics = expr_semantics
+
+        ##  Encodes categories as bitmasks, for use by the parser and generator.
+        self.codec = CategoryCodec()
         
         if filename: GrammarLoader(self).load(filename)
 
     ##  Add a rule.
 
-    def define (self, lhs, rhs, sem=None, symtab=None, tokens=None):
+    def define (self, lhs, rhs, sem=None, symtab=None, tokens=None, weight=None):
         i = len(self.rules)
-        rule = Rule(lhs, rhs, sem, index=i, symtab=symtab, decls=self.declarations)
+        rule = Rule(lhs, rhs, sem, index=i, symtab=symtab, decls=self.declarations,
+                    weight=weight)
         self.arities.check_rule(rule, tokens)
+        if self.declarations is not None and self.codec.features is None:
+            self.codec.declare(self.declarations.features)
+        rule.compiled = self.codec.compile_rule(rule)
         self.rules.append(rule)
         self.by_lhs.add(lhs[0], rule)
         if rule.rhs:
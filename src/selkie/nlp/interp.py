@@ -1,8 +1,9 @@
 ##  \package seal.nlp.interp
 #   Semantic interpreter.
 
+from time import time
 from .tree import Tree, is_leaf, getsem, getchildren
-from .expr import Expr, Variable, parse_expr, scan_expr, fresh_variable
+from .expr import Expr, ExprTable, Variable, parse_expr, scan_expr, fresh_variable
 from .grammar import GrammarLoader
 from .parser import Parser
 
@@ -105,14 +106,19 @@ def beta_reduce (x, env):
 
 #--  Replace metavariables  ----------------------------------------------------
 
-##  Replace metavariables throughout the tree.
+##  Replace metavariables throughout the tree.  If seen is provided, it is
+#   a set of ids of subtrees that have already been done, and they are
+#   skipped.  It is used when trees share subtrees.
 
-def tree_replace_metavariables (tree):
+def tree_replace_metavariables (tree, seen=None):
+    if seen is not None:
+        if id(tree) in seen: return
+        seen.add(id(tree))
     sem = getsem(tree)
     children = getchildren(tree)
     if children:
         for c in children:
-            tree_replace_metavariables(c)
+            tree_replace_metavariables(c, seen)
     if sem: tree.sem = replace_metavariables(sem)
 
 ##  Replace metavariables.
@@ -246,9 +252,19 @@ def standardize_variables (expr, replacements=None):
 def hasop (op, expr):
     return isinstance(expr, Expr) and len(expr) > 0 and expr[0] == op
 
-##  Raise quantifiers.
+##  Raise quantifiers.  If memo is provided, it is a dict mapping ids of
+#   input trees to results, and a subtree that has already been done
+#   is not done again.
 
-def raise_quantifiers (tree):
+def raise_quantifiers (tree, memo=None):
+    if memo is not None:
+        if id(tree) not in memo:
+            memo[id(tree)] = (tree, _raise_quantifiers(tree, memo))
+        return memo[id(tree)][1]
+    else:
+        return _raise_quantifiers(tree, memo)
+
+def _raise_quantifiers (tree, memo):
     if is_leaf(tree):
         return tree
     elif hasop('!qs', tree.sem):
@@ -256,7 +272,7 @@ def raise_quantifiers (tree):
             raise Exception("Bad syntax for !qs: " + str(tree.sem))
         qs = []
         tree = Tree(tree.cat,
-                    [excise_quantifiers(c, qs) for c in tree.children],
+                    [excise_quantifiers(c, qs, memo) for c in tree.children],
                     sem=tree.sem[1])
         while qs:
             q = qs.pop()
@@ -266,25 +282,25 @@ def raise_quantifiers (tree):
         return tree
     else:
         return Tree(tree.cat,
-                    [raise_quantifiers(c) for c in tree.children],
+                    [raise_quantifiers(c, memo) for c in tree.children],
                     sem=tree.sem)
 
 ##  Excise quantifiers, leaving traces behind.  This is part of raising
 #   quantifiers.
 
-def excise_quantifiers (tree, qs):
+def excise_quantifiers (tree, qs, memo=None):
     if is_leaf(tree):
         return tree
     elif hasop('!q', tree.sem):
         assert len(tree.sem) > 2
         var = tree.sem[2]
-        qs.append(raise_quantifiers(tree))
+        qs.append(raise_quantifiers(tree, memo))
         return Tree(tree.cat, sem=var)
     elif hasop(tree, '!qs'):
-        return raise_quantifiers(tree)
+        return raise_quantifiers(tree, memo)
     else:
         return Tree(tree.cat,
-                    [excise_quantifiers(c, qs) for c in tree.children],
+                    [excise_quantifiers(c, qs, memo) for c in tree.children],
                     sem=tree.sem)
 
 
@@ -413,6 +429,247 @@ class SemGrammarLoader (GrammarLoader):
             macros.define(op, params, body)
 
 
+#--  Alpha equivalence  --------------------------------------------------------
+
+##  Whether two expressions are the same up to renaming of bound variables.
+#   A binder whose variable list is a list is not equivalent to one whose
+#   variable is bare.
+
+def alpha_equivalent (x, y):
+    return _alpha_equivalent(x, y, {}, {})
+
+def _alpha_equivalent (x, y, m1, m2):
+    if isinstance(x, Variable) and (x in m1 or y in m2):
+        return m1.get(x) is not None and m1.get(x) == m2.get(y)
+    elif not (isinstance(x, Expr) and isinstance(y, Expr)):
+        return x == y
+    elif len(x) != len(y):
+        return False
+    elif len(x) == 3 and x[0] in VariableBindingOperators and x[0] == y[0]:
+        if isinstance(x[1], Expr) != isinstance(y[1], Expr):
+            return False
+        if isinstance(x[1], Expr): (vs1, vs2) = (x[1], y[1])
+        else: (vs1, vs2) = ((x[1],), (y[1],))
+        if len(vs1) != len(vs2):
+            return False
+        (m1, m2) = (dict(m1), dict(m2))
+        for (v1, v2) in zip(vs1, vs2):
+            m1[v1] = m2[v2] = object()
+        return _alpha_equivalent(x[2], y[2], m1, m2)
+    else:
+        for (c1, c2) in zip(x, y):
+            if not _alpha_equivalent(c1, c2, m1, m2):
+                return False
+        return True
+
+
+#--  Memoized interpretation  --------------------------------------------------
+
+##  Shared intermediate results for the interpretation of many trees.
+#   Expressions are hash-consed in an ExprTable, and the expression-level
+#   steps (gap replacement, macro expansion, and beta-normalization) are
+#   memoized on the interned expressions.  Hence a subexpression that occurs
+#   in many parses of a sentence is processed once.
+#
+#   Unlike simplify(), normal_form() does not copy a lambda expression each
+#   time it is substituted for a variable.  Instead, substitution renames a
+#   bound variable when it would capture a free variable of the value being
+#   substituted.  The new name is derived from the old one, not taken from
+#   fresh_variable(), so the result of normal_form() is a function of its
+#   input, and can be memoized.
+#
+#   A cache is meant to be used for one batch of trees, and discarded
+#   afterwards; it grows with the number of distinct expressions.
+
+class InterpCache (object):
+
+    ##  Constructor.
+
+    def __init__ (self):
+
+        ##  The hash-consing table.
+        self.exprs = ExprTable()
+
+        ##  Memo tables, one for each step.  The keys are ids of interned
+        #   expressions.
+        self.memo = {'translation': {}, 'gaps': {}, 'macros': {}, 'normalize': {}}
+
+        ##  Free variables of interned expressions, by id.
+        self.free = {}
+
+        ##  Maps a step name to its number of memo hits.
+        self.hits = dict((step, 0) for step in self.memo)
+
+        ##  Maps a step name to its number of memo misses.
+        self.misses = dict((step, 0) for step in self.memo)
+
+    ##  Discard all cached results and reset the counters.
+
+    def clear (self):
+        self.__init__()
+
+    ##  Intern an expression.
+
+    def intern (self, x):
+        return self.exprs.intern(x)
+
+    def __lookup (self, step, key):
+        table = self.memo[step]
+        if key in table:
+            self.hits[step] += 1
+            return table[key]
+        else:
+            self.misses[step] += 1
+            return None
+
+    ##  Memoized translation().  The table is a dict mapping tree ids to
+    #   translations; it is only valid for the trees of one sentence.
+
+    def translation (self, tree, table):
+        if id(tree) in table:
+            self.hits['translation'] += 1
+            return table[id(tree)][1]
+        self.misses['translation'] += 1
+        if is_leaf(tree):
+            expr = self.intern(tree.sem)
+        else:
+            childsems = [self.translation(c, table) for c in tree.children]
+            expr = self.intern(fuse(tree.sem, childsems))
+        table[id(tree)] = (tree, expr)
+        return expr
+
+    ##  Memoized replace_gaps().
+
+    def replace_gaps (self, expr, g=None):
+        if expr == '$g':
+            if g is None:
+                raise Exception('Unbound gap')
+            return g
+        elif not isinstance(expr, Expr):
+            return expr
+        key = (id(expr), id(g))
+        value = self.__lookup('gaps', key)
+        if value is not None:
+            return value[1]
+        if len(expr) >= 1 and expr[0] == '!g=':
+            if len(expr) != 3: raise Exception("Bad syntax for !g=: " + str(expr))
+            out = self.replace_gaps(expr[2], g=expr[1])
+        elif len(expr) >= 2 and expr[0] == '!g' and expr[1] == '=':
+            if len(expr) != 4: raise Exception('Bad syntax for !g=: ' + str(expr))
+            out = self.replace_gaps(expr[3], g=expr[2])
+        else:
+            out = self.exprs.make([self.replace_gaps(c, g) for c in expr])
+        self.memo['gaps'][key] = (g, out)
+        return out
+
+    ##  Memoized macro expansion.
+
+    def expand_macros (self, expr, macros):
+        if not isinstance(expr, Expr):
+            return expr
+        out = self.__lookup('macros', id(expr))
+        if out is not None:
+            return out
+        if len(expr) > 0 and isinstance(expr[0], str) and expr[0] in macros.defs:
+            dfn = macros.defs[expr[0]]
+            body = replace_variables(dfn.params, expr[1:], dfn.body)
+            out = self.expand_macros(self.intern(body), macros)
+        else:
+            out = self.exprs.make([self.expand_macros(c, macros) for c in expr])
+        self.memo['macros'][id(expr)] = out
+        return out
+
+    ##  Beta-normal form of an interned expression.  Children are
+    #   normalized first; if the first child is then a lambda expression,
+    #   it is applied to the others, and the result is normalized.  As with
+    #   normalize(), the parameter of a lambda expression is always a list.
+
+    def normal_form (self, expr):
+        if not isinstance(expr, Expr):
+            return expr
+        out = self.__lookup('normalize', id(expr))
+        if out is not None:
+            return out
+        cs = [self.normal_form(c) for c in expr]
+        if len(cs) == 3 and cs[0] == 'lambda' and not isinstance(cs[1], Expr):
+            cs[1] = self.exprs.make([cs[1]])
+        if cs and is_lambda_expr(cs[0]):
+            out = self.normal_form(self.__apply(cs[0], cs[1:]))
+        else:
+            out = self.exprs.make(cs)
+        self.memo['normalize'][id(expr)] = out
+        return out
+
+    def __apply (self, fnc, args):
+        assert len(fnc) == 3
+        params = fnc[1]
+        if not isinstance(params, tuple):
+            params = (params,)
+        return self.substitute(fnc[2], dict(zip(params, args)))
+
+    ##  The set of free variables of an interned expression.
+
+    def free_variables (self, expr):
+        if isinstance(expr, Variable):
+            return frozenset([expr])
+        elif not isinstance(expr, Expr):
+            return frozenset()
+        elif id(expr) in self.free:
+            return self.free[id(expr)]
+        fvs = frozenset().union(*[self.free_variables(c) for c in expr])
+        if len(expr) == 3 and expr[0] in VariableBindingOperators:
+            fvs = fvs.difference(self.__bound(expr))
+        self.free[id(expr)] = fvs
+        return fvs
+
+    def __bound (self, expr):
+        if isinstance(expr[1], Expr): return expr[1]
+        else: return (expr[1],)
+
+    ##  Substitute values for variables in an interned expression.  The
+    #   bindings are a dict mapping variables to interned values.  A
+    #   subexpression that contains none of the variables is returned as is.
+
+    def substitute (self, expr, bindings):
+        if isinstance(expr, Variable) and expr in bindings:
+            return bindings[expr]
+        elif not isinstance(expr, Expr):
+            return expr
+        elif self.free_variables(expr).isdisjoint(bindings):
+            return expr
+        elif len(expr) == 3 and expr[0] in VariableBindingOperators:
+            vars = self.__bound(expr)
+            inner = dict((v, x) for (v, x) in bindings.items() if v not in vars)
+            fvs = frozenset().union(*[self.free_variables(x) for x in inner.values()])
+            avoid = None
+            newvars = []
+            for v in vars:
+                if v in fvs:
+                    if avoid is None:
+                        avoid = set(fvs).union(self.free_variables(expr[2]), vars)
+                    newv = Variable(v + "'")
+                    while newv in avoid:
+                        newv = Variable(newv + "'")
+                    avoid.add(newv)
+                    inner[v] = newv
+                    newvars.append(newv)
+                else:
+                    newvars.append(v)
+            if isinstance(expr[1], Expr): params = self.exprs.make(newvars)
+            else: params = newvars[0]
+            return self.exprs.make([expr[0], params, self.substitute(expr[2], inner)])
+        else:
+            return self.exprs.make([self.substitute(c, bindings) for c in expr])
+
+    ##  Print the hit and miss counts for each step.
+
+    def report (self, file=None):
+        print('%-12s %8s %8s' % ('', 'hits', 'misses'), file=file)
+        for step in self.memo:
+            print('%-12s %8d %8d' % (step, self.hits[step], self.misses[step]), file=file)
+        print('%-12s %8d %8d' % ('exprs', self.exprs.hits, self.exprs.misses), file=file)
+
+
 #--  Interpreter  --------------------------------------------------------------
 
 ##  The semantic interpreter.
@@ -488,7 +745,72 @@ class Interpreter (object):
             print(' ', expr)
         return expr
 
+    ##  Interpret a list of trees, typically all the parses of one sentence.
+    #   The steps are the same as for interpret(), but intermediate results
+    #   are shared: a subtree shared among the trees is processed once, and
+    #   the expression-level steps go through an InterpCache.  A new cache
+    #   is used for each call, unless one is given.  The results are
+    #   equivalent to those of interpret(), up to renaming of bound variables.
+
+    def interpret_all (self, trees, cache=None):
+        if cache is None: cache = InterpCache()
+        seen = set()
+        raised = {}
+        translations = {}
+        out = []
+        for tree in trees:
+            tree_replace_metavariables(tree, seen)
+            tree = raise_quantifiers(tree, raised)
+            expr = cache.translation(tree, translations)
+            expr = cache.replace_gaps(expr)
+            expr = cache.expand_macros(expr, self.macros)
+            expr = cache.normal_form(expr)
+            out.append(standardize_variables(expr))
+        return out
+
+    ##  Parse and interpret each of a list of sentences.  Returns a list
+    #   containing, for each sentence, the list of interpretations, or None
+    #   if there is no parse.  One cache is shared across the sentences of
+    #   the batch; if none is given, a new one is used, and discarded when
+    #   the call returns.
+
+    def batch (self, sents, cache=None):
+        if cache is None: cache = InterpCache()
+        out = []
+        for s in sents:
+            trees = self.parser(s)
+            if trees: out.append(self.interpret_all(trees, cache))
+            else: out.append(None)
+        return out
+
     ##  Reload the parser and definitions.
 
     def reload (self):
         SemGrammarLoader(self).load(self.name)
+
+
+##  Compares interpret() and interpret_all() on the parses of the given
+#   sentences.  Each sentence is parsed once; then all its parses are
+#   interpreted, nreps times, in each way.  A new cache is used for each
+#   pass over the sentences.  Prints the time for each, and the cache
+#   counts for the last pass, and returns the pair of times.
+
+def benchmark (name, sents, nreps=1, file=None):
+    interp = Interpreter(name)
+    parses = [interp.parser(s) or [] for s in sents]
+    t0 = time()
+    for i in range(nreps):
+        for trees in parses:
+            for tree in trees:
+                interp.interpret(tree)
+    t1 = time()
+    for i in range(nreps):
+        cache = InterpCache()
+        for trees in parses:
+            interp.interpret_all(trees, cache)
+    t2 = time()
+    print('%d sentences, %d parses' % (len(sents), sum(len(trees) for trees in parses)), file=file)
+    print('interpret     %8.3f ms' % ((t1 - t0) * 1000), file=file)
+    print('interpret_all %8.3f ms' % ((t2 - t1) * 1000), file=file)
+    cache.report(file=file)
+    return (t1 - t0, t2 - t1)
@@ -2,7 +2,7 @@
 #   Resolution-based theorem prover.
 
 from itertools import chain
-from heapq import heappush, heappop
+from heapq import heappush, heappop, merge
 from .io import string_to_tokens, ispathlike
 from .seq import cross_product, concat, unique
 from .expr import Variable, Expr, parse_expr, load_exprs, scan_expr, fresh_variable, restart_variables
@@ -83,6 +83,9 @@ class Clause (object):
         ##  Weight.
         self.weight = None
 
+        ##  The clause that subsumed this one, if it has been discarded.
+        self.subsumed_by = None
+
     ##  Always true.
 
     def __bool__ (self):
@@ -464,6 +467,107 @@ def clausify (expr, apart=False, trace=False):
     return out
 
 
+#--  Clause index  -------------------------------------------------------------
+
+##  The index key for an atomic formula: its operator and arity.  A formula
+#   that is a bare symbol has arity 0.
+
+def predicate_key (expr):
+    if isinstance(expr, Expr): return (expr[0], len(expr))
+    else: return (expr, 0)
+
+##  The key for the first argument of an atomic formula: the operator and
+#   arity of a complex term, or the symbol itself.  The value is None if
+#   the first argument is a variable or there is none.
+
+def first_argument_key (expr):
+    if not isinstance(expr, Expr) or len(expr) < 2: return None
+    arg = expr[1]
+    if isinstance(arg, Variable): return None
+    elif isinstance(arg, Expr): return (arg[0], len(arg))
+    else: return arg
+
+
+##  An index of clause literals by polarity, predicate, and first argument.
+#   Retrieval returns (clause, j) pairs, where j is the position of the
+#   literal in the clause, in the order in which they were added.
+
+class ClauseIndex (object):
+
+    ##  Constructor.
+
+    def __init__ (self, clauses=[]):
+
+        ##  Maps (polarity, predicate key) to a dict that maps first-argument
+        #   keys to lists of entries (n, clause, j).
+        self.table = {}
+
+        ##  Number of entries added; n orders the entries.
+        self.count = 0
+
+        for clause in clauses:
+            self.add(clause)
+
+    ##  Add all literals of a clause.
+
+    def add (self, clause):
+        for j, lit in enumerate(clause.literals):
+            buckets = self.table.setdefault((lit.polarity, predicate_key(lit.expr)), {})
+            entries = buckets.setdefault(first_argument_key(lit.expr), [])
+            entries.append((self.count, clause, j))
+            self.count += 1
+
+    ##  Remove all entries, e.g. after the clauses have been edited.
+
+    def clear (self):
+        self.table = {}
+        self.count = 0
+
+    # The buckets that may contain a match for expr.  A variable first
+    # argument matches anything when unifying or looking for instances,
+    # but its generalizations must also have a variable there.
+
+    def __entries (self, polarity, expr, unif, gen):
+        buckets = self.table.get((polarity, predicate_key(expr)))
+        if not buckets: return []
+        key = first_argument_key(expr)
+        if key is None:
+            if unif: lists = list(buckets.values())
+            else: lists = [buckets.get(None, [])]
+        elif gen:
+            lists = [buckets.get(key, []), buckets.get(None, [])]
+        else:
+            lists = [buckets.get(key, [])]
+        if len(lists) == 1:
+            return lists[0]
+        else:
+            return merge(*lists)
+
+    def __live (self, entries):
+        for (n, clause, j) in entries:
+            if clause.subsumed_by is None:
+                yield (clause, j)
+
+    ##  Iterate over (clause, j) such that the j-th literal of the clause
+    #   has the given polarity and may unify with expr.  Clauses that have
+    #   been subsumed are skipped.
+
+    def unifiable (self, polarity, expr):
+        return self.__live(self.__entries(polarity, expr, True, True))
+
+    ##  Iterate over (clause, j) such that the j-th literal of the clause
+    #   has the given polarity and may be a generalization of expr.
+
+    def generalizations (self, polarity, expr):
+        return self.__live(self.__entries(polarity, expr, False, True))
+
+    ##  Iterate over (clause, j) such that the j-th literal of the clause
+    #   has the given polarity and may be an instance of expr.
+
+    def instances (self, polarity, expr):
+        return self.__live(self.__entries(polarity, expr, True, False))
+
+
 #--  KB  -----------------------------------------------------------------------
 
 ##  A knowledge base.
@@ -476,6 +580,10 @@ class KB (object):
 
         ##  The clauses.
         self.clauses = []
+
+        ##  Index of the clauses' literals.
+        self.index = ClauseIndex()
+
         if filename:
             self.load(filename)
 
@@ -502,19 +610,27 @@ class KB (object):
 
     def __delitem__ (self, i):
         del self.clauses[i]
+        self.reindex()
 
     ##  Delete the clause with the given ID (clause number).
 
     def delete (self, id):
         for i in range(len(self.clauses)):
-            if clause.index == id:
+            if self.clauses[i].index == id:
                 del self.clauses[i]
+                self.reindex()
                 break
 
     ##  Delete all clauses.
 
     def clear (self):
         self.clauses = []
+        self.index.clear()
+
+    ##  Rebuild the index from scratch.
+
+    def reindex (self):
+        self.index = ClauseIndex(self.clauses)
 
     ##  Iterate over the clauses.
 
@@ -527,6 +643,7 @@ class KB (object):
         if isinstance(expr, str): expr = parse_expr(expr)
         for clause in clausify(expr):
             self.clauses.append(clause)
+            self.index.add(clause)
 
     ##  Answer a query.
 
@@ -663,6 +780,58 @@ def standardize_apart (x, env=None, newvars=None):
         return Expr(standardize_apart(c, env, newvars) for c in x)
 
 
+#--  Subsumption  --------------------------------------------------------------
+
+##  Called for side effect: extends env so that pattern, instantiated by
+#   env, equals expr.  Only variables of pattern are bound.  Raises Fail
+#   on failure.
+
+def match (pattern, expr, env):
+    if isinstance(pattern, Variable):
+        if pattern in env:
+            if env[pattern] != expr: raise Fail
+        else:
+            env[pattern] = expr
+    elif isinstance(pattern, Expr):
+        if not (isinstance(expr, Expr) and len(expr) == len(pattern)): raise Fail
+        for i in range(len(pattern)):
+            match(pattern[i], expr[i], env)
+    elif isinstance(expr, Variable) or pattern != expr: raise Fail
+
+##  Whether clause1 subsumes clause2: some substitution maps every literal
+#   of clause1 to a literal of clause2, and maps the answer literal of
+#   clause1 to that of clause2.  Clause1 may not be longer than clause2,
+#   lest a clause subsume its own factors.
+
+def subsumes (clause1, clause2):
+    if len(clause1) > len(clause2): return False
+    ans1 = clause1.answer_literal
+    ans2 = clause2.answer_literal
+    if (ans1 is None) != (ans2 is None): return False
+    env = {}
+    try:
+        if ans1 is not None:
+            if ans1.polarity != ans2.polarity: return False
+            match(ans1.expr, ans2.expr, env)
+    except Fail:
+        return False
+    return _subsumes(clause1.literals, 0, clause2.literals, env)
+
+def _subsumes (literals, i, targets, env):
+    if i == len(literals): return True
+    lit = literals[i]
+    for target in targets:
+        if target.polarity != lit.polarity: continue
+        newenv = dict(env)
+        try:
+            match(lit.expr, target.expr, newenv)
+        except Fail:
+            continue
+        if _subsumes(literals, i+1, targets, newenv):
+            return True
+    return False
+
+
 #--  Prover  -------------------------------------------------------------------
 
 ##  Instantiate and call a prover.
@@ -709,6 +878,30 @@ class Prover (object):
         ##  How many steps before we give up.
         self.maxsteps = 200
 
+        ##  Whether to discard subsumed clauses.
+        self.subsumption = True
+
+        ##  Index of the usable clauses, for finding resolution partners.
+        self.usable_index = None
+
+        ##  Index of the usable and SOS clauses, for subsumption.
+        self.retained = None
+
+        ##  Number of clauses added to usable, counting initial ones.
+        self.nused = 0
+
+        ##  Number of clauses resolved.
+        self.nsteps = 0
+
+        ##  Number of clauses generated by resolution and factoring.
+        self.ngenerated = 0
+
+        ##  Number of new clauses discarded by forward subsumption.
+        self.nforward = 0
+
+        ##  Number of retained clauses discarded by backward subsumption.
+        self.nbackward = 0
+
     ##  Run it.
 
     def __call__ (self, query, trace=False, maxsteps=None):
@@ -724,12 +917,14 @@ class Prover (object):
             print('SOS')
             for clause in self.sos: print(clause)
         while self.sos:
-            if len(self.usable) >= maxsteps:
+            if self.nused >= maxsteps:
                 if self.tracing: print('OUT OF TIME')
                 break
             self.step()
         self.usable = None
         self.sos = None
+        self.usable_index = None
+        self.retained = None
         return list(self.answers.keys())
         
     ##  Set the query.  Clear the usable list and initialize the SOS list.
@@ -739,17 +934,26 @@ class Prover (object):
         clauses = clausify(query, apart=True)
         self.usable = []
         self.sos = []
+        self.usable_index = ClauseIndex()
+        self.retained = ClauseIndex()
+        self.nsteps = self.ngenerated = self.nforward = self.nbackward = 0
         for clause in clauses:
             if clause.answer_literal is None:
                 self.usable.append(clause)
+                self.usable_index.add(clause)
             else:
                 clause.weight = 0
                 self.sos.append(clause)
+            self.retained.add(clause)
+        self.nused = len(self.usable)
 
-    ##  Do one resolution.
+    ##  Do one resolution.  Resolution partners for the first literal are
+    #   looked up in the KB index and the usable index, in the same order
+    #   as a scan of the KB followed by the usable list.
 
     def step (self):
         clause = heappop(self.sos)
+        if clause.subsumed_by is not None: return
         if self.tracing: print('Resolve', clause)
         if len(clause) == 0:
             if self.tracing: print('ANSWER', clause)
@@ -760,21 +964,73 @@ class Prover (object):
                 self.answers[ans] = [clause]
         else:
             # will we ever want to resolve a clause with itself?
+            self.nsteps += 1
+            self.nused += 1
             self.usable.append(clause)
-            for other in chain(self.kb, self.usable):
-                for j in range(len(other)):
-                    newclause = resolve(clause, 0, other, j)
-                    if newclause: self.add(newclause)
+            self.usable_index.add(clause)
+            lit = clause[0]
+            partners = chain(self.kb.index.unifiable(not lit.polarity, lit.expr),
+                             self.usable_index.unifiable(not lit.polarity, lit.expr))
+            # materialize: adding clauses may discard usable clauses
+            for (other, j) in list(partners):
+                newclause = resolve(clause, 0, other, j)
+                if newclause: self.add(newclause)
             for newclause in factor(clause):
                 self.add(newclause)
 
-    ##  Add a new clause.
+    ##  Add a new clause, unless it is subsumed by a clause already in the
+    #   KB, usable list, or SOS.  Retained clauses that the new clause
+    #   subsumes are discarded.
 
     def add (self, newclause):
+        self.ngenerated += 1
+        if self.subsumption:
+            old = self.subsumer(newclause)
+            if old is not None:
+                newclause.subsumed_by = old
+                self.nforward += 1
+                if self.tracing: print('    subsumed by %d:' % old.index, newclause)
+                return
+            self.discard_subsumed(newclause)
         self.set_weight(newclause)
         heappush(self.sos, newclause)
+        self.retained.add(newclause)
         if self.tracing: print('   ', newclause)
 
+    ##  Find a clause that subsumes the given one.  Only clauses whose first
+    #   literal may match one of its literals need to be checked.
+
+    def subsumer (self, clause):
+        for lit in clause.literals:
+            for index in (self.kb.index, self.retained):
+                for (old, j) in index.generalizations(lit.polarity, lit.expr):
+                    if j == 0 and subsumes(old, clause):
+                        return old
+        return None
+
+    ##  Discard retained clauses that the given clause subsumes.  Their first
+    #   literal is not necessarily the one matched, so every literal
+    #   that is an instance of the new clause's first literal is a candidate.
+
+    def discard_subsumed (self, clause):
+        if len(clause) == 0: return
+        lit = clause[0]
+        for (old, j) in list(self.retained.instances(lit.polarity, lit.expr)):
+            if old.subsumed_by is None and old is not clause and subsumes(clause, old):
+                old.subsumed_by = clause
+                self.nbackward += 1
+                if self.tracing: print('    discard %d:' % old.index, old)
+                self.usable = [c for c in self.usable if c is not old]
+
+    ##  Summary of the work done for the last query.
+
+    def report (self):
+        lines = ['Steps            %d' % self.nsteps,
+                 'Generated        %d' % self.ngenerated,
+                 'Forward pruned   %d' % self.nforward,
+                 'Backward pruned  %d' % self.nbackward]
+        return '\n'.join(lines)
+
     ##  Set the weight for a clause.
 
     def set_weight (self, clause):
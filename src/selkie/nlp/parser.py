@@ -1,13 +1,16 @@
 ##  \package seal.nlp.parser
 #   Chart parser.
 
-import os
+import os, heapq
+from time import time
+from concurrent.futures import ProcessPoolExecutor
 from .seq import cross_product, product
 from .map import Index
 from .io import OutputList
-from .features import unify, subst
+from .features import subst, basecat, bit_subst
 from .grammar import Grammar, Lexicon
 from .tree import Tree
+from .string import timestr
 from itertools import chain
 
 
@@ -40,6 +43,9 @@ class Node (object):
 
         ##  Semantics.
         self.sem = sem
+
+        ##  The category encoded as bitmasks (see CategoryCodec), set by the parser.
+        self.bits = None
         timestep += 1
 
         ##  Sequence number.  Nodes and edges are numbered in the order created.
@@ -76,7 +82,7 @@ class Edge (object):
         ##  The children collected so far.
         self.expansion = expansion
 
-        ##  Current bindings.
+        ##  Current bindings, encoded as bitmasks.
         self.bindings = bindings
         timestep += 1
 
@@ -93,7 +99,7 @@ class Edge (object):
         for cat in self.rule.rhs[len(self.expansion):]:
             s += ' ' + str(cat)
         s += ' {'
-        s += ' '.join(str(val) for val in self.bindings)
+        s += ' '.join(str(val) for val in self.rule.compiled.codec.decode_bindings(self.bindings))
         s += '})'
         return s
 
@@ -131,15 +137,139 @@ class Edge (object):
             return sem
 
 
+#--  Left-corner table  ---------------------------------------------------------
+
+##  The left-corner relation of a grammar, on base categories.  X lc-predicts
+#   Y if X = Y, or if there is a rule Z -> Y beta such that X lc-predicts Z.
+
+class LCTable (object):
+
+    ##  Constructor.
+
+    def __init__ (self, grammar):
+
+        ##  The grammar.
+        self.grammar = grammar
+
+        ##  Set of pairs (X,Y) such that X lc-predicts Y.
+        self.pairs = set()
+
+        ##  Maps X to the set of categories that X lc-predicts.
+        self.corners = {}
+
+        for X in grammar_categories(grammar):
+            self.add_pair(X, X)
+
+    ##  Add the pair (Y,Z), and the pairs (X,Z) for all continuations
+    #   X -> Y beta.  Uses an explicit stack rather than recursion.
+
+    def add_pair (self, Y, Z):
+        todo = [(Y, Z)]
+        while todo:
+            (Y, Z) = todo.pop()
+            if (Y, Z) in self.pairs: continue
+            self.pairs.add((Y, Z))
+            if Y in self.corners: self.corners[Y].add(Z)
+            else: self.corners[Y] = set([Z])
+            for rule in self.grammar.continuations(Y):
+                todo.append((rule.lhs[0], Z))
+
+    ##  Whether expected category X lc-predicts category Y.  Either may be
+    #   a Category or a string.
+
+    def predicts (self, X, Y):
+        return (basecat(X), basecat(Y)) in self.pairs
+
+    ##  The set of base categories that X lc-predicts.
+
+    def predictions (self, X):
+        return self.corners.get(basecat(X), ())
+
+    ##  Listing of the table.
+
+    def __str__ (self):
+        lines = []
+        for X in sorted(self.corners):
+            lines.append('%s: %s' % (X, ' '.join(sorted(self.corners[X]))))
+        return '\n'.join(lines)
+
+
+##  The base categories that occur in a grammar, whether in rules or in the
+#   lexicon.
+
+def grammar_categories (grammar):
+    cats = set()
+    for rule in grammar.rules:
+        cats.add(rule.lhs[0])
+        for cat in rule.rhs:
+            cats.add(cat[0])
+    for entry in grammar.lexicon:
+        cats.add(entry.pos[0])
+    if grammar.start is not None:
+        cats.add(grammar.start[0])
+    return cats
+
+
+#--  First-child index  --------------------------------------------------------
+
+##  Maps a full category (with features) to the rules that it can start,
+#   together with the bindings (as bitmasks) that result from unifying it
+#   with the first rhs category.  Entries are computed on first use and
+#   kept, so each category is unified with each continuation rule only once
+#   per grammar.  Failures are kept too, with bindings None, so that tracing
+#   still works.
+
+class FirstChildIndex (object):
+
+    ##  Constructor.
+
+    def __init__ (self, grammar):
+
+        ##  The grammar.
+        self.grammar = grammar
+
+        ##  Maps a Category to a list of (rule, bindings) pairs.
+        self.table = {}
+
+    ##  The (rule, bindings) pairs for the given category.
+
+    def __getitem__ (self, cat):
+        if cat in self.table:
+            return self.table[cat]
+        matches = []
+        codec = self.grammar.codec
+        bits = codec.encode(cat)
+        for rule in self.grammar.continuations(cat[0]):
+            c = rule.compiled
+            try:
+                bindings = codec.unify(c.rhs[0], bits, c.bindings)
+            except Exception as e:
+                lines = ['unifying %s %s' % (rule.rhs[0], cat)]
+                lines.append('  rule %s' % rule)
+                lines.append('  %s' % str(e))
+                raise Exception('\n'.join(lines))
+            matches.append((rule, bindings))
+        self.table[cat] = matches
+        return matches
+
+    ##  The number of categories indexed so far.
+
+    def __len__ (self):
+        return len(self.table)
+
+
 #--  Parser  -------------------------------------------------------------------
 
-##  The parser.
+##  The parser.  If filter is true, a left-corner table is used to reject
+#   nodes and edges that cannot be used given the edges to their left.
+#   If forest is true, a call returns a Forest rather than a list of trees.
+#   If lazy is true, a call returns an iterator over trees (see iter_trees).
 
 class Parser (object):
 
     ##  Constructor.
 
-    def __init__ (self, grammar=None, limit=None):
+    def __init__ (self, grammar=None, limit=None, filter=False, forest=False, lazy=False):
         if isinstance(grammar, Grammar):
 
             ##  Filename.
@@ -179,6 +309,37 @@ class Parser (object):
         ##  Parsing actions.
         self.actions = {'node': self.add_node, 'edge': self.add_edge}
 
+        ##  Whether to use the left-corner filter.
+        self.filter = filter
+
+        ##  Whether to return a packed forest instead of a list of trees.
+        self.forest = forest
+
+        ##  Whether to return an iterator over trees instead of a list.
+        self.lazy = lazy
+
+        ##  The first-child index.  Rebuilt if the grammar changes.
+        self.first_index = None
+
+        ##  The left-corner table, if filtering.  Rebuilt if the grammar changes.
+        self.lctable = None
+
+        ##  Base categories expected at each position (filtering only).
+        self.expected = None
+
+        ##  Base categories predicted at each position (filtering only).
+        self.predicted = None
+
+        ##  Number of edges created for the current sentence.
+        self.nedges = 0
+
+    ##  The constructor keyword arguments, as a dict.  Parser(grammar,
+    #   **p.options()) creates a parser configured like p.
+
+    def options (self):
+        return {'limit': self.limit, 'filter': self.filter,
+                'forest': self.forest, 'lazy': self.lazy}
+
     ##  Call it on input words.
 
     def __call__ (self, words, trace=False):
@@ -190,7 +351,12 @@ class Parser (object):
                 self.step()
         s = self.grammar.start
         if (s, 0, n) in self.chart:
-            return unwind(self.chart[s, 0, n], self.limit)
+            if self.forest:
+                return Forest(self.chart[s, 0, n], self.words)
+            elif self.lazy:
+                return iter_trees(self.chart[s, 0, n])
+            else:
+                return unwind(self.chart[s, 0, n], self.limit)
         else:
             return None
 
@@ -206,6 +372,36 @@ class Parser (object):
         self.edges.clear()
         self.trace = trace
         self.todo = []
+        self.nedges = 0
+        if self.first_index is None or self.first_index.grammar is not self.grammar:
+            self.first_index = FirstChildIndex(self.grammar)
+            self.lctable = None
+        if self.filter:
+            if self.lctable is None:
+                self.lctable = LCTable(self.grammar)
+            self.expected = [set() for i in range(len(words) + 1)]
+            self.predicted = [set() for i in range(len(words) + 1)]
+            self.expect(self.grammar.start, 0)
+
+    ##  Record that the given category is expected at position i.
+
+    def expect (self, cat, i):
+        X = basecat(cat)
+        if X not in self.expected[i]:
+            self.expected[i].add(X)
+            self.predicted[i].update(self.lctable.predictions(X))
+
+    ##  Whether the given category is predicted at position i.  Always true
+    #   if not filtering.
+
+    def is_expected (self, cat, i):
+        return (not self.filter) or basecat(cat) in self.predicted[i]
+
+    ##  The number of nodes and the number of edges created for the current
+    #   sentence.
+
+    def chart_size (self):
+        return (len(self.chart), self.nedges)
 
     ##  Add a todo item.
 
@@ -228,25 +424,28 @@ class Parser (object):
         if (not ents) and self.trace:
             print('Unknown Word:', w, file=self.trace_output)
         for entry in ents:
-            self.add('node', entry.pos, entry, j-1, j)
+            if self.is_expected(entry.pos, j-1):
+                self.add('node', self.grammar.codec.intern(entry.pos), entry, j-1, j)
+            elif self.trace:
+                print('Filter Node %d.%s.%d' % (j-1, entry.pos, j), w, entry.pos, file=self.trace_output)
 
     ##  Find rules that this node can be the first child of.
 
     def start (self, node):
-        for rule in self.grammar.continuations(node.cat[0]):
-            try:
-                bindings = unify(rule.rhs[0], node.cat, rule.bindings)
-            except Exception as e:
-                lines = ['**Error in start %s' % node]
-                lines.append('  unifying %s %s' % (rule.rhs[0], node.cat))
-                lines.append('  rule %s' % rule)
-                lines.append('  %s' % str(e))
-                raise Exception('\n'.join(lines))
+        try:
+            matches = self.first_index[node.cat]
+        except Exception as e:
+            raise Exception('**Error in start %s\n  %s' % (node, e))
 
+        for (rule, bindings) in matches:
             edge = None
             if bindings is None:
                 if self.trace_rule == rule.index:
                     print('Start:', node, '!~', subst(rule.bindings, rule.rhs[0]), file=self.trace_output)
+            elif not self.is_expected(rule.lhs, node.i):
+                if self.trace:
+                    rest = ''.join(' ' + str(cat) for cat in rule.rhs[1:])
+                    print('Filter Edge (%s -> %s *%s)' % (rule.lhs, node, rest), file=self.trace_output)
             else:
                 edge = Edge(None, rule, [node], bindings)
                 if self.trace_rule == rule.index:
@@ -256,9 +455,11 @@ class Parser (object):
     ##  Find edges that can combine with this node.
 
     def combine (self, node):
+        codec = self.grammar.codec
         for edge in self.edges[node.i, node.cat[0]]:
             try:
-                bindings = unify(edge.afterdot(), node.cat, edge.bindings)
+                pattern = edge.rule.compiled.rhs[len(edge.expansion)]
+                bindings = codec.unify(pattern, node.bits, edge.bindings)
             except Exception as e:
                 lines = ['**Error unifying %s %s in combine %s' %
                          (edge.afterdot(), node.cat, node)]
@@ -278,7 +479,8 @@ class Parser (object):
     def complete (self, edge):
         if self.trace_rule == edge.rule.index:
             print('Complete', edge, file=self.trace_output)
-        cat = subst(edge.bindings, edge.cat())
+        codec = edge.rule.compiled.codec
+        cat = codec.decode(bit_subst(edge.bindings, edge.rule.compiled.lhs))
         self.add('node', cat, edge, edge.start(), edge.end())
 
     ##  Add a new node.  But if one already exists, just add a new expansion.
@@ -290,6 +492,7 @@ class Parser (object):
             if self.trace: print('Add Expansion', node, expansion, file=self.trace_output)
         else:
             node = Node(X, expansion, i, j)
+            node.bits = self.grammar.codec.encode(X)
             self.chart[X,i,j] = node
             if self.trace: print('Add Node', node, expansion, file=self.trace_output)
             self.combine(node)
@@ -299,9 +502,12 @@ class Parser (object):
 
     def add_edge (self, edge):
         if self.trace: print('Add Edge', edge, file=self.trace_output)
+        self.nedges += 1
         cat = edge.afterdot()
         if cat:
             self.edges.add((edge.end(), cat[0]), edge)
+            if self.filter:
+                self.expect(cat, edge.end())
         else:
             self.complete(edge)        
 
@@ -318,6 +524,88 @@ class Parser (object):
         self.grammar = Grammar(self.filename)
 
 
+#--  Forest  -------------------------------------------------------------------
+
+##  A packed parse forest.  It is a wrapper around the root Node of the
+#   chart; trees are not extracted until asked for.
+
+class Forest (object):
+
+    ##  Constructor.
+
+    def __init__ (self, root, words=None):
+
+        ##  The root node.
+        self.root = root
+
+        ##  The input words.
+        self.words = words
+
+    ##  Iterates over the nodes reachable from the root, each once.
+
+    def nodes (self):
+        seen = set()
+        todo = [self.root]
+        while todo:
+            node = todo.pop()
+            if id(node) in seen: continue
+            seen.add(id(node))
+            yield node
+            for e in node.expansions:
+                if isinstance(e, Edge):
+                    todo.extend(reversed(e.expansion))
+
+    ##  The number of nodes in the forest.
+
+    def __len__ (self):
+        return sum(1 for node in self.nodes())
+
+    ##  The number of trees in the forest, computed without extracting them.
+
+    def count (self):
+        counts = {}
+        def _count (node):
+            if id(node) in counts: return counts[id(node)]
+            n = 0
+            for e in node.expansions:
+                if isinstance(e, Edge):
+                    n += product(_count(child) for child in e.expansion)
+                else:
+                    n += 1
+            counts[id(node)] = n
+            return n
+        return _count(self.root)
+
+    ##  Extract the trees.  Signals TooManyParses if there are more than limit.
+
+    def trees (self, limit=None):
+        return unwind(self.root, limit)
+
+    ##  Iterate over the trees, extracting them one at a time.
+
+    def iter_trees (self):
+        return iter_trees(self.root)
+
+    ##  The k best (score, tree) pairs.  See kbest().
+
+    def kbest (self, k, weight=None):
+        return kbest(self.root, k, weight)
+
+    ##  Listing of the nodes and their expansions.
+
+    def __str__ (self):
+        lines = []
+        for node in sorted(self.nodes(), key=lambda x: (x.i, -x.j, x.timestep)):
+            alts = []
+            for e in node.expansions:
+                if isinstance(e, Edge):
+                    alts.append(' '.join(str(child) for child in e.expansion))
+                else:
+                    alts.append(e.word)
+            lines.append('%s -> %s' % (node, ' | '.join(alts)))
+        return '\n'.join(lines)
+
+
 #--  Unwind  -------------------------------------------------------------------
 
 ##  Unwind trees out of the chart.
@@ -350,6 +638,179 @@ def tree_expansions (node_expansion, limit=None):
 class TooManyParses (Exception): pass
 
 
+#--  Lazy enumeration  ---------------------------------------------------------
+
+##  Iterates over the trees of a node, in the same order as unwind(), but
+#   without materializing them all.  Each node's trees are generated on
+#   demand and cached, so that a subtree is built only once, however many
+#   trees it appears in.
+
+def iter_trees (node):
+    return iter(_TreeStream(node, {}))
+
+##  The trees for a node, generated on demand.
+
+class _TreeStream (object):
+
+    ##  Constructor.  The table maps node ids to streams.
+
+    def __init__ (self, node, table):
+        table[id(node)] = self
+
+        ##  The node.
+        self.node = node
+
+        ##  Shared table of streams.
+        self.table = table
+
+        ##  The trees generated so far.
+        self.items = []
+
+        ##  The generator for further trees.
+        self.source = self.generate()
+
+    ##  The stream for a child node.
+
+    def stream (self, node):
+        s = self.table.get(id(node))
+        if s is None: s = _TreeStream(node, self.table)
+        return s
+
+    ##  The i-th tree, or None if there are fewer than i+1.
+
+    def get (self, i):
+        while len(self.items) <= i:
+            if self.source is None: return None
+            try:
+                self.items.append(next(self.source))
+            except StopIteration:
+                self.source = None
+                return None
+        return self.items[i]
+
+    ##  Iterate over all trees.
+
+    def __iter__ (self):
+        i = 0
+        while True:
+            x = self.get(i)
+            if x is None: return
+            yield x
+            i += 1
+
+    ##  Generate the trees, one expansion at a time.
+
+    def generate (self):
+        node = self.node
+        for e in node.expansions:
+            if isinstance(e, Lexicon.Entry):
+                yield Tree(e.pos, word=e.word, sem=e.sem)
+            elif len(e.expansion) == 0:
+                yield Tree(node.cat, [], sem=e.reduce([]))
+            else:
+                streams = [self.stream(child) for child in e.expansion]
+                for childlist in _lazy_product(streams, 0):
+                    yield Tree(node.cat, childlist, sem=e.reduce(childlist))
+
+def _lazy_product (streams, i):
+    if i == len(streams):
+        yield ()
+    else:
+        for x in streams[i]:
+            for rest in _lazy_product(streams, i+1):
+                yield (x,) + rest
+
+##  The default weight function: the rule's weight, or 0 if it has none.
+
+def rule_weight (rule):
+    return rule.weight or 0
+
+##  Iterates over (score, tree) pairs for a node, best first.  The score
+#   of a tree is the sum of the weights of its rules, as given by the
+#   weight function (default: rule_weight), and higher is better; with
+#   log probabilities as weights, the trees come out most probable first.
+#   Lexical entries contribute 0.  Uses the lazy k-best algorithm of Huang
+#   and Chiang (2005): each node keeps a heap of candidates, each a choice
+#   of expansion plus a rank for each child, and a candidate's successors
+#   are pushed only when it is popped.
+
+def iter_best (node, weight=None):
+    if weight is None: weight = rule_weight
+    return iter(_BestStream(node, {}, weight))
+
+##  The k best (score, tree) pairs for a node, best first.
+
+def kbest (node, k, weight=None):
+    out = []
+    if k <= 0: return out
+    for item in iter_best(node, weight):
+        out.append(item)
+        if len(out) >= k: break
+    return out
+
+##  The (score, tree) pairs for a node, generated best first on demand.
+
+class _BestStream (_TreeStream):
+
+    ##  Constructor.
+
+    def __init__ (self, node, table, weight):
+
+        ##  The weight function.
+        self.weight = weight
+
+        _TreeStream.__init__(self, node, table)
+
+    ##  The stream for a child node.
+
+    def stream (self, node):
+        s = self.table.get(id(node))
+        if s is None: s = _BestStream(node, self.table, self.weight)
+        return s
+
+    ##  Score a candidate.  Returns None if some child has too few trees.
+
+    def score (self, e, ranks):
+        total = self.weight(e.rule)
+        for (child, r) in zip(e.expansion, ranks):
+            x = self.stream(child).get(r)
+            if x is None: return None
+            total += x[0]
+        return total
+
+    ##  Generate the (score, tree) pairs in order of decreasing score.
+
+    def generate (self):
+        node = self.node
+        heap = []
+        seen = set()
+        for (k, e) in enumerate(node.expansions):
+            if isinstance(e, Lexicon.Entry):
+                heap.append((0, k, (), Tree(e.pos, word=e.word, sem=e.sem)))
+            else:
+                ranks = (0,) * len(e.expansion)
+                score = self.score(e, ranks)
+                if score is not None:
+                    heap.append((-score, k, ranks, None))
+                    seen.add((k, ranks))
+        heapq.heapify(heap)
+        while heap:
+            (negscore, k, ranks, tree) = heapq.heappop(heap)
+            e = node.expansions[k]
+            if tree is None:
+                children = tuple(self.stream(child).get(r)[1]
+                                 for (child, r) in zip(e.expansion, ranks))
+                tree = Tree(node.cat, children, sem=e.reduce(children))
+                for i in range(len(ranks)):
+                    succ = ranks[:i] + (ranks[i] + 1,) + ranks[i+1:]
+                    if (k, succ) in seen: continue
+                    seen.add((k, succ))
+                    score = self.score(e, succ)
+                    if score is not None:
+                        heapq.heappush(heap, (-score, k, succ, None))
+            yield (-negscore, tree)
+
+
 #--  Fragments  ----------------------------------------------------------------
 
 ##  Get the best fragments out of the chart.
@@ -540,7 +1001,13 @@ class Tester (object):
                 raise Exception("No sentence")
             else:
                 self.sent = sent
-        trees = self.parser(sent)
+        self.show(self.parser(sent))
+
+    ##  Print a list of trees.  A Forest is unpacked into its trees.
+
+    def show (self, trees):
+        if isinstance(trees, Forest):
+            trees = trees.trees(self.parser.limit)
         if trees:
             for tree in trees:
                 print()
@@ -554,15 +1021,235 @@ class Tester (object):
     def reload (self):
         self.parser.grammar = Grammar(self.name)
 
-    ##  Run a batch.
+    ##  Run a batch.  If nworkers is other than 1, the sentences are
+    #   distributed over a pool of processes (see batch_parse).  The
+    #   parsers are configured like this Tester's parser.  If stats is
+    #   true, the chart size and time are printed after each sentence.
+    #   The sentences are read with batch_sents().  An error stops the
+    #   batch, unless keep_errors is true, in which case it is printed in
+    #   place of the trees.
 
-    def batch (self, batchfile=None):
+    def batch (self, batchfile=None, nworkers=1, stats=False, keep_errors=False):
         if batchfile:
             self.batchfile = batchfile
         else:
             batchfile = self.batchfile
-        for sent in open(batchfile):
-            sent = sent.strip()
+        sents = list(batch_sents(batchfile))
+        p = self.parser
+        for r in batch_parse(p.grammar, sents, nworkers, factory=p.__class__,
+                             options=p.options(), keep_errors=keep_errors):
             print()
-            print(sent)
-            self(sent)
+            print(r.sent)
+            if r.error:
+                print()
+                print('(Error: %s)' % r.error)
+            else:
+                self.show(r.trees)
+            if stats:
+                print()
+                print(r)
+
+
+#--  Batch parsing  ------------------------------------------------------------
+
+##  The result of parsing one sentence in a batch.
+
+class BatchResult (object):
+
+    ##  Constructor.
+
+    def __init__ (self, index, sent, trees=None, ntrees=0, nnodes=0, nedges=0,
+                  time=0, error=None, hits=0, misses=0):
+
+        ##  Position of the sentence in the batch.
+        self.index = index
+
+        ##  The sentence.
+        self.sent = sent
+
+        ##  The list of trees, if requested and there was a parse.
+        self.trees = trees
+
+        ##  The number of trees.
+        self.ntrees = ntrees
+
+        ##  The number of nodes in the chart.
+        self.nnodes = nnodes
+
+        ##  The number of edges created.
+        self.nedges = nedges
+
+        ##  Wall time in seconds.
+        self.time = time
+
+        ##  Error message, if parsing signalled an error.
+        self.error = error
+
+        ##  Unification cache hits while parsing this sentence.
+        self.hits = hits
+
+        ##  Unification cache misses while parsing this sentence.
+        self.misses = misses
+
+    ##  String representation.
+
+    def __str__ (self):
+        return '[%d] trees=%d nodes=%d edges=%d hits=%d misses=%d time=%s' % \
+            (self.index, self.ntrees, self.nnodes, self.nedges,
+             self.hits, self.misses, timestr(self.time))
+
+
+##  Parses the sentences of a batch, one at a time, with a given parser.
+#   If keep_errors is true, an exception signalled while parsing a sentence
+#   is recorded in the result's error, and the batch continues; otherwise it
+#   propagates.
+
+class BatchWorker (object):
+
+    ##  Constructor.
+
+    def __init__ (self, parser, trees=True, keep_errors=False):
+
+        ##  The parser.
+        self.parser = parser
+
+        ##  Whether to return trees.
+        self.trees = trees
+
+        ##  Whether to record errors rather than signalling them.
+        self.keep_errors = keep_errors
+
+    ##  Parse one (index, sent) pair.  Returns a BatchResult.
+
+    def __call__ (self, item):
+        (i, sent) = item
+        p = self.parser
+        (h0, m0) = _cache_stats(p)
+        t0 = time()
+        if self.keep_errors:
+            try:
+                (trees, ntrees) = self.parse(sent)
+            except Exception as e:
+                return BatchResult(i, sent, time=time() - t0, error=str(e))
+        else:
+            (trees, ntrees) = self.parse(sent)
+        t = time() - t0
+        (h1, m1) = _cache_stats(p)
+        (nnodes, nedges) = p.chart_size()
+        return BatchResult(i, sent, trees, ntrees, nnodes, nedges, t,
+                           hits=h1 - h0, misses=m1 - m0)
+
+    ##  Parse a sentence.  Returns (trees, ntrees).  Whatever the parser's
+    #   options, the trees are a list, or None if there is no parse or
+    #   trees were not requested.  A Forest's trees are counted without
+    #   extracting them, and extracted only if trees were requested.
+
+    def parse (self, sent):
+        p = self.parser
+        trees = p(sent)
+        if trees is None:
+            return (None, 0)
+        if isinstance(trees, Forest):
+            ntrees = trees.count()
+            if self.trees: trees = trees.trees(p.limit)
+            else: trees = None
+        else:
+            if not isinstance(trees, list): trees = list(trees)
+            ntrees = len(trees)
+            if not self.trees: trees = None
+        return (trees, ntrees)
+
+def _cache_stats (p):
+    codec = getattr(p.grammar, 'codec', None)
+    if codec is None: return (0, 0)
+    else: return codec.cache_stats()
+
+##  The BatchWorker of a worker process.  Set by _batch_init, which the
+#   process pool calls once in each worker.  Not used when parsing in
+#   the calling process.
+
+_batch_worker = None
+
+def _batch_init (factory, grammar, options, trees, keep_errors):
+    global _batch_worker
+    _batch_worker = BatchWorker(factory(grammar, **options), trees, keep_errors)
+
+def _batch_parse1 (item):
+    return _batch_worker(item)
+
+##  Parses a list of sentences and yields a BatchResult for each, in input
+#   order.  Sentences may be strings or lists of words.  If nworkers is 1,
+#   parsing is done in this process.  Otherwise the sentences are
+#   distributed over a ProcessPoolExecutor with nworkers processes (None
+#   means one per CPU).  Each worker loads the grammar once, so the grammar
+#   must be given as a filename or a Grammar that has one.  If trees is
+#   false, only the counts are returned, which saves pickling trees.
+#   The parser is created by calling factory (by default, Parser) on the
+#   grammar and the keyword arguments in options (see Parser.options()).
+#   An exception signalled while parsing a sentence propagates, unless
+#   keep_errors is true, in which case it is recorded in the result.
+
+def batch_parse (grammar, sents, nworkers=None, trees=True, chunksize=1,
+                 factory=None, options=None, keep_errors=False):
+    if factory is None: factory = Parser
+    if options is None: options = {}
+    items = list(enumerate(sents))
+    if nworkers == 1:
+        worker = BatchWorker(factory(grammar, **options), trees, keep_errors)
+        for item in items:
+            yield worker(item)
+    else:
+        if not isinstance(grammar, (str, os.PathLike)):
+            if grammar.filename is None:
+                raise Exception('Grammar must have a filename for parallel parsing')
+            grammar = grammar.filename
+        grammar = os.fspath(grammar)
+        with ProcessPoolExecutor(nworkers, initializer=_batch_init,
+                                 initargs=(factory, grammar, options, trees, keep_errors)) as pool:
+            for r in pool.map(_batch_parse1, items, chunksize=chunksize):
+                yield r
+
+
+##  Iterates over the sentences in a batch file.  Blank lines and lines
+#   beginning with '#' are skipped, and a leading '*' (marking an
+#   ungrammatical sentence) is removed.
+
+def batch_sents (batchfile):
+    with open(batchfile) as f:
+        for line in f:
+            sent = line.strip()
+            if (not sent) or sent.startswith('#'): continue
+            if sent.startswith('*'): sent = sent[1:].strip()
+            yield sent
+
+
+##  Parses each sentence in a Tester batch file with and without the
+#   left-corner filter, and prints the chart size (nodes and edges) and wall
+#   time for each.  The grammar is a filename or Grammar; the batch file
+#   defaults to the grammar name plus '.sents', as for Tester.  Returns a list
+#   of rows (sent, nodes, edges, time, filtered nodes, filtered edges,
+#   filtered time).
+
+def benchmark (grammar, batchfile=None, file=None):
+    if not isinstance(grammar, Grammar):
+        if batchfile is None: batchfile = grammar + '.sents'
+        grammar = Grammar(grammar)
+    elif batchfile is None:
+        batchfile = grammar.filename + '.sents'
+    parsers = [Parser(grammar), Parser(grammar, filter=True, forest=True)]
+    rows = []
+    print('%5s %6s %6s %12s %6s %6s %12s' %
+          ('words', 'nodes', 'edges', 'time', 'nodes', 'edges', 'filtered'), file=file)
+    for sent in batch_sents(batchfile):
+        row = [sent]
+        for p in parsers:
+            t0 = time()
+            p(sent)
+            t = time() - t0
+            row.extend(p.chart_size())
+            row.append(t)
+        rows.append(tuple(row))
+        print('%5d %6d %6d %12s %6d %6d %12s' %
+              (len(sent.split()), row[1], row[2], timestr(row[3]),
+               row[4], row[5], timestr(row[6])), '', sent, file=file)
+    return rows
@@ -8,8 +8,8 @@ from random import Random
 from collections import namedtuple
 
 from ..pyx.disk import VDisk
-from .grammar import Grammar as SelkieGrammar
-from .parser import Parser as _SelkieParser
+from ..nlp.grammar import Grammar as SelkieGrammar
+from ..nlp.parser import Parser as _SelkieParser, batch_parse
 
 
 #--  GDev  ---------------------------------------------------------------------
@@ -88,6 +88,8 @@ class BaseParser (object):
     def __init__ (self, gdev, parser):
         self.gdev = gdev
         self._parser = parser
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     def grammar (self):
         return self.gdev.grammar
@@ -107,6 +109,9 @@ class BaseParser (object):
     def count (self, sent):
         return len(self.parses(sent))
 
+    def counts (self, sents, nworkers=1):
+        return [self.count(sent) for sent in sents]
+
     def batch (self, sents=None):
         if sents is None:
             sents = self.gdev.sents
@@ -132,8 +137,8 @@ class BaseParser (object):
             else:
                 print('-', word)
 
-    def evaluate (self):
-        return SyntacticEvaluator(self.gdev)()
+    def evaluate (self, nworkers=1):
+        return SyntacticEvaluator(self.gdev, nworkers)()
 
 
 class NLTKParser (BaseParser):
@@ -171,6 +176,19 @@ class SelkieParser (BaseParser):
     def parses (self, sent):
         return self._parser(sent) or []
 
+    def counts (self, sents, nworkers=1):
+        words = [self._tosent(sent).words for sent in sents]
+        if nworkers == 1:
+            grammar = self._parser.grammar
+        else:
+            grammar = join(self.gdev.filename, 'grammar')
+        counts = []
+        for r in batch_parse(grammar, words, nworkers, trees=False, factory=_SelkieParser):
+            self.cache_hits += r.hits
+            self.cache_misses += r.misses
+            counts.append(r.ntrees)
+        return counts
+
 
 #--  Sentences  ----------------------------------------------------------------
 
@@ -308,11 +326,13 @@ class Sentences (object):
 
 class SyntaxStats (object):
     
-    def __init__ (self, misses, false_pos, extra, sents):
+    def __init__ (self, misses, false_pos, extra, sents, cache_hits=0, cache_misses=0):
         self.misses = misses
         self.false_pos = false_pos
         self.extra = extra
         self.sents = sents
+        self.cache_hits = cache_hits
+        self.cache_misses = cache_misses
 
     def __str__ (self):
         (fn, fp, x) = (self.misses, self.false_pos, self.extra)
@@ -344,13 +364,21 @@ class SyntaxStats (object):
                   f'                 ',
                   '|',
                   f'Parses/sent: {T/n1:-6.4f}', file=f)
+            nu = self.cache_hits + self.cache_misses
+            if nu:
+                print(f'Cache hits:  {self.cache_hits:-4d}',
+                      '|',
+                      f'Misses:      {self.cache_misses:-4d}',
+                      '|',
+                      f'Hit rate:    {self.cache_hits/nu:-6.4f}', file=f)
             return f.getvalue()
 
 
 class SyntacticEvaluator (object):
         
-    def __init__ (self, res):
+    def __init__ (self, res, nworkers=1):
         self.gdev = res
+        self.nworkers = nworkers
 
     def __call__ (self):
         print(self.stats())
@@ -361,20 +389,20 @@ class SyntacticEvaluator (object):
         sents = res.sents
 
         fp = fn = extra_trees = 0
+        parse.cache_hits = parse.cache_misses = 0
 
-        for sent in sents:
-            ntrees = parse.count(sent)
+        for ntrees in parse.counts(sents, self.nworkers):
             if ntrees > 0:
                 extra_trees += ntrees - 1
             else:
                 fn += 1
 
-        for nonsent in sents.bad:
-            ntrees = parse.count(nonsent)
+        for ntrees in parse.counts(sents.bad, self.nworkers):
             if ntrees > 0:
                 fp += 1
 
-        return SyntaxStats(fn, fp, extra_trees, sents)
+        return SyntaxStats(fn, fp, extra_trees, sents,
+                           parse.cache_hits, parse.cache_misses)
 
 
 #--  Meaning  ------------------------------------------------------------------
@@ -3,7 +3,7 @@ The selkie.com module contains functionality related to command-line processing,
 as well as system commands.
 '''
 
-import sys, subprocess
+import os, sys, subprocess
 from time import time
 from io import StringIO
 from .string import elapsed_time_str
@@ -546,6 +546,52 @@ class Progress (object):
             return f.getvalue()
 
 
+#--  Throughput  ---------------------------------------------------------------
+
+class IndexStats (object):
+    '''
+    Record of an indexing run: how many texts and tokens were read, how
+    long it took, and how many worker processes were used.
+    '''
+
+    ##  Constructor.
+
+    def __init__ (self, ntexts, ntokens, seconds, processes=None, nentries=None):
+
+        ##  Number of texts read.
+        self.ntexts = ntexts
+
+        ##  Number of tokens read.
+        self.ntokens = ntokens
+
+        ##  Elapsed wall-clock time.
+        self.seconds = seconds
+
+        ##  Number of worker processes.
+        self.processes = processes or os.cpu_count()
+
+        ##  Number of index entries written, if the indexer counts them.
+        self.nentries = nentries
+
+    ##  Tokens per second.
+
+    def tokens_per_sec (self):
+        if self.seconds > 0:
+            return self.ntokens / self.seconds
+        else:
+            return float('inf')
+
+    ##  String representation, including the throughput.
+
+    def __str__ (self):
+        entries = '' if self.nentries is None else f', {self.nentries} entries'
+        return (f'{self.ntexts} texts, {self.ntokens} tokens{entries} in {self.seconds:.3f}s '
+                f'({self.tokens_per_sec():.0f} tokens/sec, {self.processes} processes)')
+
+    def __repr__ (self):
+        return f'<IndexStats {self.ntexts} texts, {self.ntokens} tokens>'
+
+
 #--  Manifest  -----------------------------------------------------------------
 #
 #  A manifest is a listing of the files in a directory tree.  The entries are of
@@ -467,8 +467,8 @@ class PLists (Format):
             else: yield '\n'
             for (k,v) in d:
                 if not spacefree(k):
-                    raise Exception(f'Bad key: {repr(key)}')
-                yield k + ' ' + v
+                    raise Exception(f'Bad key: {repr(k)}')
+                yield k + ' ' + v + '\n'
 
 
 #--  Dicts  --------------------------------------------------------------------
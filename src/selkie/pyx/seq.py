@@ -123,12 +123,27 @@ class EditDistance (object):
     and a number greater than 0 if not. The default is 0-1 loss.
     An instance of EditDistance is a function that returns the edit distance
     between two sequences.
+
+    With the default cost function, the distance is computed by Myers'
+    bit-parallel algorithm, treating an integer as a bit vector with one
+    bit per element of the input sequence.  Otherwise the table is
+    filled in one row at a time.  In either case, if *max_distance* is
+    given, the computation stops as soon as the distance is known to
+    exceed it, and the value is ``inf``.  When the table is filled in, each
+    row is also limited to the cells whose cost is within *max_distance*,
+    which, with unit costs, lie in a diagonal band of width
+    2*max_distance*+1.
     '''
 
     def __init__ (self, cost=simple_cost):
         self.cost_function = cost
 
     def table (self, inseq, outseq):
+        '''
+        Returns the full table of EDNodes, in row-major order.  The last
+        node's ``prev`` links lead back to the first node, giving the
+        alignment.
+        '''
         cost = self.cost_function
         m = len(inseq)
         n = len(outseq)
@@ -174,9 +189,159 @@ class EditDistance (object):
     
         return nodes
 
-    def __call__ (self, inseq, outseq):
+    def alignment (self, inseq, outseq):
+        '''
+        Returns a minimum-cost alignment, as a list of pairs (x,y), using
+        the same conventions as the cost function: (x,None) is a deletion,
+        (None,y) is an insertion, and (x,y) is a substitution.
+        '''
         nodes = self.table(inseq, outseq)
-        return nodes[-1].cost
+        pairs = []
+        node = nodes[-1]
+        while node.prev is not None:
+            prev = node.prev
+            x = inseq[prev.i] if prev.i < node.i else None
+            y = outseq[prev.j] if prev.j < node.j else None
+            pairs.append((x, y))
+            node = prev
+        pairs.reverse()
+        return pairs
+
+    def __call__ (self, inseq, outseq, max_distance=None):
+        if self.cost_function is simple_cost:
+            try:
+                peq = _pattern_masks(inseq)
+            except TypeError:
+                pass
+            else:
+                return _myers_distance(peq, len(inseq), outseq, max_distance)
+        return self._row_distance(inseq, outseq, max_distance)
+
+    def distances (self, query, candidates, max_distance=None):
+        '''
+        Returns a list containing the distance from *query* to each of the
+        candidates.  With the default cost function, the bit vectors for
+        *query* are computed only once.
+        '''
+        if self.cost_function is simple_cost:
+            try:
+                peq = _pattern_masks(query)
+            except TypeError:
+                pass
+            else:
+                m = len(query)
+                return [_myers_distance(peq, m, c, max_distance) for c in candidates]
+        return [self._row_distance(query, c, max_distance) for c in candidates]
+
+    # Given max_distance k, only the cells whose cost is at most k matter,
+    # and since costs are nonnegative, they can only be reached from cells
+    # of cost at most k.  Each row is computed from the first cell of the
+    # previous row's active range [lo, hi] to the last cell that is within
+    # k, and the cells outside are inf (Ukkonen 1985).  With unit costs,
+    # the range lies in the band [i-k, i+k].
+
+    def _row_distance (self, inseq, outseq, max_distance):
+        if max_distance is None:
+            return self._full_row_distance(inseq, outseq)
+        cost = self.cost_function
+        n = len(outseq)
+        k = max_distance
+        row = [inf] * (n + 1)
+        row[0] = 0
+        hi = 0
+        for j in range(1, n + 1):
+            c = row[j-1] + cost(None, outseq[j-1])
+            if c > k: break
+            row[j] = c
+            hi = j
+        lo = 0
+        for x in inseq:
+            dcost = cost(x, None)
+            prev = row
+            row = [inf] * (n + 1)
+            (newlo, newhi) = (None, -1)
+            if lo == 0:
+                row[0] = prev[0] + dcost
+                if row[0] <= k: newlo = newhi = 0
+            j = max(lo, 1)
+            while j <= n:
+                y = outseq[j-1]
+                c = row[j-1] + cost(None, y) if row[j-1] <= k else inf
+                if j <= hi:
+                    c = min(c, prev[j] + dcost)
+                if lo <= j - 1 <= hi:
+                    c = min(c, prev[j-1] + cost(x, y))
+                row[j] = c
+                if c <= k:
+                    if newlo is None: newlo = j
+                    newhi = j
+                elif j > hi:
+                    break
+                j += 1
+            if newlo is None:
+                return inf
+            (lo, hi) = (newlo, newhi)
+        if row[n] > k:
+            return inf
+        return row[n]
+
+    def _full_row_distance (self, inseq, outseq):
+        cost = self.cost_function
+        n = len(outseq)
+        row = [0]
+        for y in outseq:
+            row.append(row[-1] + cost(None, y))
+        for x in inseq:
+            dcost = cost(x, None)
+            prev = row
+            row = [prev[0] + dcost]
+            for j in range(1, n + 1):
+                y = outseq[j-1]
+                row.append(min(prev[j-1] + cost(x, y),
+                               prev[j] + dcost,
+                               row[j-1] + cost(None, y)))
+        return row[n]
+
+
+def _pattern_masks (seq):
+    peq = {}
+    bit = 1
+    for x in seq:
+        peq[x] = peq.get(x, 0) | bit
+        bit <<= 1
+    return peq
+
+
+# Myers (1999), in the form given by Hyyro (2001) for global distance.
+# Bit i of the vertical delta vectors (pv, mv) represents the difference
+# between rows i+1 and i of the current column.
+
+def _myers_distance (peq, m, text, max_distance):
+    n = len(text)
+    if max_distance is not None and abs(m - n) > max_distance:
+        return inf
+    if m == 0:
+        return n
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    pv = mask
+    mv = 0
+    score = m
+    for (j, c) in enumerate(text):
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & mask
+        mh = pv & xh
+        if ph & high: score += 1
+        elif mh & high: score -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv
+        if max_distance is not None and score - (n - j - 1) > max_distance:
+            return inf
+    return score
 
 
 #--  Sorted lists  -------------------------------------------------------------
@@ -22,13 +22,8 @@ dev_version = testing_development_version()
 print('Testing development version?', dev_version)
 
 skip = ['nlp/glab.rst',
-        'nlp/fst.rst',
-        'nlp/dp/parser.rst',
-        'nlp/dp/eval.rst',
         'nlp/dp/mst.rst',
-        'nlp/dp/features.rst',
         'nlp/dp/nnproj.rst',
-        'nlp/dp/nivre.rst',
         'nlp/dp/ml/cluster.rst',
         'data/corpora.rst',
         'data/wiktionary.rst',